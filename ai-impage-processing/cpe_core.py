@@ -0,0 +1,746 @@
+"""
+Shared tiling / consensus / aggregation / persistence core for the LLM CPE scripts.
+
+Each individual_image_<ai>.py only declares its prompt, its configuration and a
+provider adapter (see providers.py); everything below is provider-agnostic and
+takes the provider and a RunConfig explicitly, so no script depends on another
+script's module globals.
+"""
+
+import os
+import re
+import json
+import math
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common import profiling
+from cpe_common.cpe_types import canonical_names
+from cpe_common.manifest import config_hash, image_files, pending, scan
+from telemetry import default_metrics_path, log_call
+from tiling import load_image, split_image, run_pyramid, tile_weight, weighted_fraction, weighted_mean
+
+
+@dataclass
+class RunConfig:
+    image_folder: str = "converted_pngs"
+    results_filename: str = "cpe_detection_results.json"
+    tile_grid: int = 4
+    consensus_runs: int = 1
+    positive_tile_threshold: float = 0.10      # image positive if >=10% of tiles are clear CPE
+    early_stress_tile_threshold: float = 0.20  # image early stress if >=20% tiles are early_stress and not CPE+
+    # image confidence = weighted (extent, tile consensus, model confidence), for clear_cpe/healthy
+    # images and for early_stress images
+    confidence_weights: tuple = (0.45, 0.30, 0.25)
+    early_stress_confidence_weights: tuple = (0.40, 0.30, 0.30)
+    max_retries: int = 3
+    retry_delay_seconds: float = 2
+    max_tile_workers: int = 8                  # parallel tile workers per image; lower if you hit rate limits
+    skip_low_detail_tiles: bool = False
+    low_detail_std_threshold: float = 4.0
+    tile_mode: str = "grid"                    # "grid" or "pyramid" (see tiling.py)
+    pyramid_coarse_grid: int = 2
+    pyramid_refine_factor: int = 2
+    pyramid_max_depth: int = 1
+    image_extensions: tuple = (".png", ".jpg", ".jpeg")
+    show_quadrant: bool = False                # add the most affected quadrant to the summary table
+    adopt_unhashed_results: bool = True        # keep results from before hashes were recorded (see run())
+    metrics_filename: str | None = field(default_factory=default_metrics_path)  # per-call telemetry, set CPE_METRICS to enable (see telemetry.py)
+
+
+# ---------------------------------------------------------------------------
+# Normalisation of a single model answer
+# ---------------------------------------------------------------------------
+
+CULTURE_STATES = {
+    "clear_cpe": "clear_cpe", "cpe": "clear_cpe", "positive": "clear_cpe", "clear cpe": "clear_cpe",
+    "early_stress": "early_stress", "early stress": "early_stress", "stressed": "early_stress", "stress": "early_stress",
+}
+
+
+def normalize_culture_state(value) -> str:
+    if value is None:
+        return "healthy"
+    return CULTURE_STATES.get(str(value).strip().lower(), "healthy")
+
+
+def _clamp(value, low: float, high: float, default):
+    if value is None:
+        return default
+    try:
+        return max(low, min(high, float(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+class TileResult:
+    """
+    One model answer for one tile, normalised once when the provider response is parsed.
+    All providers return these; build_tile_consensus reads the attributes directly.
+    """
+    __slots__ = ("culture_state", "cpe_detected", "cpe_types", "viability", "confidence", "full_response_text")
+
+    def __init__(self, culture_state: str = "healthy", cpe_detected: bool = False, cpe_types=(),
+                 viability: float | None = None, confidence: float = 0.0, full_response_text: str = ""):
+        self.culture_state = culture_state
+        self.cpe_detected = cpe_detected
+        self.cpe_types = cpe_types
+        self.viability = viability
+        self.confidence = confidence
+        self.full_response_text = full_response_text
+
+    @classmethod
+    def parse(cls, culture_state=None, cpe_detected=None, cpe_types=None, viability=None,
+              confidence=None, full_response_text=None) -> "TileResult":
+        # binary schemas (Claude, Gemini) only answer cpe_detected
+        if culture_state is None and cpe_detected is not None:
+            culture_state = "clear_cpe" if cpe_detected else "healthy"
+        state = normalize_culture_state(culture_state)
+        return cls(
+            culture_state=state,
+            cpe_detected=bool(cpe_detected) and state == "clear_cpe",
+            cpe_types=canonical_names(cpe_types) if state != "healthy" else [],
+            viability=_clamp(viability, 0.0, 100.0, None),
+            confidence=_clamp(confidence, 0.0, 1.0, 0.0),
+            full_response_text=str(full_response_text or "").strip(),
+        )
+
+    @classmethod
+    def from_mapping(cls, data: dict) -> "TileResult":
+        """From a decoded JSON object; unknown keys (tile_id, visual_reasoning, ...) are ignored."""
+        return cls.parse(**{name: data.get(name) for name in cls.__slots__})
+
+    @classmethod
+    def from_object(cls, obj) -> "TileResult":
+        """From an SDK-parsed structured output (pydantic model) without dumping it to a dict first."""
+        return cls.parse(**{name: getattr(obj, name, None) for name in cls.__slots__})
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"TileResult({self.culture_state}, types={self.cpe_types}, conf={self.confidence:.2f})"
+
+
+# ---------------------------------------------------------------------------
+# Provider calls
+# ---------------------------------------------------------------------------
+
+def call_with_retries(request, config: RunConfig, provider, call, parse, call_info: dict):
+    """
+    Run parse(call(request)) until it succeeds, asking the provider how long to back off.
+    Every attempt is logged to config.metrics_filename with its latency and token usage;
+    call_info carries the image / tile ids and payload size for the record.
+    """
+    last_error = None
+    for attempt in range(1, config.max_retries + 1):
+        start = time.perf_counter()
+        response = None
+        try:
+            with profiling.span("api_call", provider=provider.name, attempt=attempt):
+                response = call(request)
+            with profiling.span("parse"):
+                result = parse(response)
+        except Exception as exc:
+            last_error = exc
+            delay = None
+            if attempt < config.max_retries:
+                delay = provider.retry_delay(exc, attempt, config.retry_delay_seconds)
+            profiling.count("api_retries" if delay is not None else "api_failures")
+            log_attempt(config, provider, call_info, attempt, start, response,
+                        "retry" if delay is not None else "failed", exc)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        log_attempt(config, provider, call_info, attempt, start, response, "ok")
+        return result
+    raise last_error
+
+
+def log_attempt(config: RunConfig, provider, call_info: dict, attempt: int, start: float,
+                response, outcome: str, error: Exception | None = None):
+    tokens_in, tokens_out, cached_tokens = provider.usage(response) if response is not None else (None, None, None)
+    log_call(config.metrics_filename, {
+        "provider": provider.name,
+        "model": provider.model,
+        **call_info,
+        "attempt": attempt,
+        "latency_s": round(time.perf_counter() - start, 3),
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "cached_tokens": cached_tokens,
+        "outcome": outcome,
+        "error": f"{type(error).__name__}: {error}" if error is not None else None,
+    })
+
+
+def call_tile(provider, encoded, config: RunConfig, tile: dict) -> dict:
+    call_info = {
+        "image": tile.get("image_name"),
+        "tile_id": tile["tile_id"],
+        "n_tiles": 1,
+        "bytes_sent": provider.payload_bytes(encoded),
+    }
+    return call_with_retries(encoded, config, provider, provider.call, provider.parse, call_info)
+
+
+def call_tile_batch(provider, encoded_tiles: list[tuple[str, object]], config: RunConfig, tiles: list[dict]) -> dict:
+    call_info = {
+        "image": tiles[0].get("image_name") if tiles else None,
+        "tile_id": ",".join(tile_id for tile_id, _ in encoded_tiles),
+        "n_tiles": len(encoded_tiles),
+        "bytes_sent": sum(provider.payload_bytes(encoded) or 0 for _, encoded in encoded_tiles),
+    }
+    return call_with_retries(encoded_tiles, config, provider, provider.call_batch, provider.parse_batch, call_info)
+
+
+# ---------------------------------------------------------------------------
+# Tile consensus
+# ---------------------------------------------------------------------------
+
+def tile_has_enough_detail(tile_image: Image.Image, config: RunConfig) -> bool:
+    if not config.skip_low_detail_tiles:
+        return True
+    arr = np.asarray(tile_image).astype(np.float32)
+    return float(arr.std()) >= config.low_detail_std_threshold
+
+
+def build_tile_consensus(pass_results: list[TileResult], consensus_runs: int) -> dict:
+    state_votes = Counter(r.culture_state for r in pass_results)
+    majority_state, majority_count = state_votes.most_common(1)[0]
+
+    positive_votes = state_votes["clear_cpe"]
+    early_stress_votes = state_votes["early_stress"]
+    healthy_votes = state_votes["healthy"]
+
+    consensus_strength = majority_count / len(pass_results)
+
+    valid_viabilities = [r.viability for r in pass_results if r.viability is not None]
+    viability_mean = float(np.mean(valid_viabilities)) if valid_viabilities else None
+
+    model_confidence_mean = float(np.mean([r.confidence for r in pass_results]))
+
+    positive_type_counter = Counter()
+    early_stress_type_counter = Counter()
+    for r in pass_results:
+        if r.culture_state == "clear_cpe":
+            positive_type_counter.update(r.cpe_types)
+        elif r.culture_state == "early_stress":
+            early_stress_type_counter.update(r.cpe_types)
+
+    threshold = math.ceil(consensus_runs / 2)
+
+    if majority_state == "clear_cpe" and positive_type_counter:
+        type_counter = positive_type_counter
+    elif majority_state == "early_stress" and early_stress_type_counter:
+        type_counter = early_stress_type_counter
+    else:
+        type_counter = None
+
+    if type_counter:
+        cpe_types = [cpe_type for cpe_type, count in type_counter.most_common() if count >= threshold]
+        if not cpe_types:
+            cpe_types = [type_counter.most_common(1)[0][0]]
+    else:
+        cpe_types = []
+
+    summary = next((r.full_response_text for r in pass_results if r.full_response_text), "")
+
+    return {
+        "tile_state": majority_state,
+        "tile_positive": majority_state == "clear_cpe",
+        "tile_early_stress": majority_state == "early_stress",
+        "positive_votes": positive_votes,
+        "early_stress_votes": early_stress_votes,
+        "healthy_votes": healthy_votes,
+        "consensus_strength": round(consensus_strength, 4),
+        "model_confidence_mean": round(model_confidence_mean, 4),
+        "viability_mean": round(viability_mean, 2) if viability_mean is not None else None,
+        "cpe_types": cpe_types,
+        "summary": summary,
+    }
+
+
+def encode_tile(provider, tile: dict):
+    """
+    Encode a tile once per encoding. Providers that share an encoding (ChatGPT and
+    Grok both send PNG base64) reuse the same payload when a tile is sent to both.
+    """
+    cache = tile.setdefault("encoded", {})
+    if provider.encoding not in cache:
+        with profiling.span("encode", encoding=provider.encoding):
+            cache[provider.encoding] = provider.encode(tile["image"])
+    return cache[provider.encoding]
+
+
+def analyze_tile(provider, tile: dict, config: RunConfig) -> dict:
+    encoded = encode_tile(provider, tile)
+    pass_results = [call_tile(provider, encoded, config, tile) for _ in range(config.consensus_runs)]
+    return build_tile_consensus(pass_results, config.consensus_runs)
+
+
+def process_single_tile(provider, tile: dict, config: RunConfig) -> dict:
+    if not tile_has_enough_detail(tile["image"], config):
+        return {
+            "tile_id": tile["tile_id"],
+            "row": tile["row"],
+            "col": tile["col"],
+            "skipped": True,
+            "reason": "low_detail",
+        }
+
+    tile_result = analyze_tile(provider, tile, config)
+    tile_result["tile_id"] = tile["tile_id"]
+    tile_result["row"] = tile["row"]
+    tile_result["col"] = tile["col"]
+    tile_result["skipped"] = False
+    return tile_result
+
+
+def print_tile_result(tile_result: dict, config: RunConfig):
+    print(
+        f"  {tile_result['tile_id']}: state={tile_result['tile_state']} | "
+        f"clear_cpe_votes={tile_result['positive_votes']}/{config.consensus_runs} | "
+        f"stress_votes={tile_result['early_stress_votes']}/{config.consensus_runs} | "
+        f"conf={tile_result['model_confidence_mean']:.2f} | "
+        f"viability={tile_result['viability_mean'] if tile_result['viability_mean'] is not None else 'null'}"
+    )
+
+
+def analyze_tiles_concurrently(provider, tiles: list[dict], config: RunConfig) -> list[dict]:
+    tile_results = []
+    worker_count = min(config.max_tile_workers, len(tiles)) or 1
+
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        future_to_tile = {
+            executor.submit(process_single_tile, provider, tile, config): tile
+            for tile in tiles
+        }
+
+        for future in as_completed(future_to_tile):
+            tile_id = future_to_tile[future]["tile_id"]
+            try:
+                tile_result = future.result()
+                if tile_result.get("skipped"):
+                    print(f"  Skipping low-detail tile {tile_id}")
+                    continue
+                tile_results.append(tile_result)
+                print_tile_result(tile_result, config)
+            except Exception as exc:
+                print(f"  Tile {tile_id} failed: {exc}")
+
+    return tile_results
+
+
+def analyze_tiles_batched(provider, tiles: list[dict], config: RunConfig) -> list[dict]:
+    """One request per consensus run covering every tile (providers with supports_batch)."""
+    valid_tiles = [t for t in tiles if tile_has_enough_detail(t["image"], config)]
+    if not valid_tiles:
+        return []
+
+    encoded_tiles = [(t["tile_id"], encode_tile(provider, t)) for t in valid_tiles]
+    pass_results_by_tile = {t["tile_id"]: [] for t in valid_tiles}
+
+    for run in range(config.consensus_runs):
+        print(f"    Consensus Run {run + 1}/{config.consensus_runs}...")
+        for tile_id, result in call_tile_batch(provider, encoded_tiles, config, valid_tiles).items():
+            if tile_id in pass_results_by_tile:
+                pass_results_by_tile[tile_id].append(result)
+
+    tile_results = []
+    for tile in valid_tiles:
+        pass_results = pass_results_by_tile[tile["tile_id"]]
+        if not pass_results:
+            continue
+        tile_result = build_tile_consensus(pass_results, config.consensus_runs)
+        tile_result["tile_id"] = tile["tile_id"]
+        tile_result["row"] = tile["row"]
+        tile_result["col"] = tile["col"]
+        tile_result["skipped"] = False
+        tile_results.append(tile_result)
+        print_tile_result(tile_result, config)
+    return tile_results
+
+
+def analyze_tiles(provider, tiles: list[dict], config: RunConfig) -> list[dict]:
+    if provider.supports_batch:
+        tile_results = analyze_tiles_batched(provider, tiles, config)
+    else:
+        tile_results = analyze_tiles_concurrently(provider, tiles, config)
+    tile_results.sort(key=lambda x: (x["row"], x["col"]))
+    return tile_results
+
+
+# ---------------------------------------------------------------------------
+# Image-level aggregation
+# ---------------------------------------------------------------------------
+
+def empty_image_result(message: str) -> dict:
+    return {
+        "culture_state": "healthy",
+        "cpe_detected": False,
+        "cpe_types": None,
+        "cpe_quadrant": None,
+        "viability": None,
+        "confidence": 0,
+        "positive_tiles": 0,
+        "early_stress_tiles": 0,
+        "total_tiles": 0,
+        "positive_tile_fraction": 0,
+        "early_stress_tile_fraction": 0,
+        "full_response_text": message,
+        "tile_results": []
+    }
+
+
+def most_affected_quadrant(positive_tiles: list[dict], grid: int):
+    """1=TL, 2=TR, 3=BL, 4=BR; pyramid tiles use their centre since rows/cols mix resolutions."""
+    if not positive_tiles:
+        return None
+    mid = math.ceil(grid / 2)
+    quad_counts = Counter()
+    for t in positive_tiles:
+        if "center" in t:
+            q_row = 1 if t["center"][1] <= 0.5 else 2
+            q_col = 1 if t["center"][0] <= 0.5 else 2
+        else:
+            q_row = 1 if t["row"] <= mid else 2
+            q_col = 1 if t["col"] <= mid else 2
+        quad_counts[q_row * 2 + q_col - 2] += 1
+    return quad_counts.most_common(1)[0][0]
+
+
+def tile_arrays(tile_results: list[dict]) -> dict:
+    """Per-tile columns as numpy arrays, built once per image; missing viabilities are NaN."""
+    def column(key):
+        return np.array([np.nan if t[key] is None else t[key] for t in tile_results], dtype=float)
+
+    return {
+        "weight": np.array([tile_weight(t) for t in tile_results], dtype=float),
+        "positive": np.array([t["tile_positive"] for t in tile_results], dtype=bool),
+        "early_stress": np.array([t["tile_early_stress"] for t in tile_results], dtype=bool),
+        "viability": column("viability_mean"),
+        "model_confidence": column("model_confidence_mean"),
+        "consensus": column("consensus_strength"),
+    }
+
+
+def strongest_tile_ids(tile_results: list[dict], arrays: dict, mask: np.ndarray, n: int = 3) -> list[str]:
+    """Ids of the n tiles in `mask` with the highest (consensus, model confidence)."""
+    idx = np.flatnonzero(mask)
+    order = np.lexsort((-arrays["model_confidence"][idx], -arrays["consensus"][idx]))
+    return [tile_results[i]["tile_id"] for i in idx[order[:n]]]
+
+
+def aggregate_image_result(tile_results: list[dict], config: RunConfig) -> dict:
+    with profiling.span("aggregate"):
+        return _aggregate_image_result(tile_results, config)
+
+
+def _aggregate_image_result(tile_results: list[dict], config: RunConfig) -> dict:
+    if not tile_results:
+        return empty_image_result("No usable tiles were analyzed.")
+
+    a = tile_arrays(tile_results)
+    weight, positive, early_stress = a["weight"], a["positive"], a["early_stress"]
+
+    total_tiles = len(tile_results)
+    positive_tiles = int(positive.sum())
+    early_stress_tiles = int(early_stress.sum())
+
+    # area-weighted so pyramid tiles of different sizes count by the region they cover;
+    # grid tiles have weight 1, which reduces to the plain tile-count fractions
+    positive_fraction = weighted_fraction(weight, positive)
+    early_stress_fraction = weighted_fraction(weight, early_stress)
+
+    avg_viability = weighted_mean(a["viability"], weight)
+
+    avg_model_confidence = weighted_mean(a["model_confidence"], weight)
+    avg_consensus_strength = weighted_mean(a["consensus"], weight)
+
+    image_positive = positive_fraction >= config.positive_tile_threshold
+    image_early_stress = (not image_positive) and (early_stress_fraction >= config.early_stress_tile_threshold)
+
+    # tile_positive and tile_early_stress are exclusive (one majority state per tile)
+    positive_type_counter = Counter()
+    early_stress_type_counter = Counter()
+    for i in np.flatnonzero(positive):
+        positive_type_counter.update(tile_results[i]["cpe_types"])
+    for i in np.flatnonzero(early_stress):
+        early_stress_type_counter.update(tile_results[i]["cpe_types"])
+
+    if image_positive:
+        culture_state = "clear_cpe"
+        cpe_detected = True
+        cpe_types = [name for name, _ in positive_type_counter.most_common()] if positive_type_counter else None
+    elif image_early_stress:
+        culture_state = "early_stress"
+        cpe_detected = False
+        cpe_types = [name for name, _ in early_stress_type_counter.most_common()] if early_stress_type_counter else None
+    else:
+        culture_state = "healthy"
+        cpe_detected = False
+        cpe_types = None
+
+    positive_consensus = weighted_mean(a["consensus"], weight, positive) if positive_tiles else 0.0
+    positive_model_conf = (
+        weighted_mean(a["model_confidence"], weight, positive)
+        if positive_tiles else avg_model_confidence
+    )
+
+    early_consensus = weighted_mean(a["consensus"], weight, early_stress) if early_stress_tiles else 0.0
+    early_model_conf = (
+        weighted_mean(a["model_confidence"], weight, early_stress)
+        if early_stress_tiles else avg_model_confidence
+    )
+
+    w_extent, w_consensus, w_model = config.confidence_weights
+    if image_positive:
+        extent_score = min(positive_fraction / 0.25, 1.0)
+        confidence = (
+            w_extent * extent_score +
+            w_consensus * positive_consensus +
+            w_model * positive_model_conf
+        )
+    elif image_early_stress:
+        w_extent, w_consensus, w_model = config.early_stress_confidence_weights
+        extent_score = min(early_stress_fraction / 0.35, 1.0)
+        confidence = (
+            w_extent * extent_score +
+            w_consensus * early_consensus +
+            w_model * early_model_conf
+        )
+    else:
+        negative_fraction = 1.0 - positive_fraction
+        confidence = (
+            w_extent * negative_fraction +
+            w_consensus * avg_consensus_strength +
+            w_model * avg_model_confidence
+        )
+
+    confidence = round(float(max(0.0, min(1.0, confidence))), 4)
+
+    if image_positive:
+        strongest_ids = strongest_tile_ids(tile_results, a, positive)
+        summary = (
+            f"Clear CPE detected in {positive_tiles}/{total_tiles} tiles "
+            f"({positive_fraction:.1%}). Most supported positive tiles: {', '.join(strongest_ids)}."
+        )
+    elif image_early_stress:
+        strongest_ids = strongest_tile_ids(tile_results, a, early_stress)
+        summary = (
+            f"Early stress pattern detected in {early_stress_tiles}/{total_tiles} tiles "
+            f"({early_stress_fraction:.1%}) without enough evidence for clear CPE. "
+            f"Most supported stress tiles: {', '.join(strongest_ids)}."
+        )
+    else:
+        summary = (
+            f"No convincing CPE detected across {total_tiles} analyzed tiles. "
+            f"Positive tile fraction was {positive_fraction:.1%} and early-stress tile fraction was {early_stress_fraction:.1%}."
+        )
+
+    return {
+        "culture_state": culture_state,
+        "cpe_detected": cpe_detected,
+        "cpe_types": cpe_types,
+        "cpe_quadrant": most_affected_quadrant([tile_results[i] for i in np.flatnonzero(positive)], config.tile_grid),
+        "viability": round(avg_viability, 2) if avg_viability is not None else None,
+        "confidence": confidence,
+        "positive_tiles": positive_tiles,
+        "early_stress_tiles": early_stress_tiles,
+        "total_tiles": total_tiles,
+        "positive_tile_fraction": round(positive_fraction, 4),
+        "early_stress_tile_fraction": round(early_stress_fraction, 4),
+        "full_response_text": summary,
+        "tile_results": tile_results,
+    }
+
+
+def tag_tiles(tiles: list[dict], image_path: str) -> list[dict]:
+    """Record which image a tile came from, for the per-call telemetry."""
+    image_name = os.path.basename(image_path)
+    for tile in tiles:
+        tile["image_name"] = image_name
+    return tiles
+
+
+def analyze_image(provider, image_path: str, config: RunConfig) -> dict:
+    def analyze_level(tiles):
+        return analyze_tiles(provider, tag_tiles(tiles, image_path), config)
+
+    if config.tile_mode == "pyramid":
+        leaf_results, refined_results = run_pyramid(
+            load_image(image_path),
+            analyze_level,
+            coarse_grid=config.pyramid_coarse_grid,
+            refine_factor=config.pyramid_refine_factor,
+            max_depth=config.pyramid_max_depth,
+        )
+        image_result = aggregate_image_result(leaf_results, config)
+        image_result["coarse_tile_results"] = refined_results
+        return image_result
+
+    tiles = split_image(load_image(image_path), config.tile_grid)
+    return aggregate_image_result(analyze_level(tiles), config)
+
+
+# ---------------------------------------------------------------------------
+# Results I/O
+# ---------------------------------------------------------------------------
+
+def load_existing_results(path: str) -> dict:
+    all_results = {}
+    if os.path.exists(path):
+        load_choice = input(f"'{path}' found. Do you want to load it? (yes/no): ").strip().lower()
+        if load_choice == "yes":
+            with open(path, "r", encoding="utf-8") as f:
+                all_results = json.load(f)
+            print("Loaded previous results. Skipping processed images.")
+        else:
+            print("Starting fresh. All images will be re-uploaded.")
+    return all_results
+
+
+def save_results(path: str, all_results: dict):
+    with profiling.span("write", path=path), open(path, "w", encoding="utf-8") as f:
+        json.dump(all_results, f, indent=4)
+
+
+def print_summary_table(all_results: dict, show_quadrant: bool = False):
+    if not all_results:
+        print("No results to display.")
+        return
+
+    rows = []
+    for image_name, result in all_results.items():
+        rows.append({
+            "Image Name": image_name,
+            "State": result.get("culture_state"),
+            "CPE Detected": result.get("cpe_detected"),
+            **({"Quadrant": result.get("cpe_quadrant")} if show_quadrant else {}),
+            "Confidence": result.get("confidence"),
+            "Positive Tiles": result.get("positive_tiles"),
+            "Stress Tiles": result.get("early_stress_tiles"),
+            "Total Tiles": result.get("total_tiles"),
+            "Viability": result.get("viability"),
+            "CPE Types": ", ".join(result.get("cpe_types") or []) if result.get("cpe_types") else None,
+        })
+
+    df = pd.DataFrame(rows)
+    print(df.to_string(index=False))
+
+
+def list_images(config: RunConfig, manifest: pd.DataFrame | None = None) -> list[str]:
+    """Images to process, from the given scan of config.image_folder (scanned here if None)."""
+    manifest = scan(config.image_folder) if manifest is None else manifest
+    return image_files(manifest, config.image_extensions)
+
+
+TILE_ID = re.compile(r"r(\d+)c(\d+)")
+
+
+def tiled_like(result: dict, config: RunConfig) -> bool:
+    """
+    Whether a stored result's tile ids fit the tiling of `config`: its grid (or the pyramid's
+    coarse grid, refined up to max_depth) with at least one tile in the last row or column.
+    The ensemble writes the per-provider files at its own tiling.
+    """
+    if config.tile_mode == "pyramid":
+        grid, factor, depth = config.pyramid_coarse_grid, config.pyramid_refine_factor, config.pyramid_max_depth
+    else:
+        grid, factor, depth = config.tile_grid, 1, 0
+    at_edge = False
+    for tile in result.get("tile_results") or []:
+        parts = [TILE_ID.fullmatch(part) for part in str(tile.get("tile_id", "")).split("/")]
+        if None in parts or len(parts) > depth + 1:
+            return False
+        row, col = int(parts[0][1]), int(parts[0][2])
+        if max(row, col) > grid or any(max(int(p[1]), int(p[2])) > factor for p in parts[1:]):
+            return False
+        at_edge |= grid in (row, col)
+    return at_edge
+
+
+# settings that change what the model sees or how its answers are aggregated
+RESULT_SETTINGS = (
+    "tile_grid", "consensus_runs", "positive_tile_threshold", "early_stress_tile_threshold",
+    "confidence_weights", "early_stress_confidence_weights",
+    "skip_low_detail_tiles", "low_detail_std_threshold", "tile_mode",
+    "pyramid_coarse_grid", "pyramid_refine_factor", "pyramid_max_depth",
+)
+
+
+def run_config_hash(provider, config: RunConfig) -> str:
+    """Hash of everything a stored result depends on besides the image itself."""
+    settings = {name: getattr(config, name) for name in RESULT_SETTINGS}
+    return config_hash(provider.name, provider.model, provider.prompt, provider.few_shot_examples, settings)
+
+
+def run(provider, config: RunConfig):
+    all_results = load_existing_results(config.results_filename)
+
+    # results carry the image's content hash and the run configuration's hash, so only new or
+    # changed images (or all of them, after a prompt/model/settings change) are sent again
+    manifest = scan(config.image_folder)
+    hashes = dict(zip(manifest["image"], manifest["sha256"]))
+    digest = run_config_hash(provider, config)
+    # results from before hashes were recorded are kept rather than paid for again
+    # (adopt_unhashed_results), unless their tiles show another tiling, e.g. the ensemble's
+    recorded = {name: (result.get("image_sha256"), result.get("config_hash")) for name, result in all_results.items()
+                if result.get("image_sha256") is not None or tiled_like(result, config)}
+    plan = pending(list_images(config, manifest), hashes, recorded, digest, adopt_unhashed=config.adopt_unhashed_results)
+    for filename in plan.up_to_date:
+        print(f"Skipping already processed {filename}")
+    for filename in plan.adopt:
+        all_results[filename].update(image_sha256=hashes[filename], config_hash=digest)
+        print(f"Skipping already processed {filename} (recording its hashes)")
+
+    print(f"Starting image processing with {provider.name} ({provider.model})... 🔬")
+    for filename in plan.run:
+        full_path = os.path.join(config.image_folder, filename)
+        print(f"\nProcessing {filename}...")
+
+        try:
+            image_result = analyze_image(provider, full_path, config)
+            image_result.update(image_sha256=hashes[filename], config_hash=digest)
+            all_results[filename] = image_result
+
+            print(
+                f"Finished {filename}. State: {image_result['culture_state']} | "
+                f"CPE detected: {image_result['cpe_detected']} | "
+                f"confidence={image_result['confidence']:.2f} | "
+                f"positive tiles={image_result['positive_tiles']}/{image_result['total_tiles']} | "
+                f"stress tiles={image_result['early_stress_tiles']}/{image_result['total_tiles']} | "
+                f"viability={image_result['viability'] if image_result['viability'] is not None else 'null'}"
+            )
+
+        except Exception as exc:
+            # no configuration hash: the image is retried on the next run
+            print(f"An error occurred while processing {filename}: {exc}")
+            all_results[filename] = {**empty_image_result(f"Error: {exc}"),
+                                     "image_sha256": hashes[filename], "config_hash": None}
+
+        save_results(config.results_filename, all_results)
+
+    for filename, source in plan.copy.items():
+        stored = all_results.get(source, {})
+        if (stored.get("image_sha256"), stored.get("config_hash")) == (hashes[filename], digest):
+            print(f"{filename} is byte-identical to {source}; reusing its result")
+            all_results[filename] = {**all_results[source], "duplicate_of": source}
+    if plan.adopt or plan.copy:
+        save_results(config.results_filename, all_results)
+
+    print("\nProcessing complete! 🎉")
+    print("\n--- Tabulated CPE Detections ---")
+    print_summary_table(all_results, config.show_quadrant)
+    print(f"\nDictionary of results saved to '{config.results_filename}'")
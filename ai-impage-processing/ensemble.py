@@ -0,0 +1,310 @@
+"""
+Cross-provider ensemble run.
+
+Tiles every image once, encodes each tile once per payload type, and dispatches
+the tiles to all configured providers at the same time (one worker pool per
+provider, sized by that provider's MAX_TILE_WORKERS). Wall time per image is
+therefore roughly that of the slowest provider rather than the sum of all four.
+
+Outputs:
+  - cpe_detection_results_<ai>.json   per-provider aggregates, same format as the
+                                      individual_image_<ai>.py scripts, so
+                                      compare_cpe_results.py can read them as usual.
+                                      They carry the hash of the provider's config
+                                      with the ensemble's tiling, so the individual
+                                      script re-scores them rather than taking them
+                                      as its own when the tiling differs.
+  - cpe_detection_results_ensemble.json
+                                      cross-provider consensus per image; every
+                                      tile record keeps each provider's answer
+
+Usage:
+    python ensemble.py            (API keys in .env, as for the individual scripts)
+"""
+
+import os
+import json
+import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+
+from dotenv import load_dotenv
+
+from cpe_core import (
+    RESULT_SETTINGS,
+    RunConfig,
+    TileResult,
+    build_tile_consensus,
+    config_hash,
+    tag_tiles,
+    process_single_tile,
+    analyze_tiles_batched,
+    aggregate_image_result,
+    empty_image_result,
+    list_images,
+    load_existing_results,
+    pending,
+    run_config_hash,
+    save_results,
+    scan,
+    print_summary_table,
+)
+from tiling import load_image, split_image, run_pyramid
+
+# --- Configuration ---
+load_dotenv()
+
+ENSEMBLE_PROVIDERS = ["chatgpt", "claude", "gemini", "grok"]   # individual_image_<name>.py
+image_folder = "converted_pngs"
+results_filename = "cpe_detection_results_ensemble.json"
+
+# One tiling shared by every provider (the individual scripts use 3 or 4)
+TILE_GRID = 4
+TILE_MODE = "grid"                  # "grid" or "pyramid" — pyramid refines on the ensemble consensus
+PYRAMID_COARSE_GRID = 2
+PYRAMID_REFINE_FACTOR = 2
+PYRAMID_MAX_DEPTH = 1
+POSITIVE_TILE_THRESHOLD = 0.10
+EARLY_STRESS_TILE_THRESHOLD = 0.20
+
+
+def load_members(names: list[str]) -> dict:
+    """name -> (provider, RunConfig) built from each individual_image_<name>.py, tiled the ensemble way."""
+    members = {}
+    for name in names:
+        module = importlib.import_module(f"individual_image_{name}")
+        try:
+            provider = module.make_provider()
+        except Exception as exc:
+            print(f"Skipping {name}: could not create provider ({exc})")
+            continue
+        config = replace(
+            module.make_config(),
+            tile_grid=TILE_GRID,
+            tile_mode=TILE_MODE,
+            pyramid_coarse_grid=PYRAMID_COARSE_GRID,
+            pyramid_refine_factor=PYRAMID_REFINE_FACTOR,
+            pyramid_max_depth=PYRAMID_MAX_DEPTH,
+        )
+        members[name] = (provider, config)
+    return members
+
+
+def cross_provider_consensus(answers: dict) -> dict:
+    """Majority vote across providers, treating each provider's tile verdict as one pass."""
+    pass_results = [
+        TileResult(
+            culture_state=r["tile_state"],
+            cpe_detected=r["tile_positive"],
+            cpe_types=r["cpe_types"],
+            viability=r["viability_mean"],
+            confidence=r["model_confidence_mean"],
+            full_response_text=r["summary"],
+        )
+        for r in answers.values()
+    ]
+    record = build_tile_consensus(pass_results, len(pass_results))
+    record["provider_states"] = {name: r["tile_state"] for name, r in answers.items()}
+    return record
+
+
+def analyze_level(tiles: list[dict], members: dict, executors: dict) -> list[dict]:
+    """Send one level of tiles to every provider concurrently and merge the answers per tile."""
+    futures = {}
+    for name, (provider, config) in members.items():
+        executor = executors[name]
+        if provider.supports_batch:
+            futures[executor.submit(analyze_tiles_batched, provider, tiles, config)] = (name, None)
+        else:
+            for tile in tiles:
+                futures[executor.submit(process_single_tile, provider, tile, config)] = (name, tile["tile_id"])
+
+    answers = {t["tile_id"]: {} for t in tiles}
+    for future in as_completed(futures):
+        name, tile_id = futures[future]
+        try:
+            result = future.result()
+        except Exception as exc:
+            print(f"  {name} {tile_id or 'batch'} failed: {exc}")
+            continue
+        for tile_result in (result if tile_id is None else [result]):
+            if tile_result.get("skipped"):
+                continue
+            answers[tile_result["tile_id"]][name] = tile_result
+
+    records = []
+    for tile in tiles:
+        by_provider = answers[tile["tile_id"]]
+        if not by_provider:
+            continue
+        record = cross_provider_consensus(by_provider)
+        record["tile_id"] = tile["tile_id"]
+        record["row"] = tile["row"]
+        record["col"] = tile["col"]
+        record["skipped"] = False
+        record["providers"] = dict(sorted(by_provider.items()))
+        records.append(record)
+
+        votes = " ".join(f"{name}={state}" for name, state in sorted(record["provider_states"].items()))
+        print(f"  {tile['tile_id']}: ensemble={record['tile_state']} "
+              f"({record['consensus_strength']:.0%} agree) | {votes}")
+    return records
+
+
+def provider_leaf_results(records: list[dict], name: str) -> list[dict]:
+    """One provider's tile results at the ensemble's leaves, carrying the pyramid weights."""
+    leaves = []
+    for record in records:
+        tile_result = record["providers"].get(name)
+        if tile_result is None:
+            continue
+        for key in ("level", "parent_id", "area_fraction", "center"):
+            if key in record:
+                tile_result[key] = record[key]
+        leaves.append(tile_result)
+    return leaves
+
+
+def strip_provider_answers(records: list[dict]) -> list[dict]:
+    """Ensemble tile records keep the per-provider verdicts; full answers live in the per-provider files."""
+    stripped = []
+    for record in records:
+        record = dict(record)
+        record["providers"] = {
+            name: {k: r[k] for k in ("tile_state", "cpe_types", "model_confidence_mean", "viability_mean")}
+            for name, r in record["providers"].items()
+        }
+        stripped.append(record)
+    return stripped
+
+
+def ensemble_config_hash(member_digests: dict, config: RunConfig) -> str:
+    """Hash of the member configurations (with the ensemble's tiling) and the ensemble's own settings."""
+    settings = {name: getattr(config, name) for name in RESULT_SETTINGS}
+    return config_hash("ensemble", member_digests, settings)
+
+
+def main():
+    members = load_members(ENSEMBLE_PROVIDERS)
+    if not members:
+        print("No providers available. Exiting.")
+        return
+
+    ensemble_config = RunConfig(
+        image_folder=image_folder,
+        results_filename=results_filename,
+        tile_grid=TILE_GRID,
+        tile_mode=TILE_MODE,
+        pyramid_coarse_grid=PYRAMID_COARSE_GRID,
+        pyramid_refine_factor=PYRAMID_REFINE_FACTOR,
+        pyramid_max_depth=PYRAMID_MAX_DEPTH,
+        positive_tile_threshold=POSITIVE_TILE_THRESHOLD,
+        early_stress_tile_threshold=EARLY_STRESS_TILE_THRESHOLD,
+        adopt_unhashed_results=False,   # results from before hashes were recorded are scored again
+    )
+
+    ensemble_results = load_existing_results(results_filename)
+    provider_results = {}
+    for name, (_, config) in members.items():
+        if os.path.exists(config.results_filename):
+            with open(config.results_filename, "r", encoding="utf-8") as f:
+                provider_results[name] = json.load(f)
+        else:
+            provider_results[name] = {}
+
+    # same bookkeeping as cpe_core.run: only new or changed images (or all of them after a
+    # configuration change) are sent; every result written carries the hashes it was made under
+    manifest = scan(image_folder)
+    hashes = dict(zip(manifest["image"], manifest["sha256"]))
+    member_digests = {name: run_config_hash(provider, config) for name, (provider, config) in members.items()}
+    digest = ensemble_config_hash(member_digests, ensemble_config)
+    recorded = {name: (result.get("image_sha256"), result.get("config_hash")) for name, result in ensemble_results.items()}
+    plan = pending(list_images(ensemble_config, manifest), hashes, recorded, digest,
+                   adopt_unhashed=ensemble_config.adopt_unhashed_results)
+    for filename in plan.up_to_date:
+        print(f"Skipping already processed {filename}")
+
+    executors = {
+        name: ThreadPoolExecutor(max_workers=max(1, config.max_tile_workers))
+        for name, (_, config) in members.items()
+    }
+
+    print(f"Starting ensemble run with {', '.join(members)}... 🔬")
+    try:
+        for filename in plan.run:
+            full_path = os.path.join(image_folder, filename)
+            print(f"\nProcessing {filename}...")
+
+            try:
+                img = load_image(full_path)
+                level = lambda tiles: analyze_level(tag_tiles(tiles, full_path), members, executors)
+                if TILE_MODE == "pyramid":
+                    records, refined = run_pyramid(
+                        img,
+                        level,
+                        coarse_grid=PYRAMID_COARSE_GRID,
+                        refine_factor=PYRAMID_REFINE_FACTOR,
+                        max_depth=PYRAMID_MAX_DEPTH,
+                    )
+                else:
+                    records, refined = level(split_image(img, TILE_GRID)), []
+
+                for name, (_, config) in members.items():
+                    provider_results[name][filename] = aggregate_image_result(
+                        provider_leaf_results(records, name), config
+                    )
+                    provider_results[name][filename].update(image_sha256=hashes[filename],
+                                                            config_hash=member_digests[name])
+
+                image_result = aggregate_image_result(strip_provider_answers(records), ensemble_config)
+                image_result["provider_verdicts"] = {
+                    name: {
+                        "culture_state": provider_results[name][filename]["culture_state"],
+                        "cpe_detected": provider_results[name][filename]["cpe_detected"],
+                        "confidence": provider_results[name][filename]["confidence"],
+                    }
+                    for name in members
+                }
+                if refined:
+                    image_result["coarse_tile_results"] = strip_provider_answers(refined)
+                image_result.update(image_sha256=hashes[filename], config_hash=digest)
+                ensemble_results[filename] = image_result
+
+                verdicts = " ".join(f"{name}={v['culture_state']}" for name, v in image_result["provider_verdicts"].items())
+                print(f"Finished {filename}. Ensemble: {image_result['culture_state']} | {verdicts}")
+
+            except Exception as exc:
+                # no configuration hash: the image is retried on the next run
+                print(f"An error occurred while processing {filename}: {exc}")
+                ensemble_results[filename] = {**empty_image_result(f"Error: {exc}"),
+                                              "image_sha256": hashes[filename], "config_hash": None}
+
+            save_results(results_filename, ensemble_results)
+            for name, (_, config) in members.items():
+                save_results(config.results_filename, provider_results[name])
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    for filename, source in plan.copy.items():
+        stored = ensemble_results.get(source, {})
+        if (stored.get("image_sha256"), stored.get("config_hash")) != (hashes[filename], digest):
+            continue
+        print(f"{filename} is byte-identical to {source}; reusing its result")
+        ensemble_results[filename] = {**stored, "duplicate_of": source}
+        for name in members:
+            if source in provider_results[name]:
+                provider_results[name][filename] = {**provider_results[name][source], "duplicate_of": source}
+    if plan.copy:
+        save_results(results_filename, ensemble_results)
+        for name, (_, config) in members.items():
+            save_results(config.results_filename, provider_results[name])
+
+    print("\nProcessing complete! 🎉")
+    print("\n--- Ensemble CPE Detections ---")
+    print_summary_table(ensemble_results)
+    print(f"\nEnsemble results saved to '{results_filename}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,14 @@
 # individual_image_grok.py
 
 import os
-import io
-import json
-import math
-import time
-import base64
-from collections import Counter
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-import numpy as np
-import pandas as pd
-from PIL import Image
+
 from dotenv import load_dotenv
-from openai import OpenAI  # Using OpenAI lib for xAI compatibility
-
-# Import shared functions from the original script (assuming same folder)
-from individual_image_chatgpt import (
-    load_existing_results,
-    image_file_to_b64,
-    pil_image_to_b64,
-    build_messages,
-    split_into_tiles,
-    tile_has_enough_detail,
-    normalize_cpe_types,
-    normalize_culture_state,
-    sanitize_model_result,
-    analyze_tile,
-    aggregate_image_result,
-    print_summary_table,
-    process_single_tile,
-)
+
+from cpe_core import RunConfig, run
+from providers import GrokProvider  # OpenAI-compatible xAI endpoint
 
 # --- Configuration ---
 load_dotenv()
-client = OpenAI(api_key=os.getenv("XAI_API_KEY"), base_url="https://api.x.ai/v1")  # xAI endpoint
 
 image_folder = "converted_pngs"
 results_filename = "cpe_detection_results_grok.json"
@@ -49,49 +23,16 @@ RETRY_DELAY_SECONDS = 2
 IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
 MAX_TILE_WORKERS = 8                # parallel tile workers per image; lower if you hit rate limits
 
+# Tiling mode: "grid" or "pyramid" (coarse grid, refine clear_cpe / early_stress tiles; see tiling.py)
+TILE_MODE = "grid"
+PYRAMID_COARSE_GRID = 2
+PYRAMID_REFINE_FACTOR = 2
+PYRAMID_MAX_DEPTH = 1
+
 # Optional: skip tiles that are nearly blank/background
 SKIP_LOW_DETAIL_TILES = False
 LOW_DETAIL_STD_THRESHOLD = 4.0
 
-JSON_SCHEMA = {
-    "type": "json_schema",
-    "json_schema": {
-        "name": "cpe_detection",
-        "schema": {
-            "type": "object",
-            "properties": {
-                "culture_state": {
-                    "type": "string",
-                    "enum": ["healthy", "early_stress", "clear_cpe"]
-                },
-                "cpe_detected": {"type": "boolean"},
-                "cpe_types": {
-                    "type": ["array", "null"],
-                    "items": {"type": "string"}
-                },
-                "viability": {
-                    "type": ["number", "null"]
-                },
-                "confidence": {
-                    "type": "number",
-                    "minimum": 0,
-                    "maximum": 1
-                },
-                "full_response_text": {"type": "string"}
-            },
-            "required": [
-                "culture_state",
-                "cpe_detected",
-                "cpe_types",
-                "viability",
-                "confidence",
-                "full_response_text"
-            ],
-            "additionalProperties": False
-        }
-    }
-}
-
 common_prompt = """
 You are a virology specialist. Your specialty is analyzing light microscope images of Vero E6 cell cultures.
 
@@ -218,110 +159,40 @@ few_shot_examples = [
     }
 ]
 
-def call_model_with_retries(messages):
-    last_error = None
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            response = client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=messages,
-                temperature=0,  # For Grok consistency
-                response_format=JSON_SCHEMA,
-            )
-            parsed = json.loads(response.choices[0].message.content)
-            return sanitize_model_result(parsed)
-        except Exception as exc:
-            last_error = exc
-            if attempt < MAX_RETRIES:
-                time.sleep(RETRY_DELAY_SECONDS * attempt)
-    raise last_error
+
+def make_config() -> RunConfig:
+    return RunConfig(
+        image_folder=image_folder,
+        results_filename=results_filename,
+        tile_grid=TILE_GRID,
+        consensus_runs=CONSENSUS_RUNS,
+        positive_tile_threshold=POSITIVE_TILE_THRESHOLD,
+        early_stress_tile_threshold=EARLY_STRESS_TILE_THRESHOLD,
+        max_retries=MAX_RETRIES,
+        retry_delay_seconds=RETRY_DELAY_SECONDS,
+        max_tile_workers=MAX_TILE_WORKERS,
+        skip_low_detail_tiles=SKIP_LOW_DETAIL_TILES,
+        low_detail_std_threshold=LOW_DETAIL_STD_THRESHOLD,
+        tile_mode=TILE_MODE,
+        pyramid_coarse_grid=PYRAMID_COARSE_GRID,
+        pyramid_refine_factor=PYRAMID_REFINE_FACTOR,
+        pyramid_max_depth=PYRAMID_MAX_DEPTH,
+        image_extensions=IMAGE_EXTENSIONS,
+    )
+
+
+def make_provider() -> GrokProvider:
+    return GrokProvider(
+        model=MODEL_NAME,
+        prompt=common_prompt,
+        few_shot_examples=few_shot_examples,
+        api_key=os.getenv("XAI_API_KEY"),
+    )
+
 
 def main():
-    all_results = load_existing_results(results_filename)
-
-    print("Starting image processing... 🔬")
-    for filename in sorted(os.listdir(image_folder)):
-        if not filename.lower().endswith(IMAGE_EXTENSIONS):
-            continue
-        if filename in all_results:
-            print(f"Skipping already processed {filename}")
-            continue
-
-        full_path = os.path.join(image_folder, filename)
-        print(f"\nProcessing {filename}...")
-
-        try:
-            tiles = split_into_tiles(full_path, grid=TILE_GRID)
-            tile_results = []
-            worker_count = min(MAX_TILE_WORKERS, len(tiles)) or 1
-
-            with ThreadPoolExecutor(max_workers=worker_count) as executor:
-                future_to_tile = {
-                    executor.submit(process_single_tile, tile): tile
-                    for tile in tiles
-                }
-
-                for future in as_completed(future_to_tile):
-                    tile = future_to_tile[future]
-                    tile_id = tile["tile_id"]
-                    try:
-                        tile_result = future.result()
-                        if tile_result is None:
-                            continue
-                        if tile_result.get("skipped"):
-                            print(f"  Skipping low-detail tile {tile_id}")
-                            continue
-
-                        tile_results.append(tile_result)
-                        print(
-                            f"  {tile_id}: state={tile_result['tile_state']} | "
-                            f"clear_cpe_votes={tile_result['positive_votes']}/{CONSENSUS_RUNS} | "
-                            f"stress_votes={tile_result['early_stress_votes']}/{CONSENSUS_RUNS} | "
-                            f"conf={tile_result['model_confidence_mean']:.2f} | "
-                            f"viability={tile_result['viability_mean'] if tile_result['viability_mean'] is not None else 'null'}"
-                        )
-                    except Exception as exc:
-                        print(f"  Tile {tile_id} failed: {exc}")
-
-            tile_results.sort(key=lambda x: (x["row"], x["col"]))
-            image_result = aggregate_image_result(tile_results)
-            all_results[filename] = image_result
-
-            print(
-                f"Finished {filename}. State: {image_result['culture_state']} | "
-                f"CPE detected: {image_result['cpe_detected']} | "
-                f"confidence={image_result['confidence']:.2f} | "
-                f"positive tiles={image_result['positive_tiles']}/{image_result['total_tiles']} | "
-                f"stress tiles={image_result['early_stress_tiles']}/{image_result['total_tiles']} | "
-                f"viability={image_result['viability'] if image_result['viability'] is not None else 'null'}"
-            )
-
-            with open(results_filename, "w", encoding="utf-8") as f:
-                json.dump(all_results, f, indent=4)
-
-        except Exception as exc:
-            print(f"An error occurred while processing {filename}: {exc}")
-            all_results[filename] = {
-                "culture_state": "healthy",
-                "cpe_detected": False,
-                "cpe_types": None,
-                "viability": None,
-                "confidence": 0,
-                "positive_tiles": 0,
-                "early_stress_tiles": 0,
-                "total_tiles": 0,
-                "positive_tile_fraction": 0,
-                "early_stress_tile_fraction": 0,
-                "full_response_text": f"Error: {exc}",
-                "tile_results": []
-            }
-            with open(results_filename, "w", encoding="utf-8") as f:
-                json.dump(all_results, f, indent=4)
-
-    print("\nProcessing complete! 🎉")
-    print("\n--- Tabulated CPE Detections ---")
-    print_summary_table(all_results)
-    print(f"\nDictionary of results saved to '{results_filename}'")
+    run(make_provider(), make_config())
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,453 @@
+"""
+Provider adapters for the LLM CPE pipeline.
+
+Every adapter implements the same three steps for one tile:
+    encode(tile_image)  -> provider-specific image payload
+    call(encoded)       -> raw SDK response
+    parse(response)     -> cpe_core.TileResult, normalised once here
+
+Providers that can analyse several tiles in one request (Gemini) also implement
+call_batch / parse_batch and set supports_batch = True. Adapters that send the
+same payload declare the same `encoding` so a tile is only encoded once for them.
+retry_delay() lets an adapter pick its own back-off for rate limits and overloads.
+usage() and payload_bytes() feed the per-call telemetry (see telemetry.py).
+
+SDKs are imported inside each adapter so only the one being used has to be installed.
+The endpoints can be redirected (e.g. to benchmarks/mock_llm_server.py) with
+OPENAI_BASE_URL, XAI_BASE_URL, ANTHROPIC_BASE_URL and GEMINI_BASE_URL.
+"""
+
+import io
+import os
+import json
+import base64
+import threading
+from typing import Optional, List
+
+from PIL import Image
+from pydantic import BaseModel, Field
+
+from cpe_core import TileResult
+
+# ---------------------------------------------------------------------------
+# Schemas
+# ---------------------------------------------------------------------------
+
+OPENAI_JSON_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "cpe_detection",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "culture_state": {
+                    "type": "string",
+                    "enum": ["healthy", "early_stress", "clear_cpe"]
+                },
+                "cpe_detected": {"type": "boolean"},
+                "cpe_types": {
+                    "type": ["array", "null"],
+                    "items": {"type": "string"}
+                },
+                "viability": {
+                    "type": ["number", "null"]
+                },
+                "confidence": {
+                    "type": "number",
+                    "minimum": 0,
+                    "maximum": 1
+                },
+                "full_response_text": {"type": "string"}
+            },
+            "required": [
+                "culture_state",
+                "cpe_detected",
+                "cpe_types",
+                "viability",
+                "confidence",
+                "full_response_text"
+            ],
+            "additionalProperties": False
+        }
+    }
+}
+
+CPE_TYPE_CHOICES = [
+    "dying cells", "rounding", "vacuolation", "detachment",
+    "granularity", "refractile cells", "syncytium formation",
+    "intranuclear inclusion bodies", "pyknosis", "karyorrhexis",
+]
+
+
+class TileAnalysis(BaseModel):
+    """Structured response for a single image tile (Claude)."""
+    cpe_detected: bool = Field(
+        description="True if any CPE morphology is visible in this tile."
+    )
+    cpe_types: Optional[list[str]] = Field(
+        default=None,
+        description=(
+            "List of detected CPE morphologies from: "
+            + ", ".join(CPE_TYPE_CHOICES)
+            + ". Null if none detected."
+        )
+    )
+    viability: float = Field(
+        ge=0, le=100,
+        description="Estimated percentage of live cells (0=all dead, 100=all alive)."
+    )
+    confidence: float = Field(
+        ge=0.0, le=1.0,
+        description="Your confidence in this assessment (0=uncertain, 1=very confident)."
+    )
+    full_response_text: str = Field(
+        description="Concise summary of morphological findings in this tile."
+    )
+
+
+class TileResultModel(BaseModel):
+    """One tile of a Gemini batch response."""
+    tile_id: str = Field(description="The exact Tile ID provided, e.g., 'r1c1'")
+    visual_reasoning: str = Field(description="Step-by-step visual observations (density, morphology, clustering) before deciding.")
+    cpe_detected: bool = Field(description="True if any form of CPE is detected; otherwise false.")
+    cpe_types: Optional[List[str]] = Field(description="List of detected morphologies, or null.", default=None)
+    viability: Optional[float] = Field(description="Numeric estimate of viability from 0 to 100.", default=None)
+    confidence: float = Field(description="Confidence score from 0.0 to 1.0.")
+    full_response_text: str = Field(description="Concise summary of the visible findings.")
+
+
+class BatchTileResponse(BaseModel):
+    results: List[TileResultModel]
+
+# ---------------------------------------------------------------------------
+# Image encoding helpers
+# ---------------------------------------------------------------------------
+
+def image_file_to_b64(path: str) -> str:
+    with open(path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode("utf-8")
+
+
+def pil_image_to_b64(image: Image.Image) -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def pil_to_b64_under_limit(img: Image.Image, max_bytes: int) -> tuple[str, str]:
+    """(base64, media_type): lossless PNG if it fits, else JPEG at decreasing quality."""
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    if buf.tell() <= max_bytes:
+        return base64.b64encode(buf.getvalue()).decode(), "image/png"
+    for quality in (95, 85, 75, 60):
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality)
+        if buf.tell() <= max_bytes:
+            return base64.b64encode(buf.getvalue()).decode(), "image/jpeg"
+    raise ValueError(f"Tile cannot be compressed below {max_bytes/1e6:.1f} MB")
+
+# ---------------------------------------------------------------------------
+# Adapters
+# ---------------------------------------------------------------------------
+
+class Provider:
+    name = "provider"
+    supports_batch = False
+    encoding = "provider"             # providers with the same encoding can share encoded tiles
+
+    def __init__(self, model: str, prompt: str, few_shot_examples=()):
+        self.model = model
+        self.prompt = prompt
+        self.few_shot_examples = list(few_shot_examples)
+        self._lock = threading.Lock()
+        self._few_shot_cache = None
+
+    def encode(self, tile_image: Image.Image):
+        raise NotImplementedError
+
+    def call(self, encoded):
+        raise NotImplementedError
+
+    def parse(self, response) -> TileResult:
+        raise NotImplementedError
+
+    def call_batch(self, encoded_tiles: list[tuple[str, object]]):
+        raise NotImplementedError(f"{self.name} does not support batched tiles")
+
+    def parse_batch(self, response) -> dict:
+        raise NotImplementedError(f"{self.name} does not support batched tiles")
+
+    def retry_delay(self, exc: Exception, attempt: int, base_delay: float) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up immediately."""
+        return base_delay * attempt
+
+    def usage(self, response) -> tuple:
+        """(tokens_in incl. cached, tokens_out, cached_tokens) from a raw response; None where unknown."""
+        return None, None, None
+
+    def payload_bytes(self, encoded) -> Optional[int]:
+        """Size of an encoded tile as sent to the API."""
+        if isinstance(encoded, tuple):
+            encoded = encoded[0]
+        if isinstance(encoded, (str, bytes)):
+            return len(encoded)
+        return None
+
+    def few_shot(self):
+        """Few-shot payloads are built once per provider instead of once per request."""
+        with self._lock:
+            if self._few_shot_cache is None:
+                self._few_shot_cache = self._build_few_shot()
+            return self._few_shot_cache
+
+    def _build_few_shot(self):
+        return []
+
+
+class ChatGPTProvider(Provider):
+    name = "chatgpt"
+    encoding = "png_b64"
+    api_key_env = "OPENAI_API_KEY"
+    base_url = None
+
+    def __init__(self, model: str, prompt: str, few_shot_examples=(), api_key: str | None = None):
+        super().__init__(model, prompt, few_shot_examples)
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key or os.getenv(self.api_key_env), base_url=self.base_url)
+
+    def encode(self, tile_image: Image.Image) -> str:
+        return pil_image_to_b64(tile_image)
+
+    def _build_few_shot(self):
+        messages = []
+        for example in self.few_shot_examples:
+            image_path = example["image_path"]
+            if not os.path.exists(image_path):
+                print(f"Warning: few-shot example not found, skipping: {image_path}")
+                continue
+
+            example_b64 = image_file_to_b64(image_path)
+            messages.append({
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Example microscopy image and its correct JSON analysis:"},
+                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{example_b64}"}}
+                ]
+            })
+            messages.append({
+                "role": "assistant",
+                "content": json.dumps(example["expected_output"])
+            })
+        return messages
+
+    def build_messages(self, target_image_b64: str):
+        return [
+            {
+                "role": "developer",
+                "content": "You are a virology microscopy expert. Return only valid JSON that matches the provided schema."
+            },
+            *self.few_shot(),
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": self.prompt},
+                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{target_image_b64}"}}
+                ]
+            },
+        ]
+
+    def call(self, encoded: str):
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=self.build_messages(encoded),
+            temperature=0,
+            response_format=OPENAI_JSON_SCHEMA,
+        )
+
+    def parse(self, response) -> TileResult:
+        return TileResult.from_mapping(json.loads(response.choices[0].message.content))
+
+    def usage(self, response) -> tuple:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None, None, None
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details is not None else None
+        return usage.prompt_tokens, usage.completion_tokens, cached
+
+
+class GrokProvider(ChatGPTProvider):
+    """xAI exposes an OpenAI-compatible endpoint, so only the key and base URL differ."""
+    name = "grok"
+    api_key_env = "XAI_API_KEY"
+    base_url = os.getenv("XAI_BASE_URL", "https://api.x.ai/v1")
+
+
+class ClaudeProvider(Provider):
+    name = "claude"
+    encoding = "claude_b64"
+    MAX_IMAGE_BYTES = 4_500_000       # stay well under the 5 MB API limit
+
+    def __init__(self, model: str, prompt: str, few_shot_examples=(), api_key: str | None = None):
+        super().__init__(model, prompt, few_shot_examples)
+        import anthropic
+        self.anthropic = anthropic
+        self.client = anthropic.Anthropic(api_key=api_key or os.getenv("ANTHROPIC_API_KEY"))
+
+    def encode(self, tile_image: Image.Image) -> tuple[str, str]:
+        return pil_to_b64_under_limit(tile_image, self.MAX_IMAGE_BYTES)
+
+    def call(self, encoded: tuple[str, str]):
+        image_b64, media_type = encoded
+        return self.client.messages.parse(
+            model=self.model,
+            max_tokens=1024,
+            temperature=0,
+            system=[
+                {
+                    "type": "text",
+                    "text": self.prompt,
+                    "cache_control": {"type": "ephemeral"},  # cache the long prompt
+                }
+            ],
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                "data": image_b64,
+                            },
+                        },
+                        {
+                            "type": "text",
+                            "text": (
+                                "Analyse this microscopy tile and return the JSON object "
+                                "as specified in the schema."
+                            ),
+                        },
+                    ],
+                }
+            ],
+            output_format=TileAnalysis,   # native structured output — guaranteed schema
+        )
+
+    def parse(self, response) -> TileResult:
+        return TileResult.from_object(response.parsed_output)
+
+    def usage(self, response) -> tuple:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return None, None, None
+        # input_tokens excludes the cached prompt; report the total like the other providers
+        cache_read = usage.cache_read_input_tokens or 0
+        cache_write = usage.cache_creation_input_tokens or 0
+        return usage.input_tokens + cache_read + cache_write, usage.output_tokens, cache_read
+
+    def retry_delay(self, exc: Exception, attempt: int, base_delay: float) -> Optional[float]:
+        if isinstance(exc, self.anthropic.RateLimitError):
+            wait = 60 * attempt
+            print(f"    Rate limit. Waiting {wait}s (attempt {attempt})…")
+            return wait
+        if isinstance(exc, self.anthropic.APIStatusError):
+            if exc.status_code in (500, 529):
+                wait = 30 * attempt
+                print(f"    API {exc.status_code}. Waiting {wait}s (attempt {attempt})…")
+                return wait
+            return None
+        return base_delay * attempt
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+    supports_batch = True
+    encoding = "pil"
+
+    def __init__(self, model: str, prompt: str, few_shot_examples=(), api_key: str | None = None):
+        super().__init__(model, prompt, few_shot_examples)
+        from google import genai
+        from google.genai import types
+        self.types = types
+        # GEMINI_BASE_URL redirects the client, e.g. to benchmarks/mock_llm_server.py
+        base_url = os.getenv("GEMINI_BASE_URL")
+        http_options = types.HttpOptions(base_url=base_url) if base_url else None
+        self.client = genai.Client(api_key=api_key or os.getenv("GOOGLE_API_KEY"), http_options=http_options)
+
+    def encode(self, tile_image: Image.Image) -> Image.Image:
+        # the SDK accepts PIL images directly and handles the upload encoding
+        return tile_image
+
+    def payload_bytes(self, encoded: Image.Image) -> int:
+        # the SDK uploads PIL images as PNG
+        buffer = io.BytesIO()
+        encoded.save(buffer, format="PNG")
+        return buffer.tell()
+
+    def _build_few_shot(self):
+        contents = []
+        for example in self.few_shot_examples:
+            image_path = example["image_path"]
+            if os.path.exists(image_path):
+                img = Image.open(image_path).convert("RGB")
+                contents.extend(["Example Tile:", img, "Correct JSON Output for this Example Tile:"])
+
+                example_out = example["expected_output"].copy()
+                example_out["tile_id"] = "example_1"
+                example_out["visual_reasoning"] = "Observed specific cellular structures matching the final output."
+                contents.append(json.dumps([example_out]))
+        return contents
+
+    def build_batch_contents(self, encoded_tiles: list[tuple[str, object]]):
+        """Constructs a multimodal payload of interleaved text and PIL Images."""
+        contents = [
+            "You are analyzing a batch of tiles cropped from a larger cell culture image. "
+            "For each tile provided below, perform your analysis and return the results in the requested JSON array.",
+            *self.few_shot(),
+            "Now, perform the analysis on the following target tiles:",
+        ]
+        for tile_id, image in encoded_tiles:
+            contents.extend([f"Tile ID: {tile_id}", image])
+        return contents
+
+    def call_batch(self, encoded_tiles: list[tuple[str, object]]):
+        return self.client.models.generate_content(
+            model=self.model,
+            contents=self.build_batch_contents(encoded_tiles),
+            config=self.types.GenerateContentConfig(
+                system_instruction=self.prompt,
+                response_mime_type="application/json",
+                response_schema=BatchTileResponse,
+                temperature=0.0,
+            )
+        )
+
+    def parse_batch(self, response) -> dict:
+        parsed = getattr(response, "parsed", None)
+        if isinstance(parsed, BatchTileResponse):
+            # the SDK already validated the schema; read the models instead of re-decoding the JSON
+            return {res.tile_id: TileResult.from_object(res) for res in parsed.results}
+        return {
+            res.get("tile_id"): TileResult.from_mapping(res)
+            for res in json.loads(response.text).get("results", [])
+        }
+
+    def usage(self, response) -> tuple:
+        meta = getattr(response, "usage_metadata", None)
+        if meta is None:
+            return None, None, None
+        # thinking tokens are billed as output
+        tokens_out = (meta.candidates_token_count or 0) + (meta.thoughts_token_count or 0)
+        return meta.prompt_token_count, tokens_out, meta.cached_content_token_count
+
+    def call(self, encoded):
+        return self.call_batch([("r1c1", encoded)])
+
+    def parse(self, response) -> TileResult:
+        results = list(self.parse_batch(response).values())
+        if not results:
+            raise ValueError("Gemini returned no tile results")
+        return results[0]
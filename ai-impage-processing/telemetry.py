@@ -0,0 +1,140 @@
+"""
+Per-call telemetry for the LLM CPE scripts.
+
+Off unless the CPE_METRICS environment variable is set ("1" means
+llm_call_metrics.jsonl in the working directory, anything else is the path).
+cpe_core.call_with_retries then appends one JSON line per API attempt to
+RunConfig.metrics_filename, which defaults to that path:
+
+    CPE_METRICS=1 python individual_image_claude.py
+
+    ts, provider, model, image, tile_id, n_tiles, attempt, latency_s,
+    tokens_in, tokens_out, cached_tokens, bytes_sent, outcome, error
+
+tokens_in counts every input token including cached ones; cached_tokens is the
+cached part of it. bytes_sent is the size of the tile payload(s), not the
+prompt or few-shot examples. outcome is "ok", "retry" (failed, will retry) or
+"failed" (gave up).
+
+Summary (p50/p95 latency, throughput, tokens and cost per image):
+    python telemetry.py [llm_call_metrics.jsonl] [--per-image]
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+
+import pandas as pd
+
+# USD per million tokens: (input, output, cached input). Check the providers'
+# price pages before quoting costs; unknown models are reported without cost.
+PRICES_PER_MTOK = {
+    "gpt-4o": (2.50, 10.00, 1.25),
+    "claude-opus-4-6": (5.00, 25.00, 0.50),
+    "gemini-3.1-pro-preview": (2.00, 12.00, 0.20),
+    "grok-4.2": (3.00, 15.00, 0.75),
+}
+
+ENV = "CPE_METRICS"
+DEFAULT_METRICS = "llm_call_metrics.jsonl"
+
+_write_lock = threading.Lock()
+
+
+def default_metrics_path() -> str | None:
+    """Telemetry file named by CPE_METRICS, or None (no telemetry) when it is not set."""
+    value = os.environ.get(ENV)
+    if not value:
+        return None
+    return DEFAULT_METRICS if value == "1" else value
+
+
+def log_call(path: str | None, record: dict):
+    """Append one call record; tile workers share the file, so writes are serialised."""
+    if not path:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), **record})
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def load_metrics(path: str) -> pd.DataFrame:
+    df = pd.read_json(path, lines=True)
+    for col in ("tokens_in", "tokens_out", "cached_tokens", "bytes_sent"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def call_cost(row) -> float:
+    prices = PRICES_PER_MTOK.get(row["model"])
+    if prices is None or pd.isna(row["tokens_in"]):
+        return float("nan")
+    price_in, price_out, price_cached = prices
+    cached = 0 if pd.isna(row["cached_tokens"]) else row["cached_tokens"]
+    tokens_out = 0 if pd.isna(row["tokens_out"]) else row["tokens_out"]
+    return ((row["tokens_in"] - cached) * price_in + cached * price_cached + tokens_out * price_out) / 1e6
+
+
+def summarize(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per provider/model."""
+    df = df.assign(cost_usd=df.apply(call_cost, axis=1))
+    rows = []
+    for (provider, model), group in df.groupby(["provider", "model"], sort=True):
+        ok = group[group["outcome"] == "ok"]
+        wall_s = group["ts"].max() - (group["ts"] - group["latency_s"]).min()
+        images = group["image"].nunique()
+        rows.append({
+            "provider": provider,
+            "model": model,
+            "calls": len(group),
+            "retries": int((group["attempt"] > 1).sum()),
+            "failed": int((group["outcome"] == "failed").sum()),
+            "p50_latency_s": round(ok["latency_s"].quantile(0.50), 2) if len(ok) else None,
+            "p95_latency_s": round(ok["latency_s"].quantile(0.95), 2) if len(ok) else None,
+            "tiles_per_min": round(ok["n_tiles"].sum() / wall_s * 60, 1) if wall_s > 0 else None,
+            "images": images,
+            "tokens_in": int(group["tokens_in"].sum()),
+            "tokens_out": int(group["tokens_out"].sum()),
+            "cached_tokens": int(group["cached_tokens"].sum()),
+            "mb_sent": round(group["bytes_sent"].sum() / 1e6, 2),
+            "cost_usd": round(group["cost_usd"].sum(min_count=1), 4),
+            "cost_per_image_usd": round(group["cost_usd"].sum(min_count=1) / images, 4) if images else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def summarize_per_image(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.assign(cost_usd=df.apply(call_cost, axis=1))
+    return (
+        df.groupby(["provider", "image"], sort=True)
+        .agg(
+            calls=("attempt", "size"),
+            retries=("attempt", lambda a: int((a > 1).sum())),
+            latency_s=("latency_s", "sum"),
+            tokens_in=("tokens_in", "sum"),
+            tokens_out=("tokens_out", "sum"),
+            cost_usd=("cost_usd", lambda c: round(c.sum(min_count=1), 4)),
+        )
+        .reset_index()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise LLM call telemetry.")
+    parser.add_argument("metrics", nargs="?", default=DEFAULT_METRICS)
+    parser.add_argument("--per-image", action="store_true", help="also print one row per provider and image")
+    args = parser.parse_args()
+
+    df = load_metrics(args.metrics)
+    print(f"{len(df)} calls in '{args.metrics}'\n")
+    print(summarize(df).to_string(index=False))
+    if args.per_image:
+        print()
+        print(summarize_per_image(df).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
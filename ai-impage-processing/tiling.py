@@ -0,0 +1,182 @@
+"""
+Tiling helpers for the LLM CPE pipeline (used by cpe_core.py).
+
+Two modes are supported:
+  grid     — the original fixed TILE_GRID x TILE_GRID split
+  pyramid  — coarse-to-fine: analyse a coarse grid first, then subdivide only
+             the tiles whose state is in REFINE_STATES (clear_cpe / early_stress)
+             until max_depth is reached. Healthy regions stay coarse, so mostly
+             healthy cultures need far fewer API calls.
+
+Pyramid tile results carry their area fraction of the full image, and the
+aggregation helpers below weight by it; they work on the per-image arrays that
+cpe_core builds. Grid tiles carry no area fraction and count as weight 1, so
+grid-mode aggregation is unchanged.
+
+load_image() reads from the packed image cache (cpe_common/image_cache.py) when it
+holds an up-to-date copy of the file; 8-bit grayscale is all the cache stores, and
+its RGB conversion is the same as that of the decoded PNG.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common import profiling
+from cpe_common.image_cache import default_cache
+
+REFINE_STATES = ("clear_cpe", "early_stress")
+USE_IMAGE_CACHE = True
+
+
+def load_image(image_path: str) -> Image.Image:
+    with profiling.span("decode", image=os.path.basename(image_path)):
+        if USE_IMAGE_CACHE:
+            pixels = default_cache().get(os.path.basename(image_path), source=image_path)
+            if pixels is not None:
+                return Image.fromarray(pixels).convert("RGB")
+        return Image.open(image_path).convert("RGB")
+
+
+def split_image(img: Image.Image, grid: int, box=None, parent: dict | None = None) -> list[dict]:
+    """
+    Split `box` (left, top, right, bottom) of `img` into a grid x grid set of tiles.
+    With no parent this is the plain grid split; with a parent the children get
+    hierarchical ids (e.g. 'r1c2/r2c1') and row/col at the finer resolution.
+    """
+    width, height = img.size
+    if box is None:
+        box = (0, 0, width, height)
+    left0, top0, right0, bottom0 = box
+    tile_width = (right0 - left0) // grid
+    tile_height = (bottom0 - top0) // grid
+
+    with profiling.span("tile", grid=grid):
+        tiles = []
+        for row in range(grid):
+            for col in range(grid):
+                left = left0 + col * tile_width
+                top = top0 + row * tile_height
+                right = right0 if col == grid - 1 else left0 + (col + 1) * tile_width
+                bottom = bottom0 if row == grid - 1 else top0 + (row + 1) * tile_height
+                tile = {
+                    "tile_id": f"r{row + 1}c{col + 1}",
+                    "row": row + 1,
+                    "col": col + 1,
+                    "level": 0,
+                    "parent_id": None,
+                    "box": (left, top, right, bottom),
+                    "image": img.crop((left, top, right, bottom)),
+                }
+                if parent is not None:
+                    tile["tile_id"] = f"{parent['tile_id']}/{tile['tile_id']}"
+                    tile["row"] = (parent["row"] - 1) * grid + row + 1
+                    tile["col"] = (parent["col"] - 1) * grid + col + 1
+                    tile["level"] = parent["level"] + 1
+                    tile["parent_id"] = parent["tile_id"]
+                tiles.append(tile)
+        return tiles
+
+
+def _annotate(tile: dict, img_size: tuple[int, int]) -> dict:
+    """Attach the hierarchy/area metadata pyramid tiles need for aggregation."""
+    width, height = img_size
+    left, top, right, bottom = tile["box"]
+    tile["area_fraction"] = ((right - left) * (bottom - top)) / float(width * height)
+    tile["center"] = (
+        round((left + right) / 2 / width, 4),
+        round((top + bottom) / 2 / height, 4),
+    )
+    return tile
+
+
+def tile_state(tile_result: dict) -> str:
+    """Three-state label for a tile result, tolerating the binary (tile_positive only) scripts."""
+    state = tile_result.get("tile_state")
+    if state:
+        return state
+    return "clear_cpe" if tile_result.get("tile_positive") else "healthy"
+
+
+def run_pyramid(
+    img: Image.Image,
+    analyze_tiles,
+    coarse_grid: int = 2,
+    refine_factor: int = 2,
+    max_depth: int = 1,
+    refine_states=REFINE_STATES,
+) -> tuple[list[dict], list[dict]]:
+    """
+    Coarse-to-fine tile analysis.
+
+    `analyze_tiles(tiles)` receives the tiles of one level and returns a list of
+    tile-result dicts (each with 'tile_id'); tiles it drops (e.g. low detail) are
+    treated as not analysed. All tiles of a level are handed over together so the
+    caller can run them concurrently or as one batch request.
+
+    Returns (leaf_results, refined_results): the leaves cover every analysed region
+    at its finest resolution and are what the image verdict is built from; the
+    refined (parent) results are kept for reference only. A refined tile none of
+    whose children came back (all failed or were skipped) stays a leaf, so its
+    region is not lost from the verdict.
+    """
+    level_tiles = split_image(img, coarse_grid)
+
+    leaves, refined = [], []
+    unanswered = {}     # tiles refined at the previous level, until one of their children comes back
+    while level_tiles:
+        for tile in level_tiles:
+            _annotate(tile, img.size)
+        tiles_by_id = {t["tile_id"]: t for t in level_tiles}
+
+        next_level, refining = [], {}
+        for result in analyze_tiles(level_tiles):
+            tile = tiles_by_id.get(result.get("tile_id"))
+            if tile is None:
+                continue
+            for key in ("level", "parent_id", "area_fraction", "center"):
+                result[key] = tile[key]
+            unanswered.pop(tile["parent_id"], None)
+
+            if tile["level"] < max_depth and tile_state(result) in refine_states:
+                refined.append(result)
+                refining[tile["tile_id"]] = result
+                next_level.extend(split_image(img, refine_factor, box=tile["box"], parent=tile))
+            else:
+                leaves.append(result)
+
+        for result in unanswered.values():
+            refined.remove(result)
+            leaves.append(result)
+        unanswered = refining
+        level_tiles = next_level
+
+    leaves.sort(key=lambda t: t["tile_id"])
+    return leaves, refined
+
+
+def tile_weight(tile_result: dict) -> float:
+    return float(tile_result.get("area_fraction", 1.0))
+
+
+def weighted_fraction(weights: np.ndarray, mask: np.ndarray) -> float:
+    """Area-weighted fraction of tiles where `mask` is set (plain count fraction for grid tiles)."""
+    total = weights.sum()
+    if total <= 0:
+        return 0.0
+    return float(weights[mask].sum() / total)
+
+
+def weighted_mean(values: np.ndarray, weights: np.ndarray, mask: np.ndarray | None = None):
+    """Area-weighted mean of `values` over tiles in `mask` where the value is not NaN; None if there are none."""
+    keep = ~np.isnan(values)
+    if mask is not None:
+        keep &= mask
+    total = weights[keep].sum()
+    if not keep.any() or total <= 0:
+        return None
+    return float((weights[keep] * values[keep]).sum() / total)
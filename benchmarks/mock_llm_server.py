@@ -0,0 +1,350 @@
+"""
+Local HTTP stand-in for the three LLM APIs, replaying the recorded tile answers in
+ai-results/cpe_detection_results_<ai>.json.
+
+    POST /v1/chat/completions                    OpenAI-compatible (ChatGPT; Grok if the model is grok-*)
+    POST /v1/messages                            Anthropic messages (Claude)
+    POST /v1beta/models/<model>:generateContent  Gemini, one or several "Tile ID: ..." tiles per request
+    GET  /stats                                  requests, replayed / fallback answers, injected 429s
+
+The tile image of a request is decoded and its pixels hashed. If they match a tile
+of a recorded image (the image under --images cut with the grid of the recording),
+that tile's recorded answer is returned, so a run over converted_pngs replays the
+paper's results tile by tile. Any other tile (synthetic images, pyramid tiles)
+gets an answer drawn from the same recording by the hash: deterministic, and with
+the recording's mix of states.
+
+Responses carry the usage block each API reports (input, output and cached tokens,
+with a repeated prompt prefix counted as cached) and x-mock-* headers. --latency
+and --jitter delay every response. --error-rate injects random 429s and
+--rate-limit enforces requests/s with a token bucket; both use the provider's own
+error body and a retry-after header.
+
+    python benchmarks/mock_llm_server.py --port 8765 --latency 0.8 --jitter 0.4 --error-rate 0.02
+
+Point the scripts at it through the SDKs' base-URL settings:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+    XAI_BASE_URL=http://127.0.0.1:8765/v1
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765
+    GEMINI_BASE_URL=http://127.0.0.1:8765
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+sys.path[:0] = [str(BENCH_DIR), str(REPO_ROOT), str(REPO_ROOT / "ai-impage-processing")]
+
+from mock_providers import TokenBucket
+from tiling import load_image, split_image
+
+RECORDINGS = {ai: REPO_ROOT / "ai-results" / f"cpe_detection_results_{ai}.json"
+              for ai in ("chatgpt", "claude", "gemini", "grok")}
+GRID_TILE_ID = re.compile(r"r(\d+)c(\d+)")
+GEMINI_PATH = re.compile(r"/v1beta/models/(?P<model>[^/:]+):generateContent")
+
+
+def pixel_hash(img: Image.Image) -> str:
+    return hashlib.sha1(np.asarray(img.convert("RGB")).tobytes()).hexdigest()
+
+
+def decode_image(data: str) -> Image.Image:
+    return Image.open(io.BytesIO(base64.b64decode(data)))
+
+
+def recorded_answer(tile: dict) -> dict:
+    """The fields a model returns for one tile, from a recorded tile result."""
+    state = tile.get("tile_state") or ("clear_cpe" if tile.get("tile_positive") else "healthy")
+    return {
+        "culture_state": state,
+        "cpe_detected": state == "clear_cpe",
+        "cpe_types": tile.get("cpe_types") or [],
+        "viability": tile.get("viability_mean"),
+        "confidence": tile.get("model_confidence_mean", tile.get("model_confidence")) or 0.5,
+        "full_response_text": tile.get("summary") or "",
+    }
+
+
+class Recording:
+    """Recorded tile answers of one AI, indexed by the tile's pixels (built on first use)."""
+
+    def __init__(self, path: Path, images: Path):
+        with open(path, "r", encoding="utf-8") as f:
+            self.results = json.load(f)
+        self.images = images
+        self.pool = [recorded_answer(t) for r in self.results.values() for t in r.get("tile_results") or []]
+        self.by_pixels = None
+        self._lock = threading.Lock()
+
+    def _index(self) -> dict:
+        index = {}
+        for name, result in self.results.items():
+            tiles = {t["tile_id"]: t for t in result.get("tile_results") or [] if GRID_TILE_ID.fullmatch(t["tile_id"])}
+            if not tiles or not (self.images / name).exists():
+                continue
+            grid = max(int(GRID_TILE_ID.fullmatch(tile_id)[1]) for tile_id in tiles)
+            for cut in split_image(load_image(str(self.images / name)), grid):
+                if cut["tile_id"] in tiles:
+                    index[pixel_hash(cut["image"])] = recorded_answer(tiles[cut["tile_id"]])
+        return index
+
+    def answer(self, img: Image.Image) -> tuple[dict, bool]:
+        """(answer, replayed): the recorded answer for this tile, or one drawn from the pool by its hash."""
+        with self._lock:
+            if self.by_pixels is None:
+                self.by_pixels = self._index()
+        digest = pixel_hash(img)
+        if digest in self.by_pixels:
+            return self.by_pixels[digest], True
+        return self.pool[int(digest, 16) % len(self.pool)], False
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, images=REPO_ROOT / "converted_pngs", latency=0.0, jitter=0.0,
+                 error_rate=0.0, rate_limit=0.0, seed=0, verbose=False):
+        super().__init__(address, Handler)
+        self.recordings = {ai: Recording(path, Path(images)) for ai, path in RECORDINGS.items() if path.exists()}
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.random = random.Random(seed)
+        self.verbose = verbose
+        self.seen_prefixes = set()
+        self.stats = {"requests": 0, "tiles": 0, "replayed": 0, "fallback": 0, "rate_limited": 0, "errors_injected": 0}
+        self.lock = threading.Lock()
+
+    def count(self, **increments):
+        with self.lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def throttle(self) -> float | None:
+        """Seconds the client should wait if this request gets a 429, else None."""
+        if self.bucket is not None:
+            wait = self.bucket.take()
+            if wait:
+                self.count(rate_limited=1)
+                return wait
+        with self.lock:
+            injected = self.random.random() < self.error_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if injected:
+            self.count(errors_injected=1)
+            return 1.0
+        time.sleep(delay)
+        return None
+
+    def cached_tokens(self, prefix: str, tokens: int) -> int:
+        """Prompt caching: a prompt prefix seen before counts as cached."""
+        digest = hashlib.sha1(prefix.encode()).hexdigest()
+        with self.lock:
+            if digest in self.seen_prefixes:
+                return tokens
+            self.seen_prefixes.add(digest)
+            return 0
+
+
+def text_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: MockServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def send_json(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(200, self.server.stats)
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            api = "openai"
+        elif path.endswith("/messages"):
+            api = "anthropic"
+        elif (match := GEMINI_PATH.search(path)):
+            api, body["model"] = "gemini", match["model"]
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        self.server.count(requests=1)
+        wait = self.server.throttle()
+        if wait is not None:
+            self.rate_limited(api, wait)
+            return
+        handler = {"openai": self.chat_completions, "anthropic": self.messages, "gemini": self.generate_content}[api]
+        try:
+            handler(body)
+        except (KeyError, IndexError, ValueError) as exc:
+            self.send_json(400, {"error": {"message": f"Malformed request: {exc}"}})
+
+    def rate_limited(self, api: str, wait: float):
+        message = f"Rate limit exceeded, retry after {wait:.2f}s"
+        body = {
+            "openai": {"error": {"message": message, "type": "requests", "code": "rate_limit_exceeded"}},
+            "anthropic": {"type": "error", "error": {"type": "rate_limit_error", "message": message}},
+            "gemini": {"error": {"code": 429, "message": message, "status": "RESOURCE_EXHAUSTED"}},
+        }[api]
+        self.send_json(429, body, {"retry-after": max(1, round(wait)), "retry-after-ms": int(wait * 1000)})
+
+    def answer(self, ai: str, img: Image.Image) -> dict:
+        answer, replayed = self.server.recordings[ai].answer(img)
+        self.server.count(tiles=1, replayed=int(replayed), fallback=int(not replayed))
+        return answer
+
+    def usage_headers(self, tokens_in: int, tokens_out: int, cached: int) -> dict:
+        return {"x-mock-input-tokens": tokens_in, "x-mock-output-tokens": tokens_out, "x-mock-cached-tokens": cached}
+
+    # OpenAI-compatible chat completions (ChatGPT, Grok) ------------------------------------
+
+    def chat_completions(self, body: dict):
+        model = body.get("model", "")
+        ai = "grok" if model.startswith("grok") else "chatgpt"
+        messages = body["messages"]
+        target = [part for part in messages[-1]["content"] if part.get("type") == "image_url"][-1]
+        img = decode_image(target["image_url"]["url"].split(",", 1)[1])
+        content = json.dumps(self.answer(ai, img))
+
+        prefix = json.dumps(messages[:-1])
+        tokens_in = text_tokens(prefix) + text_tokens(json.dumps(messages[-1]["content"][0])) + 85 + 170 * (
+            -(-img.width // 512) * -(-img.height // 512))
+        tokens_out = text_tokens(content)
+        cached = self.server.cached_tokens(prefix, text_tokens(prefix)) if text_tokens(prefix) >= 1024 else 0
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content, "refusal": None},
+                         "logprobs": None, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": tokens_in, "completion_tokens": tokens_out,
+                      "total_tokens": tokens_in + tokens_out,
+                      "prompt_tokens_details": {"cached_tokens": cached}},
+        }, self.usage_headers(tokens_in, tokens_out, cached))
+
+    # Anthropic messages (Claude) ------------------------------------------------------------
+
+    def messages(self, body: dict):
+        content = body["messages"][-1]["content"]
+        image = [part for part in content if part.get("type") == "image"][-1]
+        img = decode_image(image["source"]["data"])
+        answer = self.answer("claude", img)
+        # TileAnalysis requires a viability (0-100)
+        viability = answer["viability"] if answer["viability"] is not None else 50.0
+        text = json.dumps({"cpe_detected": answer["cpe_detected"], "cpe_types": answer["cpe_types"] or None,
+                           "viability": viability, "confidence": answer["confidence"],
+                           "full_response_text": answer["full_response_text"]})
+
+        system = json.dumps(body.get("system", ""))
+        system_tokens = text_tokens(system)
+        cache_read = self.server.cached_tokens(system, system_tokens)
+        tokens_in = img.width * img.height // 750 + text_tokens(json.dumps(content[1:]))
+        tokens_out = text_tokens(text)
+        self.send_json(200, {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", ""),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": tokens_in, "output_tokens": tokens_out,
+                      "cache_read_input_tokens": cache_read,
+                      "cache_creation_input_tokens": system_tokens - cache_read},
+        }, self.usage_headers(tokens_in + system_tokens, tokens_out, cache_read))
+
+    # Gemini generateContent --------------------------------------------------------------
+
+    def generate_content(self, body: dict):
+        parts = [part for content in body["contents"] for part in content.get("parts", [])]
+        results, tile_id = [], None
+        for part in parts:
+            text = part.get("text")
+            inline = part.get("inlineData") or part.get("inline_data")
+            if text is not None:
+                tile_id = text[len("Tile ID: "):].strip() if text.startswith("Tile ID: ") else None
+            elif inline is not None and tile_id is not None:
+                answer = self.answer("gemini", decode_image(inline["data"]))
+                results.append({"tile_id": tile_id, "visual_reasoning": answer["full_response_text"],
+                                **{key: answer[key] for key in
+                                   ("cpe_detected", "cpe_types", "viability", "confidence", "full_response_text")}})
+                tile_id = None
+        text = json.dumps({"results": results})
+
+        prefix = json.dumps(body.get("systemInstruction") or body.get("system_instruction") or "")
+        tokens_in = text_tokens(prefix) + sum(text_tokens(p.get("text", "")) + 258 * ("text" not in p) for p in parts)
+        tokens_out = text_tokens(text)
+        cached = self.server.cached_tokens(prefix, text_tokens(prefix)) if text_tokens(prefix) >= 1024 else 0
+        self.send_json(200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": tokens_in, "candidatesTokenCount": tokens_out,
+                              "totalTokenCount": tokens_in + tokens_out, "cachedContentTokenCount": cached,
+                              "thoughtsTokenCount": 0},
+            "modelVersion": body["model"],
+        }, self.usage_headers(tokens_in, tokens_out, cached))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the recorded LLM tile answers over the providers' HTTP APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--images", default=str(REPO_ROOT / "converted_pngs"),
+                        help="images the recordings were made from (tiles replayed exactly)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform random latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests/s before 429s, 0 = unlimited")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), args.images, args.latency, args.jitter,
+                        args.error_rate, args.rate_limit, args.seed, args.verbose)
+    print(f"Replaying {', '.join(server.recordings)} on http://{args.host}:{args.port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
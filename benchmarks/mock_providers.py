@@ -0,0 +1,184 @@
+"""
+Stand-in LLM providers for benchmarking the tiling / encode / call / parse /
+aggregate path of cpe_core without API keys.
+
+Each mock subclasses providers.Provider and encodes tiles exactly like the adapter
+it replaces: PNG base64 for ChatGPT/Grok, the size-capped PNG/JPEG for Claude,
+PIL images and batched tiles for Gemini. Only the network call is replaced by a
+simulated server:
+
+    latency     seconds per request (plus a uniform 0..jitter)
+    rate_limit  requests per second across all threads (token bucket, burst 1 s);
+                over the limit a call raises RateLimited after a short delay, and
+                retry_delay() honours its retry_after like the real adapters do.
+
+The answer is a JSON string (parsed like a real response) picked by a CRC of the
+payload, so results are deterministic per tile without the client doing work a
+real server would do.
+"""
+
+import io
+import json
+import random
+import threading
+import time
+import zlib
+
+from PIL import Image
+
+from cpe_core import TileResult
+from providers import Provider, pil_image_to_b64, pil_to_b64_under_limit
+
+TOKENS_PER_TILE = 1100          # roughly what a ~400 px tile plus prompt costs
+TOKENS_OUT = 120
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"429 Too Many Requests (retry after {retry_after:.2f}s)")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """0 if a request may go now, else the seconds until one may."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+def mock_answer(payload: bytes) -> dict:
+    """A tile verdict picked by the payload's CRC: about 20% CPE, 15% early stress."""
+    score = zlib.crc32(payload) / 0xFFFFFFFF
+    if score > 0.8:
+        state, types = "clear_cpe", ["rounding", "refractile"]
+    elif score > 0.65:
+        state, types = "early_stress", ["rounding"]
+    else:
+        state, types = "healthy", []
+    return {
+        "culture_state": state,
+        "cpe_detected": state == "clear_cpe",
+        "cpe_types": types,
+        "viability": round(1.0 - score / 2, 3),
+        "confidence": round(0.6 + score / 3, 3),
+    }
+
+
+class MockProvider(Provider):
+    name = "mock"
+
+    def __init__(self, model: str = "mock", prompt: str = "", few_shot_examples=(),
+                 latency: float = 0.02, jitter: float = 0.01, rate_limit: float = 0, seed: int = 0):
+        super().__init__(model, prompt, few_shot_examples)
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+
+    def _server(self, n_tiles: int = 1):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        wait = self.bucket.take() if self.bucket is not None else 0.0
+        if wait:
+            with self._lock:
+                self.rate_limited += 1
+            time.sleep(min(delay, 0.005))
+            raise RateLimited(wait)
+        time.sleep(delay * (1 + 0.2 * (n_tiles - 1)))
+
+    def retry_delay(self, exc, attempt, base_delay):
+        if isinstance(exc, RateLimited):
+            return exc.retry_after
+        return None
+
+    def payload(self, encoded) -> bytes:
+        if isinstance(encoded, tuple):
+            encoded = encoded[0]
+        return encoded.encode()
+
+    def call(self, encoded):
+        self._server()
+        return {"text": json.dumps(mock_answer(self.payload(encoded))),
+                "usage": (TOKENS_PER_TILE, TOKENS_OUT, 0)}
+
+    def parse(self, response) -> TileResult:
+        return TileResult.from_mapping(json.loads(response["text"]))
+
+    def usage(self, response) -> tuple:
+        return response["usage"]
+
+
+class MockChatGPT(MockProvider):
+    name = "chatgpt"
+    encoding = "png_b64"
+
+    def encode(self, tile_image: Image.Image) -> str:
+        return pil_image_to_b64(tile_image)
+
+
+class MockGrok(MockChatGPT):
+    name = "grok"
+
+
+class MockClaude(MockProvider):
+    name = "claude"
+    encoding = "claude_b64"
+    MAX_IMAGE_BYTES = 4_500_000
+
+    def encode(self, tile_image: Image.Image) -> tuple[str, str]:
+        return pil_to_b64_under_limit(tile_image, self.MAX_IMAGE_BYTES)
+
+
+class MockGemini(MockProvider):
+    name = "gemini"
+    encoding = "pil"
+    supports_batch = True
+
+    def encode(self, tile_image: Image.Image) -> Image.Image:
+        return tile_image
+
+    def payload(self, encoded: Image.Image) -> bytes:
+        return encoded.tobytes()
+
+    def payload_bytes(self, encoded: Image.Image) -> int:
+        buffer = io.BytesIO()
+        encoded.save(buffer, format="PNG")
+        return buffer.tell()
+
+    def call(self, encoded):
+        return self.call_batch([("r1c1", encoded)])
+
+    def parse(self, response) -> TileResult:
+        return next(iter(self.parse_batch(response).values()))
+
+    def call_batch(self, encoded_tiles: list[tuple[str, object]]):
+        self._server(len(encoded_tiles))
+        answers = {tile_id: mock_answer(self.payload(encoded)) for tile_id, encoded in encoded_tiles}
+        return {"text": json.dumps(answers),
+                "usage": (TOKENS_PER_TILE * len(encoded_tiles), TOKENS_OUT * len(encoded_tiles), 0)}
+
+    def parse_batch(self, response) -> dict:
+        return {tile_id: TileResult.from_mapping(answer) for tile_id, answer in json.loads(response["text"]).items()}
+
+
+MOCK_PROVIDERS = {
+    "chatgpt": MockChatGPT,
+    "claude": MockClaude,
+    "gemini": MockGemini,
+    "grok": MockGrok,
+}
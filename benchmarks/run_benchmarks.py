@@ -0,0 +1,366 @@
+"""
+End-to-end throughput benchmarks on synthetic images.
+
+Writes a corpus of Vero-like fields (synthetic.py, 1270x952, 8-bit) once to
+benchmarks/.corpus/, then runs each stage on 100, 1k and 10k images (cycling over
+--unique distinct files) and records images/s and memory:
+
+    tiling         decode, split into the 3x3 grid, PNG/base64 encode every tile
+    cell_features  decode, per-cell features + spatial metrics on the generator's own
+                   cell masks, written to a chunked Parquet dataset (no Cellpose needed)
+    cellpose       analyze_cpe.analyze: Cellpose eval, mask PNG, features, metrics
+    dvice          dvice_analysis.predict with the three models in dvice-results/resources
+    llm_<ai>       cpe_core.analyze_image + incremental JSON save for each LLM script's
+                   configuration, against an in-process mock server (mock_providers.py)
+    compare        build_comparison + confusion matrices + per-type accuracy + summary CSV
+
+Every stage × size runs in a fresh process, so peak RSS is that stage's own.
+Model loading and corpus setup are reported as setup_s and not counted in
+images/s. Stages whose dependencies (cellpose, tensorflow and the DVICE weights,
+python-dotenv for the LLM scripts) are missing are reported as skipped.
+
+    python benchmarks/run_benchmarks.py                                   # all stages, all sizes
+    python benchmarks/run_benchmarks.py --stages tiling llm_gemini --sizes 100 --latency 0.2 --rate-limit 5
+    python benchmarks/run_benchmarks.py --compare old.json new.json       # images/s per stage, before/after
+
+Reports go to benchmarks/results/bench-<commit>.json by default.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+sys.path[:0] = [str(BENCH_DIR), str(REPO_ROOT), str(REPO_ROOT / "ai-impage-processing"),
+                str(REPO_ROOT / "cellpose-results"), str(REPO_ROOT / "dvice-results"),
+                str(REPO_ROOT / "compare-results")]
+
+from synthetic import corpus_parameters, vero_field, write_corpus
+
+CORPUS = BENCH_DIR / ".corpus"
+RESULTS = BENCH_DIR / "results"
+SIZES = (100, 1000, 10000)
+LLM_SCRIPTS = ("chatgpt", "claude", "gemini", "grok")
+STAGES = ("tiling", "cell_features", "cellpose", "dvice", *(f"llm_{ai}" for ai in LLM_SCRIPTS), "compare")
+
+
+class Skip(Exception):
+    """A stage that cannot run here (missing dependency or model files)."""
+
+
+# ---------------------------------------------------------------------------
+# Stages: setup(images, options) does the untimed preparation and returns the timed run()
+# ---------------------------------------------------------------------------
+
+def setup_tiling(images, options):
+    from providers import pil_image_to_b64
+    from tiling import load_image, split_image
+
+    def run():
+        for path in images:
+            for tile in split_image(load_image(str(path)), 3):
+                pil_image_to_b64(tile["image"])
+    return run
+
+
+def setup_cell_features(images, options):
+    import numpy as np
+    from skimage import io as skio
+    from cpe_common.cell_features import CellFeatureWriter, cell_features
+    from cpe_common.spatial import image_metrics
+
+    params = dict(corpus_parameters(options["unique"], options["seed"]))
+    labels = {path.name: vero_field(**params[path.name])[1] for path in set(images)}
+
+    def run():
+        writer = CellFeatureWriter("cells")
+        for path in images:
+            img = skio.imread(path, as_gray=True).astype(np.float32)
+            cells = cell_features(labels[path.name], img, path.name)
+            image_metrics(cells, img.shape)
+            writer.append(cells)
+        writer.flush()
+    return run
+
+
+def setup_cellpose(images, options):
+    try:
+        import analyze_cpe
+    except ImportError as exc:
+        raise Skip(f"cellpose not installed ({exc})")
+    from skimage import io as skio
+    from cpe_common.cell_features import CellFeatureWriter
+    from cpe_common.parallel import run as run_parallel
+
+    os.makedirs(analyze_cpe.OUTPUT_DIR, exist_ok=True)
+    workers = options["workers"]
+    if workers <= 1:
+        model = analyze_cpe.load_model()
+        init = lambda: model  # noqa: E731  (inline: never pickled)
+    else:
+        init = analyze_cpe.load_model
+    paths = {path.name: path for path in images}
+
+    def run():
+        writer = CellFeatureWriter("cells")
+        load = lambda name: skio.imread(paths[name], as_gray=True)  # noqa: E731
+        for _, (metrics, cells) in run_parallel([p.name for p in images], load, analyze_cpe.analyze,
+                                                init=init, processes=workers):
+            writer.append(cells)
+        writer.flush()
+    return run
+
+
+def setup_dvice(images, options):
+    try:
+        import dvice_analysis
+    except ImportError as exc:
+        raise Skip(f"tensorflow not installed ({exc})")
+    import skimage.io
+    from cpe_common.parallel import run as run_parallel
+
+    model_paths = [REPO_ROOT / "dvice-results" / "resources" / f"model{i}.h5" for i in (1, 2, 3)]
+    missing = [p.name for p in model_paths if not p.exists()]
+    if missing:
+        raise Skip(f"DVICE weights not found in dvice-results/resources ({', '.join(missing)})")
+    workers = options["workers"]
+    if workers <= 1:
+        models = dvice_analysis.load_models(model_paths)
+        init, init_args = (lambda: models), ()  # noqa: E731
+    else:
+        init, init_args = dvice_analysis.load_models, (model_paths,)
+    paths = {path.name: path for path in images}
+
+    def run():
+        load = lambda name: skimage.io.imread(paths[name])  # noqa: E731
+        for _ in run_parallel([p.name for p in images], load, dvice_analysis.predict,
+                              init=init, init_args=init_args, processes=workers):
+            pass
+    return run
+
+
+def setup_llm(ai):
+    def setup(images, options):
+        import importlib
+        try:
+            script = importlib.import_module(f"individual_image_{ai}")
+        except ImportError as exc:
+            raise Skip(f"individual_image_{ai}.py cannot be imported ({exc})")
+        from cpe_core import analyze_image, save_results
+        from mock_providers import MOCK_PROVIDERS
+
+        config = script.make_config()
+        config.results_filename = f"cpe_detection_results_{ai}.json"
+        config.metrics_filename = "llm_call_metrics.jsonl"   # always on here; written to the scratch folder
+        config.max_retries = 1000           # rate-limited calls wait and retry, they never give up
+        provider = MOCK_PROVIDERS[ai](
+            model=getattr(script, "MODEL", None) or script.MODEL_NAME,
+            prompt=getattr(script, "SYSTEM_PROMPT", None) or script.common_prompt,
+            latency=options["latency"], jitter=options["jitter"], rate_limit=options["rate_limit"],
+            seed=options["seed"],
+        )
+
+        def run():
+            all_results = {}
+            for i, path in enumerate(images):
+                all_results[f"{i}_{path.name}"] = analyze_image(provider, str(path), config)
+                save_results(config.results_filename, all_results)
+            options["extra"] = {"calls": provider.calls, "rate_limited": provider.rate_limited,
+                                "tile_grid": config.tile_grid, "tile_mode": config.tile_mode}
+        return run
+    return setup
+
+
+def setup_compare(images, options):
+    import numpy as np
+    import pandas as pd
+    import compare_cpe_results as compare
+
+    rng = np.random.default_rng(options["seed"])
+    types = ["rounding", "vacuolation", "detached", "granularity", "refractile", "dying cells"]
+    names = [f"EXP_path{1 + i % 2}_passage4_{100 + i}.png" for i in range(len(images))]
+    all_data = {}
+    for source in compare.SOURCES:
+        all_data[source] = {}
+        for name in names:
+            state = rng.choice(["healthy", "early_stress", "clear_cpe"], p=[0.5, 0.2, 0.3])
+            found = [t for t in types if rng.random() < (0.4 if state == "clear_cpe" else 0.05)]
+            all_data[source][name] = ({"cpe_detected": state == "clear_cpe", "cpe_types": found} if source == "CRO"
+                                      else {"culture_state": state, "cpe_types": found})
+    ais = sorted(s for s in compare.SOURCES if s != "CRO")
+
+    def run():
+        cmp = compare.build_comparison(all_data, sorted(names))
+        compare.confusion_codes(cmp, ais)
+        compare.detection_confusion_matrices(cmp, ais)
+        for path in (1, 2):
+            compare.accuracy_by_type(cmp, ais, cmp.path == path)
+        summary = pd.DataFrame({"Image": cmp.images})
+        for j, model in enumerate(compare.SOURCES):
+            summary[f"{model}_CPE"] = cmp.detected_label[:, j]
+            summary[f"{model}_Types"] = cmp.types_label[:, j]
+        summary.to_csv("cpe_comparison_table.csv", index=False)
+    return run
+
+
+SETUPS = {
+    "tiling": setup_tiling,
+    "cell_features": setup_cell_features,
+    "cellpose": setup_cellpose,
+    "dvice": setup_dvice,
+    **{f"llm_{ai}": setup_llm(ai) for ai in LLM_SCRIPTS},
+    "compare": setup_compare,
+}
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def _rss_mb(who=resource.RUSAGE_SELF) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)   # bytes on macOS, KiB elsewhere
+
+
+def _measure(stage: str, n: int, options: dict, conn):
+    """Child process: set up and run one stage on n images in a scratch folder, send back the record."""
+    record = {"stage": stage, "images": n}
+    paths = write_corpus(CORPUS, options["unique"], options["seed"])
+    images = [paths[i % len(paths)] for i in range(n)]
+    with tempfile.TemporaryDirectory(prefix=f"bench-{stage}-") as scratch:
+        os.chdir(scratch)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                run = SETUPS[stage](images, options)
+                record["setup_s"] = round(time.perf_counter() - start, 3)
+                record["rss_after_setup_mb"] = _rss_mb()
+                start = time.perf_counter()
+                run()
+                seconds = time.perf_counter() - start
+        except Skip as exc:
+            conn.send({**record, "status": "skipped", "reason": str(exc)})
+            return
+        except Exception as exc:
+            conn.send({**record, "status": "error", "reason": f"{type(exc).__name__}: {exc}"})
+            return
+    conn.send({
+        **record,
+        "status": "ok",
+        "seconds": round(seconds, 3),
+        "images_per_s": round(n / seconds, 3) if seconds else None,
+        "peak_rss_mb": _rss_mb(),
+        "peak_rss_workers_mb": _rss_mb(resource.RUSAGE_CHILDREN) or None,
+        **options.get("extra", {}),
+    })
+
+
+def measure(stage: str, n: int, options: dict) -> dict:
+    ctx = mp.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_measure, args=(stage, n, options, child))
+    process.start()
+    child.close()
+    try:
+        record = parent.recv()
+    except EOFError:
+        record = {"stage": stage, "images": n, "status": "error", "reason": "benchmark process died"}
+    process.join()
+    return record
+
+
+def _git(*args) -> str | None:
+    try:
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare_reports(old_path, new_path):
+    import pandas as pd
+
+    def rates(path):
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        rows = pd.DataFrame(report["results"])
+        rows = rows[rows["status"] == "ok"].set_index(["stage", "images"])
+        return report["environment"].get("commit") or path, rows
+
+    old_commit, old = rates(old_path)
+    new_commit, new = rates(new_path)
+    table = pd.DataFrame({"old_images_per_s": old["images_per_s"], "new_images_per_s": new["images_per_s"],
+                          "old_peak_rss_mb": old["peak_rss_mb"], "new_peak_rss_mb": new["peak_rss_mb"]}).dropna(how="all")
+    table["speedup"] = (table["new_images_per_s"] / table["old_images_per_s"]).round(2)
+    print(f"{str(old_commit)[:12]} -> {str(new_commit)[:12]}")
+    print(table.to_string())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and memory of every pipeline stage on synthetic images.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES))
+    parser.add_argument("--unique", type=int, default=32, help="distinct synthetic images the runs cycle over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="processes for the cellpose and dvice stages")
+    parser.add_argument("--latency", type=float, default=0.02, help="mock LLM seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.01, help="mock LLM extra random latency (s)")
+    parser.add_argument("--rate-limit", type=float, default=0, help="mock LLM requests/s, 0 = unlimited")
+    parser.add_argument("--out", help="report path (default benchmarks/results/bench-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+
+    options = {"unique": args.unique, "seed": args.seed, "workers": args.workers,
+               "latency": args.latency, "jitter": args.jitter, "rate_limit": args.rate_limit}
+    print(f"Writing {args.unique} synthetic images to {CORPUS.relative_to(REPO_ROOT)}/ ...")
+    write_corpus(CORPUS, args.unique, args.seed)
+
+    env = environment()
+    results = []
+    for stage in args.stages:
+        for n in sorted(args.sizes):
+            record = measure(stage, n, options)
+            results.append(record)
+            if record["status"] != "ok":
+                print(f"{stage:>14} {n:>6}: {record['status']} ({record['reason']})")
+                if record["status"] == "skipped":
+                    break
+                continue
+            print(f"{stage:>14} {n:>6}: {record['images_per_s']:9.2f} images/s  "
+                  f"peak {record['peak_rss_mb']:.0f} MB  (setup {record['setup_s']:.1f}s)")
+
+    out = Path(args.out) if args.out else RESULTS / f"bench-{(env['commit'] or 'unknown')[:12]}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"environment": env, "options": options, "results": results}, f, indent=2)
+    print(f"Saved: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Synthetic Vero-like transmitted-light images for benchmarking.
+
+vero_field() draws a textured monolayer at the real 1270x952 resolution:
+elongated flat cells with dark membranes and a visible nucleus, a fraction of
+rounded refractile cells (bright halo, dark core) and cell-free gaps, on an
+uneven illumination background with camera noise. It also returns the label mask
+of the cells it drew, so the per-cell feature and spatial stages can be measured
+without Cellpose.
+
+    img, labels = vero_field(seed=3, density=0.8, rounded=0.3, gaps=0.1)
+
+density is the fraction of the field covered by cells, rounded the fraction of
+cells drawn rounded/refractile (a CPE-like culture at ~0.3 and above), gaps the
+fraction of the field left empty. Images are 8-bit grayscale, like converted_pngs.
+
+write_corpus() writes n such images named like the real data
+(EXP_path<P>_passage4_<id>.png) with parameters spread over healthy and CPE-like
+cultures.
+"""
+
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+from skimage.draw import disk, ellipse
+from skimage.segmentation import find_boundaries
+
+SHAPE = (952, 1270)             # rows, cols of the converted microscope fields
+FLAT_AXES = (22.0, 9.0)         # semi-axes (px) of a flat, elongated Vero cell
+ROUNDED_RADIUS = 8.0
+
+
+def vero_field(seed: int = 0, density: float = 0.8, rounded: float = 0.1, gaps: float = 0.05,
+               shape=SHAPE) -> tuple[np.ndarray, np.ndarray]:
+    """(uint8 image, int32 label mask) of one synthetic field."""
+    rng = np.random.default_rng(seed)
+    height, width = shape
+
+    # uneven illumination plus low-frequency texture of the medium
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = 150 + 20 * (xx / width) - 15 * ((yy / height - 0.5) ** 2)
+    background += ndimage.gaussian_filter(rng.normal(0, 25, shape).astype(np.float32), 20)
+
+    # cell-free gaps: a few large blobs nobody is drawn in
+    gap_mask = np.zeros(shape, dtype=bool)
+    while gap_mask.mean() < gaps:
+        r = rng.uniform(30, 120)
+        rr, cc = disk((rng.uniform(0, height), rng.uniform(0, width)), r, shape=shape)
+        gap_mask[rr, cc] = True
+
+    # cell centres: enough to cover `density` of the free area
+    flat_area = np.pi * FLAT_AXES[0] * FLAT_AXES[1]
+    n_cells = int(density * (~gap_mask).sum() / flat_area * 1.6)   # overlap eats ~40%
+    centres = rng.uniform((0, 0), (height, width), size=(n_cells, 2))
+    centres = centres[~gap_mask[centres[:, 0].astype(int), centres[:, 1].astype(int)]]
+    is_rounded = rng.random(len(centres)) < rounded
+
+    labels = np.zeros(shape, dtype=np.int32)
+    image = background.copy()
+    nuclei = np.zeros(shape, dtype=bool)
+    halos = np.zeros(shape, dtype=bool)
+    for label, ((row, col), round_cell) in enumerate(zip(centres, is_rounded), start=1):
+        if round_cell:
+            rr, cc = disk((row, col), ROUNDED_RADIUS * rng.uniform(0.8, 1.2), shape=shape)
+            hr, hc = disk((row, col), ROUNDED_RADIUS * 1.4, shape=shape)
+            halos[hr, hc] = True
+        else:
+            scale = rng.uniform(0.7, 1.3)
+            rr, cc = ellipse(row, col, FLAT_AXES[0] * scale, FLAT_AXES[1] * scale, shape=shape,
+                             rotation=rng.uniform(0, np.pi))
+            nr, nc = disk((row, col), 3.5, shape=shape)
+            nuclei[nr, nc] = True
+        labels[rr, cc] = label
+
+    # flat cells: slightly darker cytoplasm with granular texture, dark membranes and nuclei
+    cells = labels > 0
+    texture = ndimage.gaussian_filter(rng.normal(0, 12, shape).astype(np.float32), 1.5)
+    image[cells] -= 18
+    image[cells] += texture[cells]
+    image[nuclei & cells] -= 25
+    # rounded cells: phase-bright ring around a dark core
+    core = np.isin(labels, np.flatnonzero(is_rounded) + 1)
+    image[halos & ~core] += 60
+    image[core] -= 45
+    image[find_boundaries(labels, mode="inner")] -= 30
+
+    image += rng.normal(0, 4, shape).astype(np.float32)
+    image = ndimage.gaussian_filter(image, 0.8)
+    return np.clip(image, 0, 255).astype(np.uint8), labels
+
+
+def corpus_parameters(n: int, seed: int = 0):
+    """(name, vero_field kwargs) for n images spread over healthy and CPE-like cultures."""
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        cpe = rng.random() < 0.5
+        kwargs = {
+            "seed": seed * 1_000_003 + i,
+            "density": rng.uniform(0.3, 0.6) if cpe else rng.uniform(0.7, 0.95),
+            "rounded": rng.uniform(0.3, 0.7) if cpe else rng.uniform(0.0, 0.1),
+            "gaps": rng.uniform(0.1, 0.3) if cpe else rng.uniform(0.0, 0.05),
+        }
+        yield f"EXP_path{1 + i % 2}_passage4_{100 + i}.png", kwargs
+
+
+def write_corpus(folder, n: int, seed: int = 0) -> list[Path]:
+    """Write n synthetic images to folder (existing files are kept); returns their paths."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, kwargs in corpus_parameters(n, seed):
+        path = folder / name
+        if not path.exists():
+            Image.fromarray(vero_field(**kwargs)[0]).save(path)
+        paths.append(path)
+    return paths
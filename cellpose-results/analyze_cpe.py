@@ -1,12 +1,21 @@
 import os
+import sys
 import numpy as np
 import pandas as pd
+from pathlib import Path
 from cellpose import models
 from skimage import io as skio
-from skimage.measure import regionprops_table
 import warnings
 warnings.filterwarnings("ignore")
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common import profiling
+from cpe_common.cell_features import CellFeatureWriter, cell_features
+from cpe_common.image_cache import ImageCache
+from cpe_common.manifest import config_hash, image_files as manifest_images, pending, scan
+from cpe_common.parallel import run
+from cpe_common.spatial import image_metrics as spatial_metrics
+
 # ====================== SETTINGS ======================
 IMAGE_DIR = "../converted_pngs"
 OUTPUT_DIR = "results"
@@ -14,46 +23,46 @@ MODEL_TYPE = "cyto"                # classic U-Net model (works on your GPU)
 DIAMETER = 30                      # Vero cell diameter in pixels (None = auto)
 GPU = True
 SAVE_MASKS = True
+CELLS_DIR = "cells"                # per-cell features, chunked Parquet (see cpe_common/cell_features.py)
+INCREMENTAL = False                # True: only segment new or changed images (content hash), keep the rest of cpe_metrics.csv
+USE_IMAGE_CACHE = True             # read pixels from the packed image cache when it is up to date (python -m cpe_common.image_cache)
+WORKERS = 1                        # >1: segment in that many processes (CPU runs), images handed over in shared memory
 # ====================================================
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# v3 API (Cellpose class)
-model = models.Cellpose(gpu=GPU, model_type=MODEL_TYPE)
+# everything a row of cpe_metrics.csv depends on besides the image itself
+CONFIG_HASH = config_hash(MODEL_TYPE, DIAMETER, "resample=True", "min_size=15")
 
-image_files = [f for f in os.listdir(IMAGE_DIR) if f.lower().endswith('.png')]
-image_files.sort()
 
-print(f"Found {len(image_files)} images. Starting batch analysis...")
+def load_model():
+    # v3 API (Cellpose class)
+    return models.Cellpose(gpu=GPU, model_type=MODEL_TYPE)
 
-results = []
 
-for idx, filename in enumerate(image_files):
-    print(f"Processing {idx+1}/{len(image_files)}: {filename}")
-    img_path = os.path.join(IMAGE_DIR, filename)
-    
-    # Load as grayscale
-    img = skio.imread(img_path, as_gray=True)
-    if img.ndim == 3:
-        img = np.mean(img, axis=2)
+def analyze(model, filename, img):
+    """Segment one grayscale image; returns its metrics row and per-cell features."""
     img = img.astype(np.float32)
-    
+
     # v3 eval call (channels=[0,0] for grayscale)
-    masks, flows, styles, diams = model.eval(
-        img,
-        diameter=DIAMETER,
-        channels=[0, 0],      # required for v3 grayscale
-        normalize=True,
-        resample=True,
-        batch_size=8,
-        min_size=15
-    )
-    
+    with profiling.span("cellpose_eval", image=filename):
+        masks, flows, styles, diams = model.eval(
+            img,
+            diameter=DIAMETER,
+            channels=[0, 0],      # required for v3 grayscale
+            normalize=True,
+            resample=True,
+            batch_size=8,
+            min_size=15
+        )
+
     # Save mask (optional)
     if SAVE_MASKS:
         mask_path = os.path.join(OUTPUT_DIR, filename.replace('.png', '_mask.png'))
-        skio.imsave(mask_path, masks.astype(np.uint16))
-    
+        with profiling.span("write", path=mask_path):
+            skio.imsave(mask_path, masks.astype(np.uint16))
+
+    # Per-cell features (written to the Parquet dataset by the caller)
+    cells = cell_features(masks, img, filename)
+
     # Compute CPE proxy metrics
     if np.max(masks) == 0:
         metrics = {
@@ -66,15 +75,14 @@ for idx, filename in enumerate(image_files):
             'mean_perimeter_px': 0.0
         }
     else:
-        props = regionprops_table(masks, properties=('area', 'perimeter', 'eccentricity'))
-        areas = props['area']
-        perimeters = props['perimeter']
-        eccentricities = props['eccentricity']
-        circularities = 4 * np.pi * areas / (perimeters ** 2)
-        
+        areas = cells['area']
+        perimeters = cells['perimeter']
+        eccentricities = cells['eccentricity']
+        circularities = cells['circularity']
+
         total_area = np.sum(areas)
         image_area = img.shape[0] * img.shape[1]
-        
+
         metrics = {
             'image': filename,
             'cell_count': len(areas),
@@ -84,13 +92,70 @@ for idx, filename in enumerate(image_files):
             'mean_eccentricity': float(np.mean(eccentricities)),
             'mean_perimeter_px': float(np.mean(perimeters))
         }
-    
-    results.append(metrics)
 
-# Save master CSV
-df = pd.DataFrame(results)
-csv_path = "cpe_metrics.csv"
-df.to_csv(csv_path, index=False)
+    # Spatial statistics (NN distance, Ripley's L, local density, abnormal-cell clusters)
+    with profiling.span("spatial", image=filename):
+        metrics.update(spatial_metrics(cells, img.shape))
+    return metrics, cells
+
+
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    manifest = scan(IMAGE_DIR)
+    hashes = dict(zip(manifest['image'], manifest['sha256']))
+
+    csv_path = "cpe_metrics.csv"
+    previous = pd.read_csv(csv_path) if INCREMENTAL and os.path.exists(csv_path) else pd.DataFrame(columns=['image'])
+    recorded = {
+        row['image']: (row.get('image_sha256'), row.get('config_hash'))
+        for row in previous.astype(object).where(previous.notna(), None).to_dict('records')
+    }
+    plan = pending(manifest_images(manifest, ('.png',)), hashes, recorded, CONFIG_HASH)
+    previous = previous[previous['image'].isin(plan.up_to_date)]
+    image_files = plan.run
+    if len(previous):
+        print(f"{len(previous)} images unchanged since they were analysed.")
+
+    print(f"Found {len(image_files)} images. Starting batch analysis...")
+
+    cache = ImageCache() if USE_IMAGE_CACHE else None
+
+    def load(filename):
+        # Load as grayscale (a cached copy holds the same 2D uint8 pixels as_gray reads)
+        with profiling.span("decode", image=filename):
+            img = cache.get(filename, sha256=hashes[filename]) if cache is not None else None
+            if img is None:
+                img = skio.imread(os.path.join(IMAGE_DIR, filename), as_gray=True)
+            if img.ndim == 3:
+                img = np.mean(img, axis=2)
+            return img
+
+    results = []
+    # cells of images that are re-analysed (or gone) are dropped from the existing dataset
+    writer = CellFeatureWriter(CELLS_DIR, overwrite=previous.empty, keep=set(previous['image']))
+
+    for idx, (filename, (metrics, cells)) in enumerate(run(image_files, load, analyze, init=load_model,
+                                                           processes=WORKERS)):
+        print(f"Processed {idx+1}/{len(image_files)}: {filename}")
+        writer.append(cells)
+        metrics.update(image_sha256=hashes[filename], config_hash=CONFIG_HASH)
+        results.append(metrics)
+
+    writer.flush()
+
+    # Byte-identical images share one segmentation
+    rows = pd.concat([frame for frame in (previous, pd.DataFrame(results)) if len(frame)], ignore_index=True)
+    copies = rows.set_index('image').loc[list(plan.copy.values())].assign(image=list(plan.copy)) if plan.copy else None
+
+    # Save master CSV
+    df = pd.concat([rows, copies], ignore_index=True).sort_values('image', ignore_index=True)
+    with profiling.span("write", path=csv_path):
+        df.to_csv(csv_path, index=False)
+
+    print(f"\nDone! Results saved to {csv_path}, per-cell features in {CELLS_DIR}/")
+    print(df.head())
+
 
-print(f"\nDone! Results saved to {csv_path}")
-print(df.head())
\ No newline at end of file
+if __name__ == "__main__":
+    main()
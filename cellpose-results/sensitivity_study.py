@@ -6,46 +6,39 @@ Performs threshold sensitivity analysis + AUC-ROC evaluation for CellPose CPE pr
 Outputs:
   - sweep-results.csv   (accuracy vs threshold)
   - aucroc-results.csv  (AUC-ROC score for CellPose)
+  - operating-point-results.csv  (threshold with the best Youden's J, see cpe_common/roc.py)
 """
 
+import sys
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from sklearn.metrics import roc_auc_score
 
-def main():
-    # ====================== PATHS ======================
-    cellpose_csv = Path('cellpose-results.csv')
-    
-    if not cellpose_csv.exists():
-        raise FileNotFoundError(f"❌ cellpose-results.csv not found")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common import ground_truth
+from cpe_common.results_store import read_table
+from cpe_common.roc import evaluate
 
+def main():
     # ====================== LOAD DATA ======================
-    print("Loading CellPose results...")
-    df = pd.read_csv(cellpose_csv)
+    print("Loading CellPose results from the results store...")
+    scores = read_table('engine_scores', columns=['path', 'id', 'score'], filters=[('engine', '==', 'Cellpose')])
+    df = ground_truth.attach(scores)
     
     y_true = df['CRO_CPE']
-    probs = df['CellPose CPE Probability']
+    probs = df['score']
     
     print(f"✅ Loaded {len(df)} images with CellPose CPE Probability and CRO_CPE")
 
-    # ====================== ACCURACY SWEEP ======================
-    thresholds = np.arange(0.0, 1.01, 0.05)
-    results = []
+    # ====================== SWEEP, AUC-ROC & OPERATING POINT ======================
+    thresholds = np.round(np.arange(0.0, 1.01, 0.05), 2)
+    summary, sweep = evaluate(y_true, {'cellpose': probs}, grid=thresholds)
 
-    for t in thresholds:
-        preds = (probs >= t).astype(int)
-        correct = (preds == y_true).sum()
-        acc = (correct / len(df)) * 100
-        row = {'threshold': round(t, 2), 'cellpose_acc': round(acc, 2)}
-        results.append(row)
-
-    sweep_df = pd.DataFrame(results)
+    sweep_df = sweep.rename(columns={'cellpose': 'cellpose_acc'}).round(2)
     sweep_df.to_csv('sweep-results.csv', index=False)
     print(f"✅ sweep-results.csv saved ({len(thresholds)} thresholds)")
 
-    # ====================== AUC-ROC ======================
-    auc = roc_auc_score(y_true, probs)
+    auc = summary.loc[0, 'auc']
     auc_df = pd.DataFrame([{'cellpose_auc': round(auc, 4)}])
     auc_df.to_csv('aucroc-results.csv', index=False)
 
@@ -53,9 +46,16 @@ def main():
     print("\n=== AUC-ROC Results ===")
     print(f"   cellpose_auc = {auc:.4f}")
 
-    print("\nAll done! Two files generated:")
+    summary.round(4).to_csv('operating-point-results.csv', index=False)
+    best = summary.loc[0]
+    print(f"\n=== Optimal operating point (max Youden's J) ===")
+    print(f"   threshold = {best['best_threshold']:.4f}  accuracy = {best['best_accuracy']:.2f}%  "
+          f"TPR = {best['best_tpr']:.3f}  FPR = {best['best_fpr']:.3f}")
+
+    print("\nAll done! Three files generated:")
     print("   • sweep-results.csv")
     print("   • aucroc-results.csv")
+    print("   • operating-point-results.csv")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,11 +1,17 @@
+import sys
 import pandas as pd
 import numpy as np
+from pathlib import Path
 
-# ====================== LOAD DATA ======================
-cpe_df = pd.read_csv('cpe_confusion_table.csv')
-airvic_df = pd.read_csv('../airvic-results/airvic-results.csv')
-cellpose_df = pd.read_csv('../cellpose-results/cellpose-results.csv')
-dvice_df = pd.read_csv('../dvice-results/dvice-final-results.csv')   # <-- NEW
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common import ground_truth
+from cpe_common.bootstrap import METRICS, Outcomes, bootstrap, outcome_codes
+from cpe_common.results_store import read_table
+
+# ====================== SETTINGS ======================
+N_BOOTSTRAP = 10_000   # resamples of the images for the 95% CIs
+SEED = 0               # fixed so the CSV is reproducible
+WORKERS = 1            # >1 spreads the resamples over processes (same result)
 
 # CPE types for macro-averaging (LLMs only)
 cpe_types = ['Dy', 'Ro', 'V', 'D', 'G', 'Re']
@@ -17,137 +23,98 @@ model_map = {
     'Claude': 'CLD'
 }
 
-# ====================== HELPER FUNCTIONS ======================
-def compute_rates_from_confusion(col, df):
-    """LLM per-CPE-type rates (macro-averaged later)"""
-    values = df[col].values
-    tp = np.sum(values == 1)
-    fn = np.sum(values == -1)
-    fp = np.sum(values == -2)
-    tn = np.sum(values == 0)
-    
-    total_pos = tp + fn
-    total_neg = fp + tn
-    total = len(values)
-    
-    return {
-        'FP_rate': fp / total_neg if total_neg > 0 else np.nan,
-        'FN_rate': fn / total_pos if total_pos > 0 else np.nan,
-        'TP_rate': tp / total_pos if total_pos > 0 else np.nan,
-        'TN_rate': tn / total_neg if total_neg > 0 else np.nan,
-        'Accuracy': (tp + tn) / total if total > 0 else np.nan
-    }
-
-
-def compute_binary_rates(gt, pred):
-    """Binary rates + accuracy = (TP + TN) / total_predictions"""
-    tp = ((gt == 1) & (pred == 1)).sum()
-    fn = ((gt == 1) & (pred == 0)).sum()
-    fp = ((gt == 0) & (pred == 1)).sum()
-    tn = ((gt == 0) & (pred == 0)).sum()
-    
-    total_pos = tp + fn
-    total_neg = fp + tn
-    total = len(gt)
-    
-    return {
-        'FP_rate': fp / total_neg if total_neg > 0 else np.nan,
-        'FN_rate': fn / total_pos if total_pos > 0 else np.nan,
-        'TP_rate': tp / total_pos if total_pos > 0 else np.nan,
-        'TN_rate': tn / total_neg if total_neg > 0 else np.nan,
-        'Accuracy': (tp + tn) / total if total > 0 else np.nan
-    }
-
+model_order = [
+    'AIRVIC',
+    'DVICE',
+    'Cellpose',
+    'Always_true_binary',
+    'Always_false_binary',
+    'ChatGPT',
+    'Claude',
+    'Gemini',
+    'Grok',
+    'Always_true',
+    'Always_false'
+]
 
-# ====================== COMPUTE FOR LLMs (macro-average) ======================
-results = {}
-for model_name, prefix in model_map.items():
-    type_rates = []
-    for t in cpe_types:
-        col = f'{prefix}_{t}'
-        rates = compute_rates_from_confusion(col, cpe_df)
-        type_rates.append(rates)
-    
-    avg_rates = {}
-    for key in ['FP_rate', 'FN_rate', 'TP_rate', 'TN_rate', 'Accuracy']:
-        vals = [r[key] for r in type_rates if not pd.isna(r[key])]
-        avg_rates[key] = np.mean(vals) if vals else np.nan
-    results[model_name] = avg_rates
+COLUMN_NAMES = {
+    'FP_rate': 'FP rate',
+    'FN_rate': 'FN rate',
+    'TP_rate': 'TP rate',
+    'TN_rate': 'TN rate',
+    'Accuracy': 'Overall Accuracy',
+}
 
 
-# ====================== COMPUTE FOR AIRVIC ======================
-results['AIRVIC'] = compute_binary_rates(
-    airvic_df['CRO_CPE'], 
-    airvic_df['Airvic_CPE']
-)
+def main():
+    # ====================== LOAD DATA ======================
+    cpe_df = pd.read_csv('cpe_confusion_table.csv')
 
+    # binary engines from the results store, aligned to the CRO ground truth on (path, id)
+    scores_df = read_table('engine_scores', filters=[('engine', 'in', ['AIRVIC', 'Cellpose', 'DVICE'])])
 
-# ====================== COMPUTE FOR CELLPOSE ======================
-gt_cell = cellpose_df['CRO_CPE']
-pred_cell = (cellpose_df['CellPose CPE Probability'] >= 0.5).astype(int)
-results['Cellpose'] = compute_binary_rates(gt_cell, pred_cell)
+    def engine_results(engine):
+        # left join: an image without a call for this engine gets NaN and is left out of its counts
+        return ground_truth.attach(scores_df[scores_df['engine'] == engine].drop(columns='engine'), how='left')
 
+    gt_binary = ground_truth.y_true().to_numpy()
 
-# ====================== COMPUTE FOR DVICE ======================
-results['DVICE'] = compute_binary_rates(
-    dvice_df['CRO_CPE'], 
-    dvice_df['DVICE_CPE']
-)
+    # ====================== BINARY DETECTORS (22-image scale) ======================
+    def binary(pred):
+        codes = outcome_codes(gt_binary, pred).astype(float)
+        codes[np.isnan(np.asarray(pred, dtype=float))] = np.nan
+        return Outcomes(codes)
 
+    airvic_df = engine_results('AIRVIC')
+    cellpose_df = engine_results('Cellpose')
+    dvice_df = engine_results('DVICE')
 
-# ====================== COMPUTE BINARY BASELINES (22-image scale) ======================
-gt_binary = airvic_df['CRO_CPE']
+    binary_models = {
+        'AIRVIC': binary(airvic_df['cpe']),
+        'Cellpose': binary(np.where(cellpose_df['score'].isna(), np.nan, cellpose_df['score'] >= 0.5)),
+        'DVICE': binary(dvice_df['cpe']),
+        # Always_true_binary / Always_false_binary = predict CPE in EVERY / NO image
+        'Always_true_binary': binary(np.ones(len(gt_binary))),
+        'Always_false_binary': binary(np.zeros(len(gt_binary))),
+    }
 
-# Always_true_binary = predict CPE in EVERY image
-pred_true_bin = pd.Series(1, index=gt_binary.index)
-results['Always_true_binary'] = compute_binary_rates(gt_binary, pred_true_bin)
+    # ====================== LLMs (macro-averaged over CPE types) + image x type baselines (CRO-annotated images) ======================
+    cro_types = cpe_df[[f'CRO_{t}' for t in cpe_types]].to_numpy()
 
-# Always_false_binary = predict no CPE in EVERY image
-pred_false_bin = pd.Series(0, index=gt_binary.index)
-results['Always_false_binary'] = compute_binary_rates(gt_binary, pred_false_bin)
+    def constant(value):
+        # pooled over all image x type predictions
+        pred = np.full(cro_types.shape, value)
+        return Outcomes(np.select([(cro_types == 1) & (pred == 1), (cro_types == 1) & (pred == 0),
+                                   (cro_types == 0) & (pred == 1)], [1, -1, -2], 0))
 
+    llm_models = {
+        model_name: Outcomes(cpe_df[[f'{prefix}_{t}' for t in cpe_types]].to_numpy(), macro=True)
+        for model_name, prefix in model_map.items()
+    }
+    llm_models['Always_true'] = constant(1)
+    llm_models['Always_false'] = constant(0)
 
-# ====================== COMPUTE LLM-SCALE BASELINES (612 predictions) ======================
-all_gt = pd.concat([cpe_df[f'CRO_{t}'] for t in cpe_types], ignore_index=True).values
+    # ====================== BOOTSTRAP (images resampled, all models at once per image set) ======================
+    results = pd.concat([
+        bootstrap(binary_models, n_resamples=N_BOOTSTRAP, seed=SEED, workers=WORKERS),
+        bootstrap(llm_models, n_resamples=N_BOOTSTRAP, seed=SEED, workers=WORKERS),
+    ]).set_index('model').loc[model_order]
 
-pred_always_true = np.ones(len(all_gt), dtype=int)
-results['Always_true'] = compute_binary_rates(all_gt, pred_always_true)
+    # ====================== BUILD FINAL TABLE ======================
+    # each rate followed by its 95% CI bounds
+    final_df = pd.DataFrame({'model': model_order})
+    for metric in METRICS:
+        name = COLUMN_NAMES[metric]
+        final_df[name] = results[metric].round(4).to_numpy()
+        final_df[f'{name} CI low'] = results[f'{metric}_low'].round(4).to_numpy()
+        final_df[f'{name} CI high'] = results[f'{metric}_high'].round(4).to_numpy()
 
-pred_always_false = np.zeros(len(all_gt), dtype=int)
-results['Always_false'] = compute_binary_rates(all_gt, pred_always_false)
+    csv_path = "aggregate-results.csv"
+    final_df.to_csv(csv_path, index=False)
 
+    print(f"✅ Table saved to {csv_path} (95% CIs from {N_BOOTSTRAP} bootstrap resamples)")
+    print(final_df.to_string(index=False))
 
-# ====================== BUILD FINAL TABLE ======================
-model_order = [
-    'AIRVIC',
-    'DVICE',
-    'Cellpose',
-    'Always_true_binary',
-    'Always_false_binary',
-    'ChatGPT',
-    'Claude',
-    'Gemini',
-    'Grok',
-    'Always_true',
-    'Always_false'
-]
 
-final_data = []
-for model in model_order:
-    r = results[model]
-    final_data.append({
-        'model': model,
-        'FP rate': round(r['FP_rate'], 4),
-        'FN rate': round(r['FN_rate'], 4),
-        'TP rate': round(r['TP_rate'], 4),
-        'TN rate': round(r['TN_rate'], 4),
-        'Overall Accuracy': round(r['Accuracy'], 4)
-    })
-
-final_df = pd.DataFrame(final_data)
-
-csv_path = "aggregate-results.csv"
-final_df.to_csv(csv_path, index=False)
-
-print(f"✅ Table saved to {csv_path}")
-print(final_df.to_string(index=False))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-import json
-import os
+import sys
 import pandas as pd
+from dataclasses import dataclass
+from pathlib import Path
 from typing import Dict, Any
 import matplotlib.pyplot as plt
 import numpy as np
@@ -8,13 +9,18 @@ from math import pi
 import seaborn as sns
 from mpl_toolkits.mplot3d import Axes3D
 
-JSON_FILES = {
-    "Claude": "ai-results/cpe_detection_results_claude.json",
-    "ChatGPT": "ai-results/cpe_detection_results_chatgpt.json",
-    "Gemini": "ai-results/cpe_detection_results_gemini.json",
-    "Grok": "ai-results/cpe_detection_results_grok.json",
-    "CRO": "cro-results/cpe_detection_results_cro.json",
-}
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common.cpe_types import COMPARED_CODES, presence
+from cpe_common.figures import FigureRegistry
+from cpe_common.manifest import image_key
+from cpe_common.tables import Column, TableLayout, write_csv, write_html, write_latex
+from cpe_common.results_store import image_results
+
+# image sources in the results store (see cpe_common/results_store.py for the files behind them)
+SOURCES = ["Claude", "ChatGPT", "Gemini", "Grok", "CRO"]
+SUMMARY_COLUMNS = ["culture_state", "cpe_detected", "cpe_types", "full_response_text"]
+# content hashes of the inputs each figure was last rendered from
+FIGURE_HASHES = "compare-results/.figure-hashes.json"
 
 # AI color scheme based on company logos
 AI_COLORS = {
@@ -24,18 +30,11 @@ AI_COLORS = {
     "Grok": "#FF6F00",     # xAI orange (vibrant, inspired by branding)
 }
 
+# CRO ticks in the type tables; the AIs use their AI_COLORS
+TICK_COLORS = {"CRO": "#ADD8E6"}  # lightblue
+
 CPE_TYPES = ["Dying Cells", "Rounding", "Vacuolation", "Detached", "Granularity", "Refractile"]
-CPE_MATCH_TYPES = ["Dying", "Rounding", "Vacuo", "Detached", "Granu", "Refrac"]
-CPE_SHORT = ["Dy", "Ro", "V", "D", "G", "Re"]
-
-def load_json(filename: str) -> Dict[str, Any]:
-    """Load JSON file, return dict of image → results."""
-    if not os.path.exists(filename):
-        print(f"Warning: {filename} not found. Skipping.")
-        return {}
-    with open(filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
+CPE_SHORT = list(COMPARED_CODES)  # Dy, Ro, V, D, G, Re — same order as CPE_TYPES
 
 def extract_cpe_summary(image_data: Dict[str, Any]) -> tuple[str, str]:
     """Extract CPE detected (Yes/No/N/A) and types (str). Handles different formats."""
@@ -63,381 +62,139 @@ def extract_cpe_summary(image_data: Dict[str, Any]) -> tuple[str, str]:
     types_str = ", ".join(types_list) if types_list else "None"
     return detected, types_str
 
-def parse_image_name(image_name: str) -> tuple[int, str]:
-    """Parse path number and ID from filename, e.g., EXP_path1_passage4_101.png -> (1, '101')"""
-    parts = image_name.split('_')
-    if len(parts) >= 3:
-        path_num = int(parts[1].replace('path', ''))
-        id_part = parts[-1].split('.')[0]  # Remove .png
-        return path_num, id_part
-    return 0, image_name  # Fallback
-
-def get_cpe_presence(types_list: list) -> Dict[str, bool]:
-    """Map CPE types to presence dict for tabular."""
-    presence = {typ: False for typ in CPE_TYPES}  # Use full CPE_TYPES as keys
-    if types_list is None:
-        types_list = []  # Handle None
-    for t in types_list:
-        for full_typ in CPE_TYPES:
-            if full_typ.lower() in t.lower() or any(match.lower() in t.lower() for match in CPE_MATCH_TYPES if match in full_typ):  # Enhanced fuzzy match
-                presence[full_typ] = True
-    return presence
-
-def prog():
-    all_data = {}
-    images = set()
-
-    # Load all JSONs
-    for model, filename in JSON_FILES.items():
-        print(filename)
-        data = load_json(filename)
-        all_data[model] = data
-        images.update(data.keys())
-
-    if not images:
-        print("No images found across JSON files.")
-        return
-
-    # Existing functionality: Align data by image for summary table
-    rows = []
-    sorted_images = sorted(images)
-    for image in sorted_images:
-        row = {"Image": image}
-        for model in JSON_FILES:
-            model_data = all_data.get(model, {}).get(image, {})
-            detected, types_str = extract_cpe_summary(model_data)
-            row[f"{model}_CPE"] = detected
-            row[f"{model}_Types"] = types_str
-        rows.append(row)
-
-    # Create and display DataFrame
-    df_summary = pd.DataFrame(rows)
-    print("\n=== CPE Detection Summary Table ===\n")
-    print(df_summary.to_string(index=False))
-
-    # Save outputs
-    csv_path = "compare-results/cpe_comparison_table.csv"
-    html_path = "compare-results/cpe_comparison_table.html"
-    df_summary.to_csv(csv_path, index=False)
-    df_summary.to_html(html_path, index=False)
-    print(f"\nSaved: {csv_path}, {html_path}")
-
-    # New 1: Tabular plot of CPE type per image
-    # Prepare data with parsed path and ID
-    detailed_rows = []
-    for image in sorted_images:
-        path_num, img_id = parse_image_name(image)
-        row = {"Path": path_num, "ID": img_id}
-        
-        # Get presence for each model
-        for model in JSON_FILES:
-            model_data = all_data.get(model, {}).get(image, {})
-            types_list = model_data.get("cpe_types", [])
-            presence = get_cpe_presence(types_list)
-            for short, full in zip(CPE_SHORT, CPE_TYPES):
-                row[f"{model}_{short}"] = "✔️" if presence[full] else ""  # Placeholder; will style in HTML/LaTeX
-
-        detailed_rows.append(row)
-
-    df_detailed = pd.DataFrame(detailed_rows)
-    df_detailed.sort_values(by=['Path', 'ID'], inplace=True)
-
-    # Group by Path (multi-index)
-    df_grouped = df_detailed.set_index(['Path', 'ID'])
-
-    # CSV without coloring
-    detailed_csv = "compare-results/cpe_type_tabular.csv"
-    df_grouped.to_csv(detailed_csv)
-    print(f"Saved detailed CSV: {detailed_csv}")
-
-    # HTML with coloring
-    def style_html(df):
-        # Style function
-        def apply_style(val, model_color=None):
-            if val == "✔️":
-                return 'background-color: lightblue; color: darkblue;'  # BCM
-            elif val == "X":
-                return 'background-color: red; color: white;'
-            return ''
-
-        styled = df.style
-        # Apply colors to headers/AI columns
-        for model in ['CRO', 'ChatGPT', 'Claude', 'Gemini', 'Grok']:
-            for short in CPE_SHORT:
-                col = f"{model}_{short}"
-                if model != 'CRO' and model in AI_COLORS:
-                    styled = styled.map(lambda v: f'background-color: {AI_COLORS[model]};' if v else '', subset=[col])
-                else:
-                    styled = styled.map(lambda v: apply_style(v), subset=[col])
-        return styled
-
-    detailed_html = "compare-results/cpe_type_tabular.html"
-    style_html(df_grouped.reset_index()).to_html(detailed_html)
-    print(f"Saved detailed HTML: {detailed_html}")
-    
-    # LaTeX with coloring (using colortbl package)
-    latex_code = df_grouped.to_latex(
-        escape=False,
-        multirow=True,
-        multicolumn=True,
-        column_format='ll' + 'c' * len(CPE_SHORT) * len(JSON_FILES)
+@dataclass
+class Comparison:
+    """
+    Everything the report needs, extracted in one pass over (image, source):
+      presence  bool [images, sources, CPE types]   CPE types named in each cpe_types list
+      detected  bool [images, sources]              extract_cpe_summary(...) == "Yes"
+      detected_label / types_label  str [images, sources]  for the summary table
+      path      int  [images], ids str [images]     parsed from the image name
+      annotated bool [images]                       the CRO has a result for the image
+    Sources are indexed in SOURCES order and CPE types in CPE_TYPES order. Only annotated
+    images are scored against the CRO; the others have no ground truth, not a negative one.
+    """
+    images: list
+    path: np.ndarray
+    ids: np.ndarray
+    presence: np.ndarray
+    detected: np.ndarray
+    detected_label: np.ndarray
+    types_label: np.ndarray
+    annotated: np.ndarray
+
+    def source(self, name: str) -> int:
+        return SOURCES.index(name)
+
+
+def build_comparison(all_data: Dict[str, Dict[str, Any]], sorted_images: list) -> Comparison:
+    n_images, n_sources = len(sorted_images), len(SOURCES)
+    type_presence = np.zeros((n_images, n_sources, len(CPE_TYPES)), dtype=bool)
+    detected_label = np.empty((n_images, n_sources), dtype=object)
+    types_label = np.empty((n_images, n_sources), dtype=object)
+
+    for i, image in enumerate(sorted_images):
+        for j, source in enumerate(SOURCES):
+            image_data = all_data.get(source, {}).get(image, {})
+            detected_label[i, j], types_label[i, j] = extract_cpe_summary(image_data)
+            type_presence[i, j] = presence(image_data.get("cpe_types", []))
+
+    parsed = [image_key(image) for image in sorted_images]
+    return Comparison(
+        images=list(sorted_images),
+        path=np.array([p for p, _ in parsed]),
+        ids=np.array([str(img_id) for _, img_id in parsed], dtype=object),
+        presence=type_presence,
+        detected=detected_label == "Yes",
+        detected_label=detected_label,
+        types_label=types_label,
+        annotated=np.array([image in all_data.get("CRO", {}) for image in sorted_images], dtype=bool),
     )
-    # Add colors manually (requires \usepackage{colortbl} in preamble)
-    # For simplicity, print raw LaTeX; user can add \cellcolor{blue!20} for BCM, \cellcolor{red} for X
-    detailed_latex = "compare-results/cpe_type_tabular.tex"
-    with open(detailed_latex, 'w', encoding='utf-8') as f:
-        f.write(latex_code)
-    print(f"Saved detailed LaTeX: {detailed_latex}")
-    
-    
-    # <Grok here> New 1.1: let's make a very dense image like this:
-    # "" means put that string exactly.
-    # |...,X| means this cell span X cells below: e.g.
-    # |...,2|..............,6 |       
-    # |..|..|..|..|..|..|..|..|
-    #
-    # |.r.| this means put the 6 data values for the result group for the row
-    #
-    # |"Images",2 |"CRO",6|"ChatGPT",6|"Claude",6|"Gemini",6|"Grok",6|
-    # |<path>|<id>|.r.    | .r.       |   .r.    |   .r.    |  .r.   |
-    ai_short = {'ChatGPT': 'GPT', 'Claude': 'CLD', 'Gemini': 'Gem', 'Grok': 'GRK'}
-    cpe_shorts = ['Dy', 'Ro', 'V', 'D', 'G', 'Re']  # Dying, Rounding, Vacuolation, Detached, Granularity, Refractile
-    
-    confusion_rows = []
-    for image in sorted_images:
-        path_num, img_id = parse_image_name(image)
-        row = {'path': path_num, 'id': img_id}
-        
-        cro_data = all_data.get('CRO', {}).get(image, {})
-        cro_presence = get_cpe_presence(cro_data.get('cpe_types', []))
-        
-        # CRO columns: 1 if asserted, 0 else
-        for short, typ in zip(cpe_shorts, CPE_TYPES):
-            row[f'CRO_{short}'] = 1 if cro_presence.get(typ, False) else 0
-        
-        # AI columns
-        for ai in ['ChatGPT', 'Claude', 'Gemini', 'Grok']:
-            ai_data = all_data.get(ai, {}).get(image, {})
-            ai_presence = get_cpe_presence(ai_data.get('cpe_types', []))
-            
-            for short, typ in zip(cpe_shorts, CPE_TYPES):
-                if ai_presence.get(typ, False) and cro_presence.get(typ, False):
-                    val = 1  # TP
-                elif ai_presence.get(typ, False) and not cro_presence.get(typ, False):
-                    val = -2  # FP
-                elif not ai_presence.get(typ, False) and cro_presence.get(typ, False):
-                    val = -1  # FN
-                else:
-                    val = 0  # TN
-                row[f'{ai_short[ai]}_{short}'] = val
-        
-        confusion_rows.append(row)
-    
-    df_confusion = pd.DataFrame(confusion_rows)
-    df_confusion.sort_values(by=['path', 'id'], key=lambda col: col.astype(int) if col.name == 'id' else col, inplace=True)
-    
-    confusion_csv = "compare-results/cpe_confusion_table.csv"
-    df_confusion.to_csv(confusion_csv, index=False)
-    print(f"Saved confusion CSV: {confusion_csv}")
 
-    # Prepare accuracy data for plots
-    # Compute accuracy per AI per CPE type (using Jaccard or simple match vs CRO)
-    accuracy_data = {ai: {typ: 0 for typ in CPE_TYPES} for ai in JSON_FILES if ai != "CRO"}
-    counts = {typ: 0 for typ in CPE_TYPES}
-
-    for image in sorted_images:
-        cro_data = all_data.get("CRO", {}).get(image, {})
-        cro_presence = get_cpe_presence(cro_data.get("cpe_types", []))
-        
-        for ai in accuracy_data:
-            ai_data = all_data.get(ai, {}).get(image, {})
-            ai_presence = get_cpe_presence(ai_data.get("cpe_types", []))
-            
-            for typ in CPE_TYPES:
-                if cro_presence[typ] or ai_presence[typ]:  # Only count if relevant
-                    counts[typ] += 1
-                    if cro_presence[typ] == ai_presence[typ]:
-                        accuracy_data[ai][typ] += 1
-
-    # Normalize to %
-    for ai in accuracy_data:
-        for typ in CPE_TYPES:
-            if counts[typ] > 0:
-                accuracy_data[ai][typ] = (accuracy_data[ai][typ] / counts[typ]) * 100
-            else:
-                accuracy_data[ai][typ] = 0
 
-    # New 2: AI accuracy bar chart
-    ai_order = sorted(accuracy_data.keys())  # Alpha: ChatGPT, Claude, Gemini, Grok
-    x = np.arange(len(CPE_TYPES))  # the label locations
-    width = 0.2  # the width of the bars
+def confusion_codes(cmp: Comparison, ais: list) -> np.ndarray:
+    """[annotated images, ais, types] per-type outcome vs CRO: 1=TP, -2=FP, -1=FN, 0=TN."""
+    presence = cmp.presence[cmp.annotated]
+    cro = presence[:, cmp.source("CRO"), None, :]
+    ai = presence[:, [cmp.source(a) for a in ais], :]
+    return np.select([ai & cro, ai & ~cro, ~ai & cro], [1, -2, -1], default=0)
+
+
+def accuracy_by_type(cmp: Comparison, ais: list, image_mask: np.ndarray) -> np.ndarray:
+    """
+    [ais, types] accuracy (%) vs CRO over the annotated images in image_mask. Only image/type
+    pairs where CRO or the AI asserts the type count, and the denominator is pooled over all AIs.
+    """
+    presence = cmp.presence[image_mask & cmp.annotated]
+    cro = presence[:, cmp.source("CRO"), None, :]
+    ai = presence[:, [cmp.source(a) for a in ais], :]
+    relevant = cro | ai
+    counts = relevant.sum(axis=(0, 1))
+    agree = (relevant & (ai == cro)).sum(axis=0)
+    return np.divide(agree * 100.0, counts, out=np.zeros(agree.shape), where=counts > 0)
+
+
+def detection_confusion_matrices(cmp: Comparison, ais: list) -> dict:
+    """Binary CPE-detected confusion matrix per AI over the annotated images, rows int(not CRO detected), cols int(AI detected)."""
+    detected = cmp.detected[cmp.annotated]
+    cro_row = (~detected[:, cmp.source("CRO")]).astype(int)
+    cms = {}
+    for ai in ais:
+        cm = np.zeros((2, 2))
+        np.add.at(cm, (cro_row, detected[:, cmp.source(ai)].astype(int)), 1)
+        cms[ai] = cm
+    return cms
 
-    fig, ax = plt.subplots(figsize=(12, 6))
-    for i, ai in enumerate(ai_order):
-        vals = [accuracy_data[ai][typ] for typ in CPE_TYPES]
-        ax.bar(x + i*width, vals, width, label=ai, color=AI_COLORS[ai])
 
-    ax.set_ylabel('Accuracy (%)')
-    ax.set_title('AI Accuracy by CPE Type')
-    ax.set_xticks(x + width * 1.5)
-    ax.set_xticklabels(CPE_TYPES, rotation=45)
-    ax.legend()
-    plt.tight_layout()
-    bar_chart_path = "compare-results/ai_accuracy_bar.png"
-    plt.savefig(bar_chart_path)
-    print(f"Saved bar chart: {bar_chart_path}")
-    plt.close()
+# ---------------------------------------------------------------------------
+# Figures. Each renderer is a module-level function render(out_path, **inputs) so the
+# FigureRegistry can hash its inputs and run it in a worker process (see cpe_common/figures.py).
+# ---------------------------------------------------------------------------
 
-    # New 2.1: AI accuracy bar chart for path1 images
-    # Filter images for path1
-    path1_images = [img for img in sorted_images if parse_image_name(img)[0] == 1]
-    accuracy_data_path1 = {ai: {typ: 0 for typ in CPE_TYPES} for ai in JSON_FILES if ai != "CRO"}
-    counts_path1 = {typ: 0 for typ in CPE_TYPES}
-
-    for image in path1_images:
-        cro_data = all_data.get("CRO", {}).get(image, {})
-        cro_presence = get_cpe_presence(cro_data.get("cpe_types", []))
-
-        for ai in accuracy_data_path1:
-            ai_data = all_data.get(ai, {}).get(image, {})
-            ai_presence = get_cpe_presence(ai_data.get("cpe_types", []))
-            
-            for typ in CPE_TYPES:
-                if cro_presence[typ] or ai_presence[typ]:
-                    counts_path1[typ] += 1
-                    if cro_presence[typ] == ai_presence[typ]:
-                        accuracy_data_path1[ai][typ] += 1
-
-    for ai in accuracy_data_path1:
-        for typ in CPE_TYPES:
-            if counts_path1[typ] > 0:
-                accuracy_data_path1[ai][typ] = (accuracy_data_path1[ai][typ] / counts_path1[typ]) * 100
-            else:
-                accuracy_data_path1[ai][typ] = 0
+def render_accuracy_bars(out_path: str, accuracy: np.ndarray, ai_order: list, colors: dict, cpe_types: list, title: str):
+    x = np.arange(len(cpe_types))  # the label locations
+    width = 0.2  # the width of the bars
 
     fig, ax = plt.subplots(figsize=(12, 6))
     for i, ai in enumerate(ai_order):
-        vals = [accuracy_data_path1[ai][typ] for typ in CPE_TYPES]
-        ax.bar(x + i*width, vals, width, label=ai, color=AI_COLORS[ai])
+        ax.bar(x + i*width, accuracy[i], width, label=ai, color=colors[ai])
 
     ax.set_ylabel('Accuracy (%)')
-    ax.set_title('AI Accuracy by CPE Type (Path 1 Images)')
+    ax.set_title(title)
     ax.set_xticks(x + width * 1.5)
-    ax.set_xticklabels(CPE_TYPES, rotation=45)
+    ax.set_xticklabels(cpe_types, rotation=45)
     ax.legend()
     plt.tight_layout()
-    bar_chart_path1 = "compare-results/path1_ai_accuracy_bar.png"
-    plt.savefig(bar_chart_path1)
-    print(f"Saved Path 1 bar chart: {bar_chart_path1}")
+    plt.savefig(out_path)
     plt.close()
 
-    # New 2.2: AI accuracy bar chart for path2 images
-    # Filter images for path2
-    path2_images = [img for img in sorted_images if parse_image_name(img)[0] == 2]
-    accuracy_data_path2 = {ai: {typ: 0 for typ in CPE_TYPES} for ai in JSON_FILES if ai != "CRO"}
-    counts_path2 = {typ: 0 for typ in CPE_TYPES}
-
-    for image in path2_images:
-        cro_data = all_data.get("CRO", {}).get(image, {})
-        cro_presence = get_cpe_presence(cro_data.get("cpe_types", []))
-
-        for ai in accuracy_data_path2:
-            ai_data = all_data.get(ai, {}).get(image, {})
-            ai_presence = get_cpe_presence(ai_data.get("cpe_types", []))
-            
-            for typ in CPE_TYPES:
-                if cro_presence[typ] or ai_presence[typ]:
-                    counts_path2[typ] += 1
-                    if cro_presence[typ] == ai_presence[typ]:
-                        accuracy_data_path2[ai][typ] += 1
-
-    for ai in accuracy_data_path2:
-        for typ in CPE_TYPES:
-            if counts_path2[typ] > 0:
-                accuracy_data_path2[ai][typ] = (accuracy_data_path2[ai][typ] / counts_path2[typ]) * 100
-            else:
-                accuracy_data_path2[ai][typ] = 0
 
-    fig, ax = plt.subplots(figsize=(12, 6))
-    for i, ai in enumerate(ai_order):
-        vals = [accuracy_data_path2[ai][typ] for typ in CPE_TYPES]
-        ax.bar(x + i*width, vals, width, label=ai, color=AI_COLORS[ai])
-
-    ax.set_ylabel('Accuracy (%)')
-    ax.set_title('AI Accuracy by CPE Type (Path 2 Images)')
-    ax.set_xticks(x + width * 1.5)
-    ax.set_xticklabels(CPE_TYPES, rotation=45)
-    ax.legend()
+def render_confusion_matrix(out_path: str, cm: np.ndarray, ai: str):
+    fig, ax = plt.subplots(figsize=(6, 4))
+    sns.heatmap(cm, annot=True, fmt="g", cmap="RdYlGn", ax=ax,
+                xticklabels=["Predicted No", "Predicted Yes"],
+                yticklabels=["Actual No", "Actual Yes"])
+    ax.set_title(f"Confusion Matrix for {ai} (CPE Detection)")
+    # Use AI color for accents if desired
     plt.tight_layout()
-    bar_chart_path2 = "compare-results/path2_ai_accuracy_bar.png"
-    plt.savefig(bar_chart_path2)
-    print(f"Saved Path 2 bar chart: {bar_chart_path2}")
+    plt.savefig(out_path)
     plt.close()
 
-    # the spider chart did not look good. skip it. 
-    # 3: AI accuracy spider chart
-    # ...
 
-    # 4: Confusion matrix graphics (proposals)
-    # For each AI, create a heatmap confusion matrix for binary CPE detection (Yes/No vs CRO)
-    # Assuming binary for simplicity; extend to multi-label if needed
-    for ai in ai_order:
-        cm = np.zeros((2, 2))  # [[TN, FP], [FN, TP]]
-        for image in sorted_images:
-            cro_detected = extract_cpe_summary(all_data.get("CRO", {}).get(image, {}))[0] == "Yes"
-            ai_detected = extract_cpe_summary(all_data.get(ai, {}).get(image, {}))[0] == "Yes"
-            cm[int(not cro_detected), int(ai_detected)] += 1
-
-        fig, ax = plt.subplots(figsize=(6, 4))
-        sns.heatmap(cm, annot=True, fmt="g", cmap="RdYlGn", ax=ax,
-                    xticklabels=["Predicted No", "Predicted Yes"],
-                    yticklabels=["Actual No", "Actual Yes"])
-        ax.set_title(f"Confusion Matrix for {ai} (CPE Detection)")
-        # Use AI color for accents if desired
-        plt.tight_layout()
-        cm_path = f"compare-results/{ai}_confusion_matrix.png"
-        plt.savefig(cm_path)
-        print(f"Saved confusion matrix for {ai}: {cm_path}")
-        plt.close()
-
-    # <Grok here>: New 4.1: combine the 4 confusion matrices into a single plot
-    # in each quadrant of the confusion matrix, break it up into 4 quadrants, e.g
-    # so the main quad for Actual NO,Predicted NO, will have four sub-quads like
-    # |ChatGPT| Claude|
-    # |Gemini | Grok  |
-    # and each sub-quad has the score for that AI model, and the heat map color.
-    # repeat for all four main quads.
-    
-    # <Grok here>: New 4.2: simmilar to 4.1, but instead of numerical value and heat map, make a 3D bar chart with same main-quad->sub-quad layout.
-    # New 4.1: Combined 2D confusion matrix heatmap
+# <Grok here>: New 4.1: combine the 4 confusion matrices into a single plot
+# in each quadrant of the confusion matrix, break it up into 4 quadrants, e.g
+# so the main quad for Actual NO,Predicted NO, will have four sub-quads like
+# |ChatGPT| Claude|
+# |Gemini | Grok  |
+# and each sub-quad has the score for that AI model, and the heat map color.
+# repeat for all four main quads.
+def render_combined_heatmap(out_path: str, stacked: np.ndarray, ai_sub_order: list):
+    """stacked[ai, main_row, main_col]: the per-AI 2x2 matrices in ai_sub_order (2x2 sub-quad layout)."""
     # Create a 4x4 grid where each main 2x2 quadrant is subdivided into 2x2 for AIs
-    # But since CM is 2x2 main, overall grid is 4x4 (2 main rows/cols x 2 sub per AI row/col)
-    # Actually for 4 AIs, sub is 2x2 per main quadrant
     fig, ax = plt.subplots(figsize=(12, 12))
-    cm_combined = np.zeros((4, 4))  # 2 main rows x 2 sub-rows, etc.
-    ai_sub_order = ['ChatGPT', 'Claude', 'Gemini', 'Grok']  # 2x2: top-left ChatGPT, top-right Claude, etc.
 
-    # Compute individual CMs again for placement
-    cms = {}
-    for ai in ai_sub_order:
-        cm = np.zeros((2, 2))
-        for image in sorted_images:
-            cro_detected = extract_cpe_summary(all_data.get("CRO", {}).get(image, {}))[0] == "Yes"
-            ai_detected = extract_cpe_summary(all_data.get(ai, {}).get(image, {}))[0] == "Yes"
-            cm[int(not cro_detected), int(ai_detected)] += 1
-        cms[ai] = cm
-
-    # Fill the large grid
-    for main_row in range(2):  # Actual No/Yes
-        for main_col in range(2):  # Predicted No/Yes
-            for sub_row in range(2):  # AI sub-grid rows
-                for sub_col in range(2):  # AI sub-grid cols
-                    ai_idx = sub_row * 2 + sub_col
-                    ai = ai_sub_order[ai_idx]
-                    val = cms[ai][main_row, main_col]
-                    row_idx = main_row * 2 + sub_row
-                    col_idx = main_col * 2 + sub_col
-                    cm_combined[row_idx, col_idx] = val
+    # [sub_row, sub_col, main_row, main_col] -> 4x4 grid with each main quadrant split by AI
+    cm_combined = stacked.reshape(2, 2, 2, 2).transpose(2, 0, 3, 1).reshape(4, 4)
 
     # Heatmap with custom annotations (add AI labels inside sub-quads)
     sns.heatmap(cm_combined, annot=False, cmap="RdYlGn", ax=ax)  # Base heatmap without annot
@@ -449,7 +206,7 @@ def prog():
                 for sub_col in range(2):
                     ai_idx = sub_row * 2 + sub_col
                     ai = ai_sub_order[ai_idx]
-                    val = cms[ai][main_row, main_col]
+                    val = stacked[ai_idx, main_row, main_col]
                     row_idx = main_row * 2 + sub_row + 0.5
                     col_idx = main_col * 2 + sub_col + 0.5
                     ax.text(col_idx, row_idx, f"{int(val)}\n{ai[:3]}", ha="center", va="center", color="black", fontsize=8)
@@ -467,12 +224,12 @@ def prog():
 
     ax.set_title("Combined Confusion Matrix (Subdivided by AI)")
     plt.tight_layout()
-    combined_cm_path = "compare-results/combined_confusion_heatmap.png"
-    plt.savefig(combined_cm_path)
-    print(f"Saved combined confusion heatmap: {combined_cm_path}")
+    plt.savefig(out_path)
     plt.close()
 
-    # New 4.2: Combined 3D bar chart
+
+# <Grok here>: New 4.2: simmilar to 4.1, but instead of numerical value and heat map, make a 3D bar chart with same main-quad->sub-quad layout.
+def render_combined_3d(out_path: str, stacked: np.ndarray, ai_sub_order: list, colors: dict):
     fig = plt.figure(figsize=(12, 12))
     ax = fig.add_subplot(111, projection='3d')
 
@@ -482,27 +239,12 @@ def prog():
     _xx, _yy = np.meshgrid(_x, _y)
     x, y = _xx.ravel(), _yy.ravel()
 
-    # Heights (z) from CM values, grouped by main quad
-    z = np.zeros(16)
-    colors = np.empty(16, dtype=object)
-    ai_labels = ['ChatGPT', 'Claude', 'Gemini', 'Grok']
-
-    idx = 0
-    for main_row in range(2):
-        for main_col in range(2):
-            base_x = main_col * 2
-            base_y = main_row * 2
-            for sub_row in range(2):
-                for sub_col in range(2):
-                    ai_idx = sub_row * 2 + sub_col
-                    ai = ai_sub_order[ai_idx]
-                    val = cms[ai][main_row, main_col]
-                    z[idx] = val
-                    colors[idx] = AI_COLORS[ai]
-                    idx += 1
+    # Heights (z) from CM values, grouped by main quad (main_row, main_col, sub_row, sub_col order)
+    z = stacked.reshape(2, 2, 2, 2).transpose(2, 3, 0, 1).ravel()
+    bar_colors = np.array([colors[ai] for ai in ai_sub_order] * 4, dtype=object)
 
     # 3D bars
-    ax.bar3d(x, y, np.zeros_like(z), 0.8, 0.8, z, color=colors)
+    ax.bar3d(x, y, np.zeros_like(z), 0.8, 0.8, z, color=bar_colors)
 
     # Labels
     ax.set_xticks([1, 3])
@@ -513,14 +255,153 @@ def prog():
     ax.set_title("Combined 3D Confusion Matrix (Subdivided by AI)")
 
     # Add AI labels on bars or legend
-    ax.legend([plt.Rectangle((0,0),1,1,fc=AI_COLORS[ai]) for ai in ai_sub_order], ai_sub_order, loc='upper right')
+    ax.legend([plt.Rectangle((0,0),1,1,fc=colors[ai]) for ai in ai_sub_order], ai_sub_order, loc='upper right')
 
     plt.tight_layout()
-    combined_3d_path = "compare-results/combined_confusion_3d.png"
-    plt.savefig(combined_3d_path)
-    print(f"Saved combined 3D confusion bar chart: {combined_3d_path}")
+    plt.savefig(out_path)
     plt.close()
 
+
+def prog(only_figures: list | None = None):
+    all_data = {}
+    images = set()
+
+    # Load every source from the results store (only the columns used below)
+    for model in SOURCES:
+        print(model)
+        data = image_results(model, columns=SUMMARY_COLUMNS)
+        all_data[model] = data
+        images.update(data.keys())
+
+    if not images:
+        print("No images found in the results store.")
+        return
+
+    sorted_images = sorted(images)
+    cmp = build_comparison(all_data, sorted_images)
+    ai_order = sorted(s for s in SOURCES if s != "CRO")  # Alpha: ChatGPT, Claude, Gemini, Grok
+
+    # Existing functionality: Align data by image for summary table
+    df_summary = pd.DataFrame({"Image": sorted_images})
+    for j, model in enumerate(SOURCES):
+        df_summary[f"{model}_CPE"] = cmp.detected_label[:, j]
+        df_summary[f"{model}_Types"] = cmp.types_label[:, j]
+
+    print("\n=== CPE Detection Summary Table ===\n")
+    print(df_summary.to_string(index=False))
+
+    # Save outputs
+    csv_path = "compare-results/cpe_comparison_table.csv"
+    html_path = "compare-results/cpe_comparison_table.html"
+    df_summary.to_csv(csv_path, index=False)
+    df_summary.to_html(html_path, index=False)
+    print(f"\nSaved: {csv_path}, {html_path}")
+
+    # New 1: Tabular plot of CPE type per image
+    df_detailed = pd.DataFrame({"Path": cmp.path, "ID": cmp.ids})
+    for j, model in enumerate(SOURCES):
+        for k, short in enumerate(CPE_SHORT):
+            df_detailed[f"{model}_{short}"] = np.where(cmp.presence[:, j, k], "✔️", "")  # Placeholder; will style in HTML/LaTeX
+    df_detailed.sort_values(by=['Path', 'ID'], inplace=True)
+
+    # One layout for the CSV, HTML and LaTeX versions; ticks are colored per source
+    tabular_layout = TableLayout(
+        [Column("Path"), Column("ID")] + [
+            Column(f"{model}_{short}", short, {"✔️": TICK_COLORS.get(model, AI_COLORS.get(model))}, narrow=True)
+            for model in SOURCES for short in CPE_SHORT
+        ],
+        groups=[("Image", 2), *[(model, len(CPE_SHORT)) for model in SOURCES]],
+        title="CPE Types per Image",
+    )
+
+    def tabular_rows():
+        return df_detailed.itertuples(index=False, name=None)
+
+    # CSV without coloring
+    detailed_csv = "compare-results/cpe_type_tabular.csv"
+    write_csv(detailed_csv, tabular_layout, tabular_rows())
+    print(f"Saved detailed CSV: {detailed_csv}")
+
+    # HTML with coloring
+    detailed_html = "compare-results/cpe_type_tabular.html"
+    write_html(detailed_html, tabular_layout, tabular_rows())
+    print(f"Saved detailed HTML: {detailed_html}")
+
+    # LaTeX with coloring (\cellcolor from colortbl), one multirow cell per path
+    detailed_latex = "compare-results/cpe_type_tabular.tex"
+    write_latex(detailed_latex, tabular_layout, tabular_rows(), caption="CPE types named per image",
+                label="tab:cpe_type_tabular", merge_first_column=True)
+    print(f"Saved detailed LaTeX: {detailed_latex}")
+
+
+    # <Grok here> New 1.1: let's make a very dense image like this:
+    # "" means put that string exactly.
+    # |...,X| means this cell span X cells below: e.g.
+    # |...,2|..............,6 |       
+    # |..|..|..|..|..|..|..|..|
+    #
+    # |.r.| this means put the 6 data values for the result group for the row
+    #
+    # |"Images",2 |"CRO",6|"ChatGPT",6|"Claude",6|"Gemini",6|"Grok",6|
+    # |<path>|<id>|.r.    | .r.       |   .r.    |   .r.    |  .r.   |
+    ai_short = {'ChatGPT': 'GPT', 'Claude': 'CLD', 'Gemini': 'Gem', 'Grok': 'GRK'}
+    confusion_ais = ['ChatGPT', 'Claude', 'Gemini', 'Grok']
+
+    # CRO-annotated images only; CRO columns: 1 if asserted, 0 else; AI columns: TP/FP/FN/TN codes
+    df_confusion = pd.DataFrame({'path': cmp.path[cmp.annotated], 'id': cmp.ids[cmp.annotated]})
+    cro_presence = cmp.presence[cmp.annotated][:, cmp.source('CRO'), :].astype(int)
+    for k, short in enumerate(CPE_SHORT):
+        df_confusion[f'CRO_{short}'] = cro_presence[:, k]
+    codes = confusion_codes(cmp, confusion_ais)
+    for a, ai in enumerate(confusion_ais):
+        for k, short in enumerate(CPE_SHORT):
+            df_confusion[f'{ai_short[ai]}_{short}'] = codes[:, a, k]
+    df_confusion.sort_values(by=['path', 'id'], key=lambda col: col.astype(int) if col.name == 'id' else col, inplace=True)
+    
+    confusion_csv = "compare-results/cpe_confusion_table.csv"
+    df_confusion.to_csv(confusion_csv, index=False)
+    print(f"Saved confusion CSV: {confusion_csv}")
+
+    # Figures: registered with the data they are drawn from; only the ones whose
+    # inputs changed since the last run are re-rendered (in parallel)
+    figures = FigureRegistry(FIGURE_HASHES)
+
+    # New 2: AI accuracy bar charts, all images and then one per path
+    figures.register("ai_accuracy_bar", "compare-results/ai_accuracy_bar.png", render_accuracy_bars,
+                     accuracy=accuracy_by_type(cmp, ai_order, np.ones(len(sorted_images), dtype=bool)),
+                     ai_order=ai_order, colors=AI_COLORS, cpe_types=CPE_TYPES,
+                     title='AI Accuracy by CPE Type')
+
+    for path_num in np.unique(cmp.path):
+        figures.register(f"path{path_num}_ai_accuracy_bar", f"compare-results/path{path_num}_ai_accuracy_bar.png",
+                         render_accuracy_bars,
+                         accuracy=accuracy_by_type(cmp, ai_order, cmp.path == path_num),
+                         ai_order=ai_order, colors=AI_COLORS, cpe_types=CPE_TYPES,
+                         title=f'AI Accuracy by CPE Type (Path {path_num} Images)')
+
+    # the spider chart did not look good. skip it. 
+    # 3: AI accuracy spider chart
+    # ...
+
+    # 4: Confusion matrix graphics (proposals)
+    # For each AI, create a heatmap confusion matrix for binary CPE detection (Yes/No vs CRO)
+    # Assuming binary for simplicity; extend to multi-label if needed
+    cms = detection_confusion_matrices(cmp, ai_order)
+    for ai in ai_order:
+        figures.register(f"{ai}_confusion_matrix", f"compare-results/{ai}_confusion_matrix.png",
+                         render_confusion_matrix, cm=cms[ai], ai=ai)
+
+    # New 4.1 / 4.2: combined heatmap and 3D bar chart
+    ai_sub_order = ['ChatGPT', 'Claude', 'Gemini', 'Grok']  # 2x2: top-left ChatGPT, top-right Claude, etc.
+    stacked = np.stack([cms[ai] for ai in ai_sub_order])
+    figures.register("combined_confusion_heatmap", "compare-results/combined_confusion_heatmap.png",
+                     render_combined_heatmap, stacked=stacked, ai_sub_order=ai_sub_order)
+    figures.register("combined_confusion_3d", "compare-results/combined_confusion_3d.png",
+                     render_combined_3d, stacked=stacked, ai_sub_order=ai_sub_order, colors=AI_COLORS)
+
+    figures.render(only=only_figures)
+
 if __name__ == "__main__":
-    print(JSON_FILES)
-    prog()
\ No newline at end of file
+    # optional figure names restrict rendering, e.g.  ... compare_cpe_results.py ai_accuracy_bar
+    print(SOURCES)
+    prog(only_figures=sys.argv[1:] or None)
\ No newline at end of file
@@ -1,35 +1,25 @@
-import json
 import os
-import csv
+import sys
+from pathlib import Path
 from typing import Dict, Any, Tuple
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common.cpe_types import COMPARED_CODES, presence
+from cpe_common.manifest import image_key
+from cpe_common.results_store import image_results
+from cpe_common.tables import CONFUSION_GROUPS, confusion_layout, write_csv
+
 # Define constants
-JSON_FILES = {
-    "Claude": "ai-results/cpe_detection_results_claude.json",
-    "ChatGPT": "ai-results/cpe_detection_results_chatgpt.json",
-    "Gemini": "ai-results/cpe_detection_results_gemini.json",
-    "Grok": "ai-results/cpe_detection_results_grok.json",
-    "CRO": "cro-results/cpe_detection_results_cro.json",
-}
+SOURCES = ["Claude", "ChatGPT", "Gemini", "Grok", "CRO"]   # results-store image sources
 
 CPE_TYPES = ["Dying cells", "Rounding", "Vacuolation", "Detached", "Granularity", "Refractile"]
-CPE_MATCH_TYPES = ["dying", "round", "vacuol", "detach", "granul", "refract"]
-CPETYPE_CODES = ["Dy", "Ro", "V", "D", "G", "Re"]
+CPETYPE_CODES = list(COMPARED_CODES)
 CPETYPE_NAMES = CPE_TYPES  # Alias for clarity
 
 AI_ABBRS = ["GPT", "CLD", "Gem", "GRK"]
 AI_FULLNAMES = ["ChatGPT", "Claude", "Gemini", "Grok"]
 
 # Provided functions
-def load_json(filename: str) -> Dict[str, Any]:
-    """Load JSON file, return dict of image → results."""
-    if not os.path.exists(filename):
-        print(f"Warning: {filename} not found. Skipping.")
-        return {}
-    with open(filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data
-
 def extract_cpe_summary(image_data: Dict[str, Any]) -> Tuple[str, str]:
     """Extract CPE detected (Yes/No/N/A) and types (str). Handles different formats."""
     # For models like ChatGPT/Claude/Grok/Gemini
@@ -56,48 +46,31 @@ def extract_cpe_summary(image_data: Dict[str, Any]) -> Tuple[str, str]:
     types_str = ", ".join(types_list) if types_list else "None"
     return detected, types_str
 
-def parse_image_name(image_name: str) -> Tuple[int, str]:
-    """Parse path number and ID from filename, e.g., EXP_path1_passage4_101.png -> (1, '101')"""
-    parts = image_name.split('_')
-    if len(parts) >= 3:
-        path_num = int(parts[1].replace('path', ''))
-        id_part = parts[-1].split('.')[0]  # Remove .png
-        return path_num, id_part
-    return 0, image_name  # Fallback
-
 def get_cpe_presence(types_list: list) -> Dict[str, bool]:
-    """Map CPE types to presence dict for tabular."""
-    presence = {typ: False for typ in CPE_TYPES}  # Use full CPE_TYPES as keys
-    if types_list is None:
-        types_list = []  # Handle None
-    for t in types_list:
-        for full_typ in CPE_TYPES:
-            if full_typ.lower() in t.lower() or any(match.lower() in t.lower() for match in CPE_MATCH_TYPES if match in full_typ.lower()):  # Enhanced fuzzy match
-                presence[full_typ] = True
-    return presence
+    """Map CPE types to presence dict for tabular (see cpe_common/cpe_types.py for the synonyms)."""
+    return dict(zip(CPE_TYPES, presence(types_list)))
 
 # Load all data
 datas = {}
-for key, path in JSON_FILES.items():
-    datas[key] = load_json(path)
+for key in SOURCES:
+    datas[key] = image_results(key, columns=["culture_state", "cpe_detected", "cpe_types", "full_response_text"])
 
 cro_data = datas["CRO"]
 
 # Get sorted images from CRO (ground truth)
-images = sorted(cro_data.keys(), key=lambda x: (parse_image_name(x)[0], int(parse_image_name(x)[1]) if parse_image_name(x)[1].isdigit() else parse_image_name(x)[1]))
+images = sorted(cro_data.keys(), key=image_key)
 
 # Prepare CSV
 output_dir = "compare-results"
 os.makedirs(output_dir, exist_ok=True)
 output_path = os.path.join(output_dir, "cpe_confusion_table_short.csv")
 
-with open(output_path, 'w', newline='') as csvfile:
-    fieldnames = ['path', 'id'] + [f"CRO_{code}" for code in CPETYPE_CODES] + sum([[f"{abbr}_{code}" for code in CPETYPE_CODES] for abbr in AI_ABBRS], [])
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
+layout = confusion_layout(CONFUSION_GROUPS, CPETYPE_CODES)
 
+
+def confusion_rows():
     for image_name in images:
-        path_num, id_part = parse_image_name(image_name)
+        path_num, id_part = image_key(image_name)
 
         # CRO presence
         _, types_str = extract_cpe_summary(cro_data[image_name])
@@ -135,6 +108,9 @@ with open(output_path, 'w', newline='') as csvfile:
                     val = 0  # True Negative
                 row[f"{abbr}_{code}"] = val
 
-        writer.writerow(row)
+        yield [row[column.name] for column in layout.columns]
+
+
+write_csv(output_path, layout, confusion_rows())
 
 print(f"CSV file created at: {output_path}")
\ No newline at end of file
@@ -0,0 +1,13 @@
+"""
+Code shared by the result folders (compare-results, cellpose-results, dvice-results, ...).
+
+Scripts in those folders are run from their own directory, so they put the repo
+root on sys.path before importing from here:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from cpe_common.results_store import read_table
+"""
+
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
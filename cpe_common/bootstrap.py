@@ -0,0 +1,118 @@
+"""
+Batched bootstrap confidence intervals for the confusion-rate metrics.
+
+Every model is reduced to per-image confusion outcomes (the codes used by the
+confusion tables: 1 TP, -1 FN, -2 FP, 0 TN; NaN where the model has no call),
+one column per CPE type or a single column for binary detectors. The outcomes of
+all models are one-hot encoded side by side into one [images, columns] matrix.
+Then B resamples of the images are drawn as a [B, images] index matrix and turned
+into per-image weights, and a single matrix product gives the TP/FN/FP/TN counts
+of every model in every resample:
+
+    models = {"AIRVIC": Outcomes(outcome_codes(gt, pred)),
+              "ChatGPT": Outcomes(type_codes, macro=True)}
+    table = bootstrap(models, n_resamples=10_000, seed=0)   # point estimate + CI per metric
+
+Resamples are generated in chunks with their own seeds (spawned from `seed`), so
+the result is the same with or without worker processes (`workers=4`).
+"""
+
+import warnings
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+METRICS = ["FP_rate", "FN_rate", "TP_rate", "TN_rate", "Accuracy"]
+OUTCOME_CODES = (1, -1, -2, 0)  # TP, FN, FP, TN
+
+
+def outcome_codes(gt, pred) -> np.ndarray:
+    """[images, 1] outcome codes of a binary detector."""
+    gt, pred = np.asarray(gt), np.asarray(pred)
+    codes = np.select([(gt == 1) & (pred == 1), (gt == 1) & (pred == 0), (gt == 0) & (pred == 1)], [1, -1, -2], 0)
+    return codes.reshape(-1, 1)
+
+
+@dataclass
+class Outcomes:
+    codes: np.ndarray       # [images, k] outcome codes, NaN = no prediction for that image
+    macro: bool = False     # True: rates per column, then averaged over columns; False: counts pooled over columns
+
+    def indicators(self) -> np.ndarray:
+        """[images, k * 4] one-hot TP/FN/FP/TN."""
+        codes = np.asarray(self.codes, dtype=float)
+        if codes.ndim == 1:
+            codes = codes[:, None]
+        return np.stack([codes == c for c in OUTCOME_CODES], axis=-1).reshape(len(codes), -1).astype(float)
+
+
+def rates(counts: np.ndarray, macro: bool) -> np.ndarray:
+    """[..., k, 4] TP/FN/FP/TN counts -> [..., 5] metrics in METRICS order (NaN where undefined)."""
+    if not macro:
+        counts = counts.sum(axis=-2, keepdims=True)
+    tp, fn, fp, tn = np.moveaxis(counts, -1, 0)
+    pos, neg = tp + fn, fp + tn
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN means
+        per_column = np.stack([
+            np.where(neg > 0, fp / neg, np.nan),
+            np.where(pos > 0, fn / pos, np.nan),
+            np.where(pos > 0, tp / pos, np.nan),
+            np.where(neg > 0, tn / neg, np.nan),
+            np.where(pos + neg > 0, (tp + tn) / (pos + neg), np.nan),
+        ], axis=-1)
+        return np.nanmean(per_column, axis=-2)
+
+
+def resample_weights(n: int, size: int, rng: np.random.Generator) -> np.ndarray:
+    """[size, n] number of times each image appears in each resample (index matrix -> counts)."""
+    idx = rng.integers(0, n, size=(size, n))
+    flat = (idx + n * np.arange(size)[:, None]).ravel()
+    return np.bincount(flat, minlength=size * n).reshape(size, n)
+
+
+def _resampled_counts(indicators: np.ndarray, size: int, seed) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return resample_weights(len(indicators), size, rng) @ indicators
+
+
+def bootstrap(models: dict[str, Outcomes], n_resamples: int = 10_000, confidence: float = 0.95,
+              seed: int = 0, workers: int = 1, chunk_size: int = 2_000) -> pd.DataFrame:
+    """
+    Point estimate and percentile CI of every metric for every model, resampling images.
+    All models must share the image axis (row i of every codes matrix is the same image).
+    Returns one row per model with columns <metric>, <metric>_low, <metric>_high.
+    """
+    blocks = {name: outcomes.indicators() for name, outcomes in models.items()}
+    n_images = {len(block) for block in blocks.values()}
+    if len(n_images) != 1:
+        raise ValueError("All models must be given on the same images")
+    indicators = np.hstack(list(blocks.values()))
+
+    sizes = [min(chunk_size, n_resamples - start) for start in range(0, n_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(_resampled_counts, [indicators] * len(sizes), sizes, seeds))
+    else:
+        chunks = [_resampled_counts(indicators, size, s) for size, s in zip(sizes, seeds)]
+    counts = np.vstack(chunks)          # [B, columns]
+    point_counts = indicators.sum(axis=0)
+
+    alpha = (1 - confidence) / 2
+    rows, start = [], 0
+    for name, block in blocks.items():
+        width, macro = block.shape[1], models[name].macro
+        point = rates(point_counts[start:start + width].reshape(-1, 4), macro)
+        resampled = rates(counts[:, start:start + width].reshape(len(counts), -1, 4), macro)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # metric undefined in every resample
+            low, high = np.nanpercentile(resampled, [100 * alpha, 100 * (1 - alpha)], axis=0)
+        row = {"model": name}
+        for i, metric in enumerate(METRICS):
+            row[metric], row[f"{metric}_low"], row[f"{metric}_high"] = point[i], low[i], high[i]
+        rows.append(row)
+        start += width
+    return pd.DataFrame(rows)
@@ -0,0 +1,203 @@
+"""
+Per-cell Cellpose features, streamed to a chunked Parquet dataset.
+
+analyze_cpe.py segments each image and appends one row per cell (area, perimeter,
+eccentricity, circularity, solidity, intensity mean/std/min/max and centroid) to
+cellpose-results/cells/part-NNNNN.parquet. Rows are buffered and flushed to a new
+part file once `rows_per_part` is reached, and only between images, so
+the cells of one image are always in a single part file:
+
+    with CellFeatureWriter("cells") as writer:
+        for filename in image_files:
+            ...
+            writer.append(cell_features(masks, img, filename))
+
+The helpers below read the dataset one record batch (or one part file) at a time,
+so memory is bounded by the part size, not by the number of cells on the plate:
+
+    histogram("cells", "area", bins=50, range=(0, 3000))      # counts, edges over all cells
+    quantiles("cells", "circularity", [0.1, 0.5, 0.9])        # from a fine histogram
+    per_image("cells", "eccentricity", q=(0.25, 0.5, 0.75))   # one row per image, exact
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from scipy import ndimage
+from skimage.measure import regionprops_table
+
+from cpe_common import profiling
+
+SCHEMA = pa.schema([
+    ("image", pa.dictionary(pa.int32(), pa.string())),
+    ("label", pa.int32()),
+    ("area", pa.float32()),
+    ("perimeter", pa.float32()),
+    ("eccentricity", pa.float32()),
+    ("circularity", pa.float32()),
+    ("solidity", pa.float32()),
+    ("intensity_mean", pa.float32()),
+    ("intensity_std", pa.float32()),
+    ("intensity_min", pa.float32()),
+    ("intensity_max", pa.float32()),
+    ("centroid_y", pa.float32()),
+    ("centroid_x", pa.float32()),
+])
+
+FEATURE_COLUMNS = [field.name for field in SCHEMA][2:]
+
+
+def cell_features(masks: np.ndarray, img: np.ndarray, image: str) -> dict[str, np.ndarray]:
+    """One entry per segmented cell (label > 0) of one image, columns as in SCHEMA."""
+    with profiling.span("regionprops", image=image):
+        props = regionprops_table(masks, properties=("label", "area", "perimeter", "eccentricity", "solidity", "centroid"))
+    labels = props["label"]
+    areas, perimeters = props["area"].astype(float), props["perimeter"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        circularities = 4 * np.pi * areas / (perimeters ** 2)
+    if len(labels):
+        # ndimage evaluates every label up to the largest, including unused ones (0 / 0 there)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = np.asarray(ndimage.mean(img, masks, labels))
+            stds = np.asarray(ndimage.standard_deviation(img, masks, labels))
+            mins = np.asarray(ndimage.minimum(img, masks, labels))
+            maxs = np.asarray(ndimage.maximum(img, masks, labels))
+    else:
+        means = stds = mins = maxs = np.empty(0)
+    return {
+        "image": np.full(len(labels), image, dtype=object),
+        "label": labels,
+        "area": areas,
+        "perimeter": perimeters,
+        "eccentricity": props["eccentricity"],
+        "circularity": circularities,
+        "solidity": props["solidity"],
+        "intensity_mean": means,
+        "intensity_std": stds,
+        "intensity_min": mins,
+        "intensity_max": maxs,
+        "centroid_y": props["centroid-0"],
+        "centroid_x": props["centroid-1"],
+    }
+
+
+class CellFeatureWriter:
+    """Buffers per-image cell tables and writes them as part-NNNNN.parquet files under `root`."""
+
+    def __init__(self, root, rows_per_part: int = 200_000, overwrite: bool = True, keep=None):
+        """overwrite=False appends to the existing parts; `keep` then prunes them to those images."""
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        if overwrite:
+            for part in parts(self.root):
+                part.unlink()
+        elif keep is not None:
+            self._prune(set(keep))
+        self.rows_per_part = rows_per_part
+        existing = [int(part.stem.split("-")[1]) for part in parts(self.root)]
+        self.parts = max(existing, default=-1) + 1
+        self.buffer: list[pa.Table] = []
+        self.buffered = 0
+
+    def append(self, cells: dict[str, np.ndarray]):
+        """Add one image's cells; flushes first if the buffer is already full."""
+        if self.buffered >= self.rows_per_part:
+            self.flush()
+        table = pa.table({name: pa.array(cells[name]).cast(SCHEMA.field(name).type) for name in SCHEMA.names},
+                         schema=SCHEMA)
+        self.buffer.append(table)
+        self.buffered += table.num_rows
+
+    def _prune(self, keep: set):
+        for part in parts(self.root):
+            table = pq.read_table(part)
+            mask = pc.is_in(table["image"].cast(pa.string()), value_set=pa.array(sorted(keep), pa.string()))
+            if pc.all(mask).as_py():
+                continue
+            kept = table.filter(mask)
+            if kept.num_rows:
+                pq.write_table(kept, part)
+            else:
+                part.unlink()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        table = pa.concat_tables(self.buffer).unify_dictionaries()
+        with profiling.span("write", rows=table.num_rows):
+            pq.write_table(table, self.root / f"part-{self.parts:05d}.parquet")
+        self.parts += 1
+        self.buffer, self.buffered = [], 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def parts(root) -> list[Path]:
+    return sorted(Path(root).glob("part-*.parquet"))
+
+
+def batches(root, columns, filter=None):
+    """Record batches of the given columns over the whole dataset."""
+    dataset = ds.dataset([str(p) for p in parts(root)], format="parquet", schema=SCHEMA)
+    yield from dataset.to_batches(columns=list(columns), filter=filter)
+
+
+def _values(batch, column) -> np.ndarray:
+    values = batch.column(column).to_numpy(zero_copy_only=False).astype(float)
+    return values[np.isfinite(values)]
+
+
+def value_range(root, column, filter=None) -> tuple[float, float]:
+    lo, hi = np.inf, -np.inf
+    for batch in batches(root, [column], filter):
+        values = _values(batch, column)
+        if len(values):
+            lo, hi = min(lo, values.min()), max(hi, values.max())
+    return lo, hi
+
+
+def histogram(root, column, bins=50, range=None, filter=None) -> tuple[np.ndarray, np.ndarray]:
+    """np.histogram over every cell, accumulated batch by batch (a first pass finds the range if not given)."""
+    if range is None:
+        range = value_range(root, column, filter)
+    edges = np.histogram_bin_edges([], bins=bins, range=range)
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    for batch in batches(root, [column], filter):
+        counts += np.histogram(_values(batch, column), bins=edges)[0]
+    return counts, edges
+
+
+def quantiles(root, column, q, bins=4096, range=None, filter=None) -> np.ndarray:
+    """Approximate quantiles (error below one bin width) interpolated from a fine streaming histogram."""
+    counts, edges = histogram(root, column, bins=bins, range=range, filter=filter)
+    cdf = np.r_[0, np.cumsum(counts)] / max(counts.sum(), 1)
+    return np.interp(np.asarray(q, dtype=float), cdf, edges)
+
+
+def per_image(root, column, q=(0.25, 0.5, 0.75)) -> pd.DataFrame:
+    """
+    Exact per-image distribution summary (count, mean, std, min, quantiles, max) of one
+    feature. Each part file holds whole images, so only one part is in memory at a time.
+    """
+    frames = []
+    for part in parts(root):
+        cells = pq.read_table(part, columns=["image", column]).to_pandas()
+        cells["image"] = cells["image"].astype(str)
+        grouped = cells.groupby("image", sort=False)[column]
+        summary = grouped.agg(["count", "mean", "std", "min", "max"])
+        for quantile in q:
+            summary[f"q{quantile:g}"] = grouped.quantile(quantile)
+        frames.append(summary)
+    if not frames:
+        return pd.DataFrame()
+    columns = ["count", "mean", "std", "min", *[f"q{quantile:g}" for quantile in q], "max"]
+    return pd.concat(frames)[columns]
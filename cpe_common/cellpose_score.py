@@ -0,0 +1,173 @@
+"""
+CPE probability from Cellpose per-image metrics (cellpose-results/cpe_metrics.csv).
+
+Each feature (cell count, confluency, area, circularity, eccentricity and the
+spatial statistics from cpe_common/spatial.py) is a metrics column rescaled
+linearly onto [0, 1] and clipped. The probability is a sigmoid of their weighted sum:
+
+    p = 1 / (1 + exp(-slope * (sum_i weight_i * feature_i - offset)))
+
+The whole metrics table is scored in one array expression, whatever its size:
+
+    DEFAULT.probability(metrics)                          # circularity + eccentricity, 0.57 / 0.43
+    scorer = fit(metrics, labels, features=("circularity", "eccentricity", "count"))
+    scorer.probability(metrics)
+
+fit() learns the weights and sigmoid constants against the CRO labels by ridge
+logistic regression. Cross-validation picks the penalty and reports held-out
+AUC/accuracy. The fitted scorer's repr can be pasted into
+compute_cpe_probability_minimal.py.
+
+Fit and cross-validate on the ground-truth images:  python -m cpe_common.cellpose_score --features circularity eccentricity
+"""
+
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# feature name -> (cpe_metrics.csv column, value mapped to 0, value mapped to 1)
+FEATURES = {
+    "count": ("cell_count", 0.0, 1000.0),
+    "confluency": ("confluency_percent", 0.0, 100.0),
+    "area": ("mean_area_px", 0.0, 2000.0),
+    "circularity": ("mean_circularity", 0.40, 1.0),
+    "eccentricity": ("mean_eccentricity", 0.0, 1.0),
+    # spatial statistics (cpe_common/spatial.py), written by analyze_cpe.py
+    "clark_evans": ("clark_evans", 0.0, 2.0),
+    "local_density": ("local_density_mean", 0.0, 20.0),
+    "abnormal": ("abnormal_fraction", 0.0, 1.0),
+    "abnormal_clustering": ("abnormal_clustered_fraction", 0.0, 1.0),
+}
+
+PENALTIES = (0.01, 0.1, 1.0, 10.0)
+
+
+def feature_matrix(metrics: pd.DataFrame, features) -> np.ndarray:
+    """[images, features] rescaled and clipped onto [0, 1]; undefined values (e.g. NN distance of a single cell) count as 0."""
+    columns = []
+    for name in features:
+        column, lo, hi = FEATURES[name]
+        if column not in metrics:
+            raise ValueError(f"Feature '{name}' needs column '{column}', which the metrics do not have "
+                             "(re-run analyze_cpe.py to add the spatial columns)")
+        columns.append(np.nan_to_num(np.clip((metrics[column].to_numpy(dtype=float) - lo) / (hi - lo), 0, 1)))
+    return np.column_stack(columns)
+
+
+@dataclass(frozen=True)
+class Scorer:
+    features: tuple[str, ...]
+    weights: tuple[float, ...]
+    slope: float
+    offset: float
+
+    def score(self, metrics: pd.DataFrame) -> np.ndarray:
+        """Weighted feature sum per image (before the sigmoid)."""
+        return (feature_matrix(metrics, self.features) * np.asarray(self.weights)).sum(axis=1)
+
+    def probability(self, metrics: pd.DataFrame) -> np.ndarray:
+        return 1 / (1 + np.exp(-self.slope * (self.score(metrics) - self.offset)))
+
+
+# the hand-set scorer used for the published Cellpose results
+DEFAULT = Scorer(features=("circularity", "eccentricity"), weights=(0.57, 0.43), slope=8.0, offset=0.55)
+
+
+def _logistic(X: np.ndarray, y: np.ndarray, penalty: float, iterations: int = 100) -> np.ndarray:
+    """Ridge logistic regression by Newton's method; returns [intercept, coef...] (intercept not penalised)."""
+    A = np.column_stack([np.ones(len(X)), X])
+    ridge = np.full(A.shape[1], penalty)
+    ridge[0] = 0.0
+    beta = np.zeros(A.shape[1])
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-A @ beta))
+        gradient = A.T @ (p - y) + ridge * beta
+        hessian = (A * (p * (1 - p))[:, None]).T @ A + np.diag(ridge)
+        step = np.linalg.solve(hessian + 1e-9 * np.eye(len(beta)), gradient)
+        beta -= step
+        if np.abs(step).max() < 1e-10:
+            break
+    return beta
+
+
+def _to_scorer(beta: np.ndarray, features) -> Scorer:
+    """Write logit = b0 + c.x as slope * (w.x - offset) with sum |w| = 1."""
+    intercept, coef = beta[0], beta[1:]
+    slope = float(np.abs(coef).sum()) or 1.0
+    return Scorer(features=tuple(features), weights=tuple(float(c) for c in coef / slope),
+                  slope=slope, offset=float(-intercept / slope))
+
+
+def _folds(y: np.ndarray, n_folds: int, seed: int) -> np.ndarray:
+    """Stratified fold number per image."""
+    rng = np.random.default_rng(seed)
+    fold = np.empty(len(y), dtype=int)
+    for label in (False, True):
+        members = rng.permutation(np.flatnonzero(y == label))
+        fold[members] = np.arange(len(members)) % n_folds
+    return fold
+
+
+def cross_validate(X: np.ndarray, y: np.ndarray, penalty: float, n_folds: int = 5, seed: int = 0) -> np.ndarray:
+    """Out-of-fold probability for every image."""
+    fold = _folds(y, n_folds, seed)
+    held_out = np.empty(len(y))
+    for k in range(n_folds):
+        test = fold == k
+        beta = _logistic(X[~test], y[~test], penalty)
+        held_out[test] = 1 / (1 + np.exp(-(beta[0] + X[test] @ beta[1:])))
+    return held_out
+
+
+def fit(metrics: pd.DataFrame, labels, features=DEFAULT.features, penalties=PENALTIES,
+        n_folds: int = 5, seed: int = 0) -> tuple[Scorer, pd.DataFrame]:
+    """
+    Learn weights and sigmoid constants for the given features against 0/1 labels
+    (aligned with the metrics rows). The penalty with the lowest held-out log-loss is
+    refitted on all images. Returns (scorer, one cross-validation row per penalty).
+    """
+    from cpe_common.roc import auc, roc_curve
+
+    X = feature_matrix(metrics, features)
+    y = np.asarray(labels, dtype=float)
+    rows = []
+    for penalty in penalties:
+        p = np.clip(cross_validate(X, y, penalty, n_folds, seed), 1e-12, 1 - 1e-12)
+        rows.append({
+            "penalty": penalty,
+            "log_loss": float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))),
+            "auc": auc(roc_curve(y, p)),
+            "accuracy": float(np.mean((p > 0.5) == y) * 100),
+        })
+    cv = pd.DataFrame(rows)
+    best = cv.loc[cv["log_loss"].idxmin(), "penalty"]
+    return _to_scorer(_logistic(X, y, best), features), cv
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the Cellpose CPE scorer against the CRO labels.")
+    parser.add_argument("--features", nargs="+", choices=list(FEATURES), default=list(DEFAULT.features))
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--metrics", default="cellpose-results/cpe_metrics.csv")
+    args = parser.parse_args()
+
+    from cpe_common import REPO_ROOT, ground_truth
+
+    metrics = pd.read_csv(REPO_ROOT / args.metrics)
+    metrics.index = ground_truth.image_index(metrics["image"])
+    labelled = ground_truth.align(metrics).dropna(subset=["image"])
+    y = ground_truth.y_true().loc[labelled.index]
+
+    scorer, cv = fit(labelled, y, features=args.features, n_folds=args.folds)
+    print(f"{len(y)} images, {args.folds}-fold cross-validation:")
+    print(cv.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    print(f"\n{scorer}")
+    for name, candidate in (("default", DEFAULT), ("fitted", scorer)):
+        p = candidate.probability(labelled)
+        print(f"{name:8s} in-sample accuracy {np.mean((p > 0.5) == y) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+One CPE-type vocabulary for ingestion (the LLM scripts) and comparison (compare-results).
+
+Free-text labels ("Rounded cells", "vacuoles", "rounding and detachment", ...) are
+mapped to canonical CPE codes with a single precompiled regex scan. Each synonym is
+a word prefix, so "detach" covers detached / detachment and "round" does not fire
+inside "background". Results are memoised per raw string, since models repeat the
+same few spellings thousands of times.
+
+    cpe_codes("Rounding and detachment")   -> ("Ro", "D")
+    canonical_names(["vacuoles", "lysed"]) -> ["vacuolation", "lysis"]
+
+COMPARED_CODES are the six types scored against the CRO annotations, in the
+column order used by the result tables (Dy, Ro, V, D, G, Re).
+"""
+
+import re
+import sys
+from functools import lru_cache
+
+# code -> (canonical name, word-prefix synonyms)
+CPE_VOCABULARY = {
+    "Dy": ("dying cells", ["dying"]),
+    "Ro": ("rounding", ["round"]),
+    "V": ("vacuolation", ["vacuo"]),
+    "D": ("detachment", ["detach"]),
+    "G": ("granularity", ["granul"]),
+    "Re": ("refractile cells", ["refrac"]),
+    "Ly": ("lysis", ["lys"]),
+    "Sy": ("syncytium formation", ["syncyt"]),
+    "IB": ("intranuclear inclusion bodies", ["inclusion", "intranuclear"]),
+    "Py": ("pyknosis", ["pyknos", "pyknot"]),
+    "Kx": ("karyorrhexis", ["karyorrhex"]),
+}
+
+COMPARED_CODES = ("Dy", "Ro", "V", "D", "G", "Re")
+
+CANONICAL_NAMES = {code: sys.intern(name) for code, (name, _) in CPE_VOCABULARY.items()}
+
+SYNONYM_PATTERN = re.compile(
+    "|".join(
+        rf"(?P<{code}>\b(?:{'|'.join(re.escape(s) for s in synonyms)}))"
+        for code, (_, synonyms) in CPE_VOCABULARY.items()
+    ),
+    re.IGNORECASE,
+)
+
+
+@lru_cache(maxsize=4096)
+def cpe_codes(label: str) -> tuple[str, ...]:
+    """Canonical codes mentioned in one free-text label, in order of first mention."""
+    codes = []
+    for match in SYNONYM_PATTERN.finditer(label):
+        if match.lastgroup not in codes:
+            codes.append(match.lastgroup)
+    return tuple(codes)
+
+
+@lru_cache(maxsize=4096)
+def _canonical_label(label: str) -> tuple[str, ...]:
+    codes = cpe_codes(label)
+    if codes:
+        return tuple(CANONICAL_NAMES[code] for code in codes)
+    # not a known CPE type (e.g. "micro-gaps"): keep the cleaned text
+    return (sys.intern(label.strip().lower()),)
+
+
+def canonical_names(labels) -> list[str]:
+    """Canonical, interned, de-duplicated names for a list of labels (None entries skipped)."""
+    names = []
+    for label in labels or ():
+        if label is None:
+            continue
+        for name in _canonical_label(str(label)):
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def presence(labels, codes=COMPARED_CODES) -> list[bool]:
+    """For each code in `codes`, whether any label mentions it."""
+    found = set()
+    for label in labels or ():
+        found.update(cpe_codes(str(label)))
+    return [code in found for code in codes]
@@ -0,0 +1,127 @@
+"""
+Figure registry: render only the figures whose inputs changed, in parallel.
+
+Each figure is registered with its output file, a module-level render function
+render(out_path, **inputs) and the data it is drawn from. The registry hashes the
+inputs together with the render function's source; a figure is re-rendered only
+when that hash differs from the one recorded for its file (or the file is
+missing). Stale figures are drawn in a process pool on the Agg backend.
+
+    figures = FigureRegistry("compare-results/.figure-hashes.json")
+    figures.register("ai_accuracy_bar", "compare-results/ai_accuracy_bar.png",
+                     render_accuracy_bars, accuracy=acc, ai_order=ais, title="...")
+    figures.render()                       # or figures.render(only=["ai_accuracy_bar"])
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def content_hash(obj) -> str:
+    """Stable hash of nested dicts/lists/tuples of scalars, strings and numpy arrays."""
+    digest = hashlib.sha256()
+
+    def feed(value):
+        if isinstance(value, np.ndarray):
+            digest.update(f"nd{value.dtype}{value.shape}".encode())
+            if value.dtype == object:
+                feed(value.tolist())
+            else:
+                digest.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            digest.update(b"{")
+            for key in sorted(value, key=repr):
+                feed(key)
+                feed(value[key])
+            digest.update(b"}")
+        elif isinstance(value, (list, tuple)):
+            digest.update(b"[" if isinstance(value, list) else b"(")
+            for item in value:
+                feed(item)
+            digest.update(b"]")
+        elif isinstance(value, (str, int, float, bool, np.generic)) or value is None:
+            digest.update(f"{type(value).__name__}:{value!r};".encode())
+        else:
+            digest.update(pickle.dumps(value))
+
+    feed(obj)
+    return digest.hexdigest()
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _render(render, out_path: str, inputs: dict) -> str:
+    _use_agg()
+    render(out_path, **inputs)
+    return out_path
+
+
+class FigureRegistry:
+    def __init__(self, hash_file: str):
+        self.hash_file = hash_file
+        self.figures = {}
+
+    def register(self, name: str, out_path: str, render, **inputs):
+        source = inspect.getsource(render)
+        self.figures[name] = {
+            "out_path": out_path,
+            "render": render,
+            "inputs": inputs,
+            "hash": content_hash({"render": source, "inputs": inputs}),
+        }
+
+    def _load_hashes(self) -> dict:
+        if os.path.exists(self.hash_file):
+            with open(self.hash_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def stale(self, only=None) -> list[str]:
+        recorded = self._load_hashes()
+        names = [n for n in self.figures if only is None or n in only]
+        return [
+            n for n in names
+            if recorded.get(self.figures[n]["out_path"]) != self.figures[n]["hash"]
+            or not os.path.exists(self.figures[n]["out_path"])
+        ]
+
+    def render(self, only=None, max_workers: int | None = None) -> list[str]:
+        """Render the stale figures (restricted to `only` if given); returns the files written."""
+        if only is not None:
+            unknown = set(only) - set(self.figures)
+            if unknown:
+                raise KeyError(f"Unknown figure(s): {', '.join(sorted(unknown))}. Known: {', '.join(self.figures)}")
+
+        todo = self.stale(only)
+        for name in self.figures:
+            if name not in todo and (only is None or name in only):
+                print(f"Up to date: {self.figures[name]['out_path']}")
+        if not todo:
+            return []
+
+        jobs = [(self.figures[n]["render"], self.figures[n]["out_path"], self.figures[n]["inputs"]) for n in todo]
+        if len(jobs) == 1:
+            written = [_render(*jobs[0])]
+        else:
+            workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+                written = list(pool.map(_render, *zip(*jobs)))
+
+        recorded = self._load_hashes()
+        for name in todo:
+            recorded[self.figures[name]["out_path"]] = self.figures[name]["hash"]
+        with open(self.hash_file, "w", encoding="utf-8") as f:
+            json.dump(recorded, f, indent=2, sort_keys=True)
+
+        for path in written:
+            print(f"Saved figure: {path}")
+        return written
@@ -0,0 +1,67 @@
+"""
+CRO ground truth, built once and shared by every stage.
+
+The label table (CRO_Dy ... CRO_Re and CRO_CPE = any of them, indexed by
+(path, id)) is the results store's ground_truth table, built from
+cro-results/cro_cpe_detections.csv. labels() memoises it per process keyed by the
+CSV's content hash, so repeated calls cost one small file hash and a dict lookup.
+The join helpers put labels next to detector results without re-reading or
+re-merging the CSV:
+
+    attach(dvice_df)                      # ground-truth images only, with CRO_CPE, in ground-truth order
+    attach(scores, how="left")            # keep every ground-truth image, NaN where df has no row
+    align(series_indexed_by_path_id)      # reindex anything keyed on (path, id) onto the ground-truth images
+    image_index(metrics["image"])         # (path, id) index from image file names
+
+Every result table in the repo identifies images by (path, id); file names such
+as EXP_path1_passage4_101.png are mapped onto that key rather than the other way round.
+"""
+
+import pandas as pd
+
+from cpe_common import REPO_ROOT
+from cpe_common.manifest import image_keys
+from cpe_common.results_store import CRO_CSV, file_hash, read_table
+
+KEY = ["path", "id"]
+
+_LABELS: dict[str, pd.DataFrame] = {}
+
+
+def labels() -> pd.DataFrame:
+    """CRO label table indexed by (path, id), sorted; memoised by the CRO CSV's content hash."""
+    digest = file_hash(REPO_ROOT / CRO_CSV)
+    table = _LABELS.get(digest)
+    if table is None:
+        _LABELS.clear()
+        table = _LABELS[digest] = read_table("ground_truth").set_index(KEY).sort_index()
+    return table
+
+
+def label_columns() -> list[str]:
+    """Per-type CRO columns (without the CRO_CPE summary)."""
+    return [column for column in labels().columns if column != "CRO_CPE"]
+
+
+def attach(df: pd.DataFrame, columns=("CRO_CPE",), how: str = "inner") -> pd.DataFrame:
+    """
+    Join ground-truth columns onto a frame with path/id columns, one row per ground-truth
+    image in ground-truth order. how="inner" drops images the frame lacks, "left" keeps them.
+    """
+    joined = labels()[list(columns)].join(df.set_index(KEY), how=how)
+    return joined.reset_index()
+
+
+def align(data):
+    """Reindex a Series/DataFrame indexed by (path, id) onto the ground-truth images."""
+    return data.reindex(labels().index)
+
+
+def y_true() -> pd.Series:
+    return labels()["CRO_CPE"]
+
+
+def image_index(names) -> pd.MultiIndex:
+    """(path, id) MultiIndex from image file names like EXP_path1_passage4_101.png."""
+    parts = image_keys(names)
+    return pd.MultiIndex.from_arrays([parts["path"].astype(int), parts["id"].astype(int)], names=KEY)
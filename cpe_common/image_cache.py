@@ -0,0 +1,153 @@
+"""
+Packed, memory-mapped cache of decoded images.
+
+build() decodes every image of the image root once and writes the pixels into one
+file, results-store/images.pack, each image starting on a page boundary. An index,
+results-store/images.json, records each image's offset, shape, SHA-256, size and
+mtime. Readers open the pack with np.memmap and get zero-copy read-only views, so
+nothing is decoded again on later runs. Worker processes that open the same pack
+share the OS page cache.
+
+    cache = ImageCache()                                  # empty if the pack was never built
+    img = cache.get("EXP_path1_passage4_101.png", sha256=digest)    # 2D uint8 view or None
+    img = cache.get(name, source="converted_pngs/" + name)          # validated by size/mtime
+
+Only images that decode to 2D uint8 (8-bit grayscale) are packed, so a cached view
+holds exactly the pixels Cellpose, DVICE and the tiling code would have read from
+the PNG. Anything else, or an image that changed since it was packed, returns None
+and the caller decodes the file as before. Rebuilds are incremental: unchanged
+images are copied over from the old pack rather than decoded.
+
+Build or refresh from the repo root:  python -m cpe_common.image_cache [--root converted_pngs]
+"""
+
+import argparse
+import json
+import os
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from cpe_common import REPO_ROOT
+from cpe_common.manifest import IMAGE_ROOT, image_files, scan
+
+PACK = REPO_ROOT / "results-store" / "images.pack"
+INDEX = PACK.with_suffix(".json")
+MAGIC = b"CPEPACK1"
+ALIGN = 4096
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+
+class ImageCache:
+    def __init__(self, pack=PACK, index=INDEX):
+        self.pack, self.entries, self._data = Path(pack), {}, None
+        try:
+            with open(index, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(self.pack, "rb") as f:
+                header = f.read(len(MAGIC) + 32)
+        except FileNotFoundError:
+            return
+        # index and pack are replaced one after the other; a mismatched pair is ignored
+        if header == MAGIC + meta["generation"].encode():
+            self.entries = meta["images"]
+
+    @property
+    def data(self) -> np.memmap:
+        if self._data is None:
+            self._data = np.memmap(self.pack, dtype=np.uint8, mode="r")
+        return self._data
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name: str, sha256: str | None = None, source=None) -> np.ndarray | None:
+        """
+        Read-only 2D uint8 view of a packed image, or None if it is not packed or is stale:
+        with sha256 the packed content hash must match, with source the file's size and mtime.
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if sha256 is not None and entry["sha256"] != sha256:
+            return None
+        if source is not None:
+            try:
+                stat = os.stat(source)
+            except FileNotFoundError:
+                return None
+            if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+                return None
+        height, width = entry["shape"]
+        return self.data[entry["offset"]:entry["offset"] + height * width].reshape(height, width)
+
+
+@lru_cache(maxsize=None)
+def default_cache() -> ImageCache:
+    """The repo's pack, opened once per process."""
+    return ImageCache()
+
+
+def _decode_gray(path) -> np.ndarray | None:
+    """Pixels of an 8-bit grayscale image, None for anything else (RGB, 16-bit, palette, ...)."""
+    with Image.open(path) as img:
+        if img.mode != "L":
+            return None
+        return np.asarray(img)
+
+
+def build(root=IMAGE_ROOT, pack=PACK, index=INDEX) -> dict:
+    """(Re)write the pack for every image under root; returns the new index entries."""
+    root, pack = Path(root), Path(pack)
+    manifest = scan(root)
+    manifest = manifest[manifest["image"].isin(image_files(manifest))]
+    old = ImageCache(pack, index)
+    generation = uuid.uuid4().hex
+    entries = {}
+    pack.parent.mkdir(parents=True, exist_ok=True)
+    tmp = pack.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as out:
+        out.write(MAGIC + generation.encode())
+        offset = _aligned(out.tell())
+        for row in manifest.itertuples():
+            pixels = old.get(row.image, sha256=row.sha256)
+            if pixels is None:
+                pixels = _decode_gray(root / row.image)
+            if pixels is None:
+                continue
+            out.seek(offset)
+            out.write(np.ascontiguousarray(pixels, dtype=np.uint8).tobytes())
+            entries[row.image] = {"offset": offset, "shape": list(pixels.shape), "sha256": row.sha256,
+                                  "size": int(row.size), "mtime_ns": int(row.mtime_ns)}
+            offset = _aligned(offset + pixels.size)
+        out.truncate(max(offset, out.tell()))
+    del old
+    os.replace(tmp, pack)
+    tmp_index = index.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_index, "w", encoding="utf-8") as f:
+        json.dump({"generation": generation, "root": str(root.resolve()), "images": entries}, f)
+    os.replace(tmp_index, index)
+    default_cache.cache_clear()
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack decoded grayscale images into one memory-mapped file.")
+    parser.add_argument("--root", default=str(IMAGE_ROOT))
+    args = parser.parse_args()
+    entries = build(args.root)
+    size = PACK.stat().st_size
+    print(f"Packed {len(entries)} images ({size / 2**20:.1f} MiB) into {PACK.relative_to(REPO_ROOT)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Per-well trajectories of the Cellpose metrics and CPE score across passages and days.
+
+Image names give the well and the time point:
+
+    EXP_path1_passage4_101.png          well path1/101, passage 4
+    EXP_path1_passage5_101_day3.png     same well, passage 5, day 3 (the _day<N> suffix is optional)
+
+A well is (path, id), i.e. the same sample followed through its passages. The
+trajectory table (one row per well and time point: cell count, confluency, CPE
+probability) is cached in cellpose-results/trajectories.parquet. update() only
+scores images the cache has not seen (or whose metrics row changed), so adding a
+new day costs that day's images; images no longer in the metrics are dropped. The whole cache is rescored only if the scorer
+changes. crossings() then flags wells whose CPE probability crosses the threshold:
+
+    tracker = Tracker()
+    tracker.update(pd.read_csv("cellpose-results/cpe_metrics.csv"))
+    tracker.crossings(threshold=0.5)    # one row per well: first crossing, last score, flagged
+
+python -m cpe_common.longitudinal --threshold 0.5 --csv well-crossings.csv
+"""
+
+import argparse
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cpe_common import REPO_ROOT
+from cpe_common.cellpose_score import DEFAULT, Scorer
+from cpe_common.manifest import image_keys
+
+CACHE = REPO_ROOT / "cellpose-results" / "trajectories.parquet"
+METRICS_CSV = REPO_ROOT / "cellpose-results" / "cpe_metrics.csv"
+
+TIME = ["passage", "day"]
+COLUMNS = ["image", "path", "id", *TIME, "cell_count", "confluency_percent", "cpe_probability", "metrics_hash"]
+
+
+def time_points(names) -> pd.DataFrame:
+    """path, id, passage, day (0 if absent) for each image name; rows that do not match are dropped."""
+    parts = image_keys(names)
+    parts.insert(0, "image", list(names))
+    return parts.dropna(subset=["path"]).astype({"path": int, "id": int, "passage": int, "day": int})
+
+
+class Tracker:
+    def __init__(self, cache=CACHE, scorer: Scorer = DEFAULT):
+        self.cache = cache
+        self.scorer = scorer
+        self.table = self._load()
+
+    def _load(self) -> pd.DataFrame:
+        try:
+            table = pq.read_table(self.cache)
+        except FileNotFoundError:
+            return pd.DataFrame(columns=COLUMNS)
+        # a cache scored by another scorer is dropped (rescoring is cheap next to segmentation)
+        if (table.schema.metadata or {}).get(b"scorer", b"").decode() != repr(self.scorer):
+            return pd.DataFrame(columns=COLUMNS)
+        return table.to_pandas()
+
+    def update(self, metrics: pd.DataFrame) -> pd.DataFrame:
+        """
+        Score the images of `metrics` (cpe_metrics.csv rows) that are new or changed; returns their rows.
+        `metrics` is the whole current set: cached images that are not in it (deleted or renamed) are dropped.
+        """
+        hashes = pd.util.hash_pandas_object(metrics, index=False).to_numpy()
+        cached = set(zip(self.table["image"], self.table["metrics_hash"]))
+        changed = [(image, h) not in cached for image, h in zip(metrics["image"], hashes)]
+        new = metrics[changed].assign(metrics_hash=hashes[changed])
+        keys = time_points(new["image"])
+        kept = self.table[self.table["image"].isin(metrics["image"]) & ~self.table["image"].isin(keys["image"])]
+        if keys.empty and len(kept) == len(self.table):
+            return keys
+        rows = keys
+        if not keys.empty:
+            new = new.set_index("image").loc[keys["image"]]
+            rows = keys.assign(cell_count=new["cell_count"].to_numpy(),
+                               confluency_percent=new["confluency_percent"].to_numpy(),
+                               cpe_probability=self.scorer.probability(new),
+                               metrics_hash=new["metrics_hash"].to_numpy())[COLUMNS]
+        parts = [frame for frame in (kept, rows) if not frame.empty]
+        self.table = (pd.concat(parts, ignore_index=True).sort_values(["path", "id", *TIME], ignore_index=True)
+                      if parts else pd.DataFrame(columns=COLUMNS))
+        self._save()
+        return rows
+
+    def _save(self):
+        table = pa.Table.from_pandas(self.table, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"scorer": repr(self.scorer).encode()})
+        tmp = self.cache.with_suffix(".tmp")
+        pq.write_table(table, tmp)
+        tmp.replace(self.cache)
+
+    def trajectories(self) -> pd.DataFrame:
+        """Time-ordered rows per well, indexed by (path, id, passage, day)."""
+        return self.table.set_index(["path", "id", *TIME])
+
+    def crossings(self, threshold: float = 0.5) -> pd.DataFrame:
+        """
+        One row per well: number of time points, first and last CPE probability, the first
+        time point at or above the threshold that follows one below it, and whether the
+        well is flagged (it crossed, i.e. went from below to at/above the threshold).
+        """
+        table = self.table
+        wells = table.groupby(["path", "id"], sort=True)
+        above = table["cpe_probability"] >= threshold
+        crossed = above & ~above.groupby([table["path"], table["id"]]).shift(fill_value=True)
+        first_crossing = table[crossed].groupby(["path", "id"])[TIME].first()
+        summary = pd.DataFrame({
+            "time_points": wells.size(),
+            "first_probability": wells["cpe_probability"].first(),
+            "last_probability": wells["cpe_probability"].last(),
+        })
+        summary = summary.join(first_crossing.rename(columns={t: f"crossed_at_{t}" for t in TIME}))
+        summary["flagged"] = summary["crossed_at_passage"].notna()
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update per-well CPE trajectories and flag threshold crossings.")
+    parser.add_argument("--metrics", default=str(METRICS_CSV), help="per-image Cellpose metrics")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--csv", help="write the per-well summary to this CSV")
+    args = parser.parse_args()
+
+    tracker = Tracker()
+    new = tracker.update(pd.read_csv(args.metrics))
+    print(f"{len(new)} new time points, {len(tracker.table)} cached")
+    summary = tracker.crossings(args.threshold)
+    multi = summary[summary["time_points"] > 1]
+    print(f"{len(summary)} wells, {len(multi)} with more than one time point, {int(summary['flagged'].sum())} flagged")
+    if summary["flagged"].any():
+        print(summary[summary["flagged"]].to_string(float_format=lambda v: f"{v:.4f}"))
+    if args.csv:
+        summary.to_csv(args.csv)
+        print(f"Saved: {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Dataset index: one scan of the image folder, one filename pattern, one manifest.
+
+Every image name is parsed by IMAGE_NAME_PATTERN (path, passage, id and an
+optional _day<N> suffix):
+
+    parse_image_name("EXP_path1_passage4_101.png")   -> ImageKey(path=1, passage=4, id=101, day=0)
+    image_key("EXP_path1_passage4_101.png")          -> (1, 101)      # the (path, id) join key
+    image_keys(df["image"])                          -> DataFrame path/passage/id/day, vectorized
+
+scan() lists an image root and writes its manifest with one row per image file:
+name, path, passage, id, day, size, mtime and SHA-256. Each root has its own file,
+results-store/manifest-<hash of the root>.parquet (manifest_path()), so scanning a
+test folder leaves the manifest of converted_pngs alone. Rescans are incremental:
+a file whose (size, mtime) is unchanged keeps its cached hash, so only new or
+modified images are read. Files that do not follow the naming scheme are still
+listed, with empty metadata.
+
+    manifest = scan()                       # DataFrame, sorted by name
+    image_files(manifest)                   # the names the engines process
+    lookup(1, 101)                          # file name of well path1/101 (latest passage/day)
+
+Hashes are computed by file_sha256 (mmap, fixed-size chunks) on a thread pool;
+hashlib releases the GIL on large buffers, so a corpus hashes at disk speed.
+verify() rehashes every file to catch changes that kept size and mtime, and
+duplicates() groups byte-identical images.
+
+Engines record the image hash and a hash of their configuration (config_hash())
+with every result. pending() then tells them what to do with each image:
+
+    plan = pending(names, hashes, recorded, config_hash(model, prompt, settings))
+    plan.run      # new or changed images (or new configuration): score these
+    plan.copy     # {duplicate: image with the same bytes}: reuse that result
+    plan.adopt    # results from before hashes were recorded (only with adopt_unhashed=True)
+
+Rebuild from the repo root:  python -m cpe_common.manifest [--root converted_pngs] [--verify]
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cpe_common import REPO_ROOT
+
+IMAGE_NAME_PATTERN = re.compile(r"EXP_path(?P<path>\d+)_passage(?P<passage>\d+)_(?P<id>\d+)(?:_day(?P<day>\d+))?")
+
+IMAGE_ROOT = REPO_ROOT / "converted_pngs"
+MANIFEST_DIR = REPO_ROOT / "results-store"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+HASH_CHUNK = 8 << 20
+
+MANIFEST_SCHEMA = pa.schema([
+    ("image", pa.string()),
+    ("path", pa.int32()),
+    ("passage", pa.int32()),
+    ("id", pa.int32()),
+    ("day", pa.int32()),
+    ("size", pa.int64()),
+    ("mtime_ns", pa.int64()),
+    ("sha256", pa.string()),
+])
+
+
+class ImageKey(NamedTuple):
+    path: int
+    passage: int
+    id: int
+    day: int
+
+
+@lru_cache(maxsize=None)
+def parse_image_name(image_name: str) -> ImageKey | None:
+    """Metadata encoded in an image name, or None if it does not follow the naming scheme."""
+    match = IMAGE_NAME_PATTERN.search(image_name)
+    if match is None:
+        return None
+    return ImageKey(int(match["path"]), int(match["passage"]), int(match["id"]), int(match["day"] or 0))
+
+
+def image_key(image_name: str) -> tuple[int, int]:
+    """(path, id) from e.g. EXP_path1_passage4_101.png."""
+    key = parse_image_name(image_name)
+    if key is None:
+        raise ValueError(f"Unrecognised image name: {image_name}")
+    return key.path, key.id
+
+
+def image_keys(names) -> pd.DataFrame:
+    """path, passage, id, day (nullable Int32, <NA> where the name does not match) for many names at once."""
+    parts = pd.Series(list(names), dtype=str).str.extract(IMAGE_NAME_PATTERN)
+    parts["day"] = parts["day"].where(parts["path"].isna(), parts["day"].fillna("0"))
+    return parts.astype("Int32")
+
+
+def file_sha256(path) -> str:
+    """SHA-256 of a file, fed to hashlib in HASH_CHUNK slices of a read-only mmap."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:  # an empty file cannot be mapped
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for start in range(0, size, HASH_CHUNK):
+                    with view[start:start + HASH_CHUNK] as chunk:
+                        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(paths, workers: int | None = None) -> list[str]:
+    """file_sha256 of every path, in order, on a thread pool."""
+    paths = list(paths)
+    if len(paths) < 2:
+        return [file_sha256(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as pool:
+        return list(pool.map(file_sha256, paths))
+
+
+def manifest_path(root=IMAGE_ROOT) -> Path:
+    """Manifest file of an image root: one per resolved root path."""
+    digest = hashlib.sha256(str(Path(root).resolve()).encode()).hexdigest()[:12]
+    return MANIFEST_DIR / f"manifest-{digest}.parquet"
+
+
+def load(manifest=None, root=IMAGE_ROOT) -> pd.DataFrame:
+    """The last manifest written for root (empty if there is none, or if it was scanned from another root)."""
+    manifest = manifest_path(root) if manifest is None else Path(manifest)
+    try:
+        table = pq.read_table(manifest)
+    except FileNotFoundError:
+        table = MANIFEST_SCHEMA.empty_table()
+    if root is not None and (table.schema.metadata or {}).get(b"root") != str(Path(root).resolve()).encode():
+        table = MANIFEST_SCHEMA.empty_table()
+    return table.to_pandas()
+
+
+def scan(root=IMAGE_ROOT, manifest=None) -> pd.DataFrame:
+    """List the image root, hashing only new or changed files, and write the manifest."""
+    manifest = manifest_path(root) if manifest is None else Path(manifest)
+    previous = load(manifest, root).set_index("image")
+    rows, stale = [], []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            if entry.name in previous.index and previous.at[entry.name, "size"] == stat.st_size \
+                    and previous.at[entry.name, "mtime_ns"] == stat.st_mtime_ns:
+                digest = previous.at[entry.name, "sha256"]
+            else:
+                digest = None
+                stale.append((len(rows), entry.path))
+            rows.append([entry.name, stat.st_size, stat.st_mtime_ns, digest])
+    for (i, _), digest in zip(stale, hash_files(path for _, path in stale)):
+        rows[i][3] = digest
+
+    table = pd.DataFrame(rows, columns=["image", "size", "mtime_ns", "sha256"]).sort_values("image", ignore_index=True)
+    table = pd.concat([table[["image"]], image_keys(table["image"]), table[["size", "mtime_ns", "sha256"]]], axis=1)
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = manifest.with_suffix(f".{os.getpid()}.tmp")
+    arrow = pa.Table.from_pandas(table, schema=MANIFEST_SCHEMA, preserve_index=False)
+    pq.write_table(arrow.replace_schema_metadata({b"root": str(Path(root).resolve()).encode()}), tmp)
+    os.replace(tmp, manifest)
+    return table
+
+
+def verify(root=IMAGE_ROOT, manifest=None, workers: int | None = None) -> pd.DataFrame:
+    """Rehash every file listed in the manifest; returns the rows whose content no longer matches (or that are gone)."""
+    table = load(manifest, root)
+    paths = [Path(root) / name for name in table["image"]]
+    present = [p.is_file() for p in paths]
+    current = iter(hash_files([p for p, ok in zip(paths, present) if ok], workers))
+    table["current_sha256"] = [next(current) if ok else None for ok in present]
+    return table[table["current_sha256"] != table["sha256"]]
+
+
+def duplicates(manifest: pd.DataFrame) -> dict[str, list[str]]:
+    """{sha256: image names} for every content shared by more than one file."""
+    groups = manifest.groupby("sha256")["image"].apply(sorted)
+    return {digest: names for digest, names in groups.items() if len(names) > 1}
+
+
+def config_hash(*parts) -> str:
+    """Stable hash of an engine configuration (model names, prompts, settings, dataclasses as dicts)."""
+    def plain(obj):
+        if hasattr(obj, "__dataclass_fields__"):
+            return {name: getattr(obj, name) for name in obj.__dataclass_fields__}
+        return str(obj)
+    text = json.dumps(parts, sort_keys=True, default=plain)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@dataclass
+class Plan:
+    run: list[str] = field(default_factory=list)
+    copy: dict[str, str] = field(default_factory=dict)
+    adopt: list[str] = field(default_factory=list)
+    up_to_date: list[str] = field(default_factory=list)
+
+
+def pending(images, hashes: dict, recorded: dict, config: str, adopt_unhashed: bool = False) -> Plan:
+    """
+    Decide per image whether its stored result is still valid.
+    hashes: {image: sha256}; recorded: {image: (image_sha256, config_hash)} of the stored results
+    (None where a result predates hashing). A result is valid if both hashes match. Images
+    without a valid result are scored once per distinct content: later byte-identical ones,
+    and any whose bytes match a valid result under another name, are copies.
+    adopt_unhashed keeps results that carry no hashes (to be stamped with the current ones)
+    instead of re-scoring them, for engines where a re-run is expensive.
+    """
+    plan = Plan()
+    # valid stored results by content: the recorded hash still matches the file on disk
+    known = {(digest, cfg): image for image, (digest, cfg) in recorded.items()
+             if digest is not None and digest == hashes.get(image)}
+    for image in images:
+        digest = hashes[image]
+        stored = recorded.get(image)
+        if stored == (digest, config):
+            plan.up_to_date.append(image)
+        elif stored is not None and stored[0] is None and adopt_unhashed:
+            plan.adopt.append(image)
+        elif (digest, config) in known:
+            plan.copy[image] = known[(digest, config)]
+        else:
+            plan.run.append(image)
+            known[(digest, config)] = image
+    return plan
+
+
+def image_files(manifest: pd.DataFrame, extensions=IMAGE_EXTENSIONS) -> list[str]:
+    """Sorted image names in the manifest with one of the given extensions."""
+    names = manifest["image"]
+    return sorted(names[names.str.lower().str.endswith(tuple(extensions))])
+
+
+def lookup(path: int, id: int, passage: int | None = None, manifest: pd.DataFrame | None = None) -> str | None:
+    """File name of an image by (path, id) in the converted_pngs manifest, optionally at one passage; the latest time point if several match."""
+    manifest = load() if manifest is None else manifest
+    hit = manifest[(manifest["path"] == path) & (manifest["id"] == id)]
+    if passage is not None:
+        hit = hit[hit["passage"] == passage]
+    if hit.empty:
+        return None
+    return hit.sort_values(["passage", "day"])["image"].iloc[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan the image folder and update the dataset manifest.")
+    parser.add_argument("--root", default=str(IMAGE_ROOT))
+    parser.add_argument("--verify", action="store_true", help="rehash every image and report content changes")
+    args = parser.parse_args()
+    table = scan(args.root)
+    unparsed = table["path"].isna().sum()
+    print(f"{len(table)} images in {args.root} ({unparsed} not following the EXP_path<P>_passage<N>_<id> scheme)")
+    for digest, names in duplicates(table).items():
+        print(f"Byte-identical: {', '.join(names)}")
+    print(f"Saved: {manifest_path(args.root).relative_to(REPO_ROOT)}")
+    if args.verify:
+        changed = verify(args.root)
+        print(f"Verified: {len(table) - len(changed)} unchanged, {len(changed)} changed or missing")
+        for name in changed["image"]:
+            print(f"  {name}")
+
+
+if __name__ == "__main__":
+    main()
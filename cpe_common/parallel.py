@@ -0,0 +1,109 @@
+"""
+Process pool for the CPU-heavy engines (Cellpose, DVICE), with images handed to the
+workers in shared memory.
+
+The parent decodes each image and copies the pixels into a
+multiprocessing.shared_memory block. A worker only receives the block's name, shape
+and dtype, maps the same pages, and runs the engine on that array. Results (small
+dicts / per-cell arrays) come back over a queue and are written by the parent, so
+CSVs and the per-cell Parquet dataset still have a single writer. At most
+`max_in_flight` images are decoded and unfinished at any time: the parent stops
+decoding until a worker hands a result back, so memory stays bounded whatever the
+corpus size.
+
+    for image, result in run(images, load, work, init=load_models, init_args=(paths,), processes=4):
+        ...
+
+load(image) -> ndarray runs in the parent. init(*init_args) runs once per worker
+(e.g. to load the models) and its return value is passed to every
+work(state, image, pixels) call. work and init must be module-level functions. With
+processes <= 1 everything runs inline in the parent, in order, with no copies.
+Workers are started with "spawn" (TensorFlow and CUDA do not survive a fork), so
+scripts using the pool need an `if __name__ == "__main__":` guard.
+"""
+
+import multiprocessing as mp
+import queue
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+POLL_SECONDS = 1.0
+
+
+def _worker(init, init_args, work, tasks, results):
+    state = init(*init_args) if init is not None else None
+    while (task := tasks.get()) is not None:
+        seq, image, block, shape, dtype = task
+        shm = shared_memory.SharedMemory(name=block)
+        try:
+            pixels = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            results.put((seq, work(state, image, pixels), None))
+        except Exception:
+            results.put((seq, None, traceback.format_exc()))
+        finally:
+            pixels = None
+            shm.close()
+
+
+def _inline(images, load, work, init, init_args):
+    state = init(*init_args) if init is not None else None
+    for image in images:
+        yield image, work(state, image, load(image))
+
+
+def run(images, load, work, init=None, init_args=(), processes: int = 1, max_in_flight: int | None = None):
+    """Yield (image, work result) for every image; in completion order when processes > 1."""
+    if processes <= 1:
+        yield from _inline(images, load, work, init, init_args)
+        return
+
+    max_in_flight = max_in_flight or 2 * processes
+    ctx = mp.get_context("spawn")
+    tasks, results = ctx.Queue(), ctx.Queue()
+    workers = [ctx.Process(target=_worker, args=(init, init_args, work, tasks, results), daemon=True)
+               for _ in range(processes)]
+    for w in workers:
+        w.start()
+    in_flight = {}  # submission number -> (image, its shared-memory block), released once the result is back
+
+    def collect():
+        while True:
+            try:
+                seq, result, error = results.get(timeout=POLL_SECONDS)
+                break
+            except queue.Empty:
+                dead = [w for w in workers if not w.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Worker exited with code {dead[0].exitcode} while images were pending")
+        image, shm = in_flight.pop(seq)
+        shm.close()
+        shm.unlink()
+        if error is not None:
+            raise RuntimeError(f"Worker failed on {image}:\n{error}")
+        return image, result
+
+    try:
+        for seq, image in enumerate(images):
+            while len(in_flight) >= max_in_flight:
+                yield collect()
+            pixels = np.ascontiguousarray(load(image))
+            shm = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+            np.ndarray(pixels.shape, dtype=pixels.dtype, buffer=shm.buf)[...] = pixels
+            in_flight[seq] = image, shm
+            tasks.put((seq, image, shm.name, pixels.shape, pixels.dtype.str))
+            del pixels
+        while in_flight:
+            yield collect()
+        for _ in workers:
+            tasks.put(None)
+        for w in workers:
+            w.join()
+    finally:
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+        for _, shm in in_flight.values():
+            shm.close()
+            shm.unlink()
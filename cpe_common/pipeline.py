@@ -0,0 +1,384 @@
+"""
+Incremental build of the results pipeline.
+
+Every script that turns results into other results is declared below as a Step
+with the files it reads and writes (paths relative to the repo root). Edges are
+implied: a step depends on whichever step writes one of its inputs. Running
+
+    python -m cpe_common.pipeline                 # bring everything up to date
+    python -m cpe_common.pipeline aggregate       # just this step and what it needs
+    python -m cpe_common.pipeline --dry-run       # show what would run and why
+    python -m cpe_common.pipeline --list          # all steps with their status
+
+re-runs a step only when the content of one of its inputs (its script included)
+differs from the last successful run, or one of its outputs is missing or was
+changed by hand. Content hashes are kept in .pipeline-state.json. Because a step is
+checked after its dependencies have run, a rebuild that reproduces the same output
+bytes stops there; a dry run cannot tell, so it lists every step downstream of a
+stale one. Steps whose dependencies are done run in parallel subprocesses,
+each from the folder its script expects to be run from.
+
+Manual steps (the LLM scripts, Cellpose and DVICE inference) need API keys, a GPU
+or the model files, so they are only run when named explicitly; otherwise their
+outputs are treated as sources. The LLM scripts write their JSON to the repo root;
+the store reads the copies in ai-results/, so an LLM step publishes its JSON there
+after a successful run, and a new run makes the store and everything after it stale.
+The paper/*.tex tables are transcribed from the CSVs by hand and are not tracked.
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import threading
+import subprocess
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from cpe_common import REPO_ROOT
+from cpe_common.results_store import TABLES, table_path
+
+STATE_FILE = REPO_ROOT / ".pipeline-state.json"
+
+
+@dataclass
+class Step:
+    name: str
+    script: str                 # repo-relative; always counted as an input
+    inputs: list[str]
+    outputs: list[str]
+    cwd: str = "."              # folder the script is run from
+    module: str | None = None   # run as `python -m module` instead of the script path
+    manual: bool = False
+    args: list[str] = field(default_factory=list)
+    publish: dict[str, str] = field(default_factory=dict)  # output -> where a successful run copies it (also an output)
+
+    def command(self) -> list[str]:
+        if self.module:
+            return [sys.executable, "-m", self.module, *self.args]
+        script = os.path.relpath(REPO_ROOT / self.script, REPO_ROOT / self.cwd)
+        return [sys.executable, script, *self.args]
+
+
+def _store_inputs() -> list[str]:
+    return sorted({source for _, sources in TABLES.values() for source in sources})
+
+
+STORE_TABLES = [str(table_path(name).relative_to(REPO_ROOT)).replace(os.sep, "/") for name in TABLES]
+
+# stages ahead of the store build its ground_truth table themselves (ground_truth.labels()),
+# so they depend on the CRO CSV and the code rather than on the store step
+GROUND_TRUTH = ["cro-results/cro_cpe_detections.csv", "cpe_common/ground_truth.py", "cpe_common/results_store.py",
+                "cpe_common/manifest.py"]
+
+COMPARE_FIGURES = [
+    "compare-results/ai_accuracy_bar.png",
+    "compare-results/path1_ai_accuracy_bar.png",
+    "compare-results/path2_ai_accuracy_bar.png",
+    "compare-results/ChatGPT_confusion_matrix.png",
+    "compare-results/Claude_confusion_matrix.png",
+    "compare-results/Gemini_confusion_matrix.png",
+    "compare-results/Grok_confusion_matrix.png",
+    "compare-results/combined_confusion_heatmap.png",
+    "compare-results/combined_confusion_3d.png",
+]
+
+LLM_STEPS = [
+    Step(f"llm_{ai}", f"ai-impage-processing/individual_image_{ai}.py",
+         inputs=["converted_pngs", "ai-impage-processing/cpe_core.py", "ai-impage-processing/providers.py",
+                 "ai-impage-processing/tiling.py", "cpe_common/manifest.py"],
+         outputs=[f"cpe_detection_results_{ai}.json", f"ai-results/cpe_detection_results_{ai}.json"],
+         publish={f"cpe_detection_results_{ai}.json": f"ai-results/cpe_detection_results_{ai}.json"}, manual=True)
+    for ai in ("chatgpt", "claude", "gemini", "grok")
+]
+
+STEPS = [
+    *LLM_STEPS,
+    Step("cellpose_segment", "cellpose-results/analyze_cpe.py", cwd="cellpose-results", manual=True,
+         inputs=["converted_pngs", "cpe_common/manifest.py", "cpe_common/cell_features.py", "cpe_common/spatial.py"],
+         outputs=["cellpose-results/cpe_metrics.csv", "cellpose-results/cells"]),
+    Step("cellpose_probability", "cellpose-results/compute_cpe_probability_minimal.py", cwd="cellpose-results",
+         inputs=["cellpose-results/cpe_metrics.csv", "cpe_common/cellpose_score.py", *GROUND_TRUTH],
+         outputs=["cellpose-results/cellpose-results.csv"]),
+    Step("dvice_inference", "dvice-results/dvice_analysis.py", cwd="dvice-results", manual=True,
+         inputs=["converted_pngs", "cpe_common/manifest.py", "dvice-results/resources"],
+         outputs=["dvice-results/dvice-results.csv"]),
+    Step("dvice_postprocess", "dvice-results/postprocess_dvice.py", cwd="dvice-results",
+         inputs=["dvice-results/dvice-results.csv", *GROUND_TRUTH],
+         outputs=["dvice-results/dvice-final-results.csv"]),
+    Step("results_store", "cpe_common/results_store.py", module="cpe_common.results_store",
+         inputs=_store_inputs(),
+         outputs=STORE_TABLES),
+    Step("compare", "compare-results/compare_cpe_results.py",
+         inputs=[*STORE_TABLES, "cpe_common/cpe_types.py", "cpe_common/figures.py", "cpe_common/tables.py",
+                 "cpe_common/manifest.py"],
+         outputs=["compare-results/cpe_comparison_table.csv", "compare-results/cpe_comparison_table.html",
+                  "compare-results/cpe_type_tabular.csv", "compare-results/cpe_type_tabular.html",
+                  "compare-results/cpe_type_tabular.tex", "compare-results/cpe_confusion_table.csv",
+                  *COMPARE_FIGURES]),
+    Step("confusion_table", "compare-results/create_confusion_table.py",
+         inputs=[*STORE_TABLES, "cpe_common/cpe_types.py", "cpe_common/tables.py", "cpe_common/manifest.py"],
+         outputs=["compare-results/cpe_confusion_table_short.csv"]),
+    Step("confusion_table_html", "compare-results/create_confusion_table_html.py",
+         inputs=["compare-results/cpe_confusion_table_short.csv", "cpe_common/tables.py"],
+         outputs=["compare-results/cpe_confusion_table.html"]),
+    Step("confusion_table_tex", "compare-results/create_confusion_table_tex.py",
+         inputs=["compare-results/cpe_confusion_table_short.csv", "cpe_common/tables.py"],
+         outputs=["compare-results/cpe_confusion_table.tex"]),
+    Step("aggregate", "compare-results/aggregate_results.py", cwd="compare-results",
+         inputs=["compare-results/cpe_confusion_table.csv", *STORE_TABLES, "cpe_common/bootstrap.py",
+                 "cpe_common/ground_truth.py"],
+         outputs=["compare-results/aggregate-results.csv"]),
+    Step("cellpose_sensitivity", "cellpose-results/sensitivity_study.py", cwd="cellpose-results",
+         inputs=[*STORE_TABLES, "cpe_common/roc.py", "cpe_common/ground_truth.py"],
+         outputs=["cellpose-results/sweep-results.csv", "cellpose-results/aucroc-results.csv",
+                  "cellpose-results/operating-point-results.csv"]),
+    Step("dvice_sensitivity", "dvice-results/sensitivity_study.py", cwd="dvice-results",
+         inputs=[*STORE_TABLES, "cpe_common/roc.py", "cpe_common/ground_truth.py"],
+         outputs=["dvice-results/sweep-results.csv", "dvice-results/aucroc-results.csv",
+                  "dvice-results/operating-point-results.csv"]),
+]
+
+
+# ---------------------------------------------------------------------------
+# Graph
+# ---------------------------------------------------------------------------
+
+class Pipeline:
+    def __init__(self, steps: list[Step]):
+        self.steps = {step.name: step for step in steps}
+        self.producer = {}
+        for step in steps:
+            for output in step.outputs:
+                if output in self.producer:
+                    raise ValueError(f"{output} is written by both {self.producer[output]} and {step.name}")
+                self.producer[output] = step.name
+        self.deps = {
+            step.name: {self.producer[i] for i in step.inputs if i in self.producer} for step in steps
+        }
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> list[str]:
+        order, visiting, visited = [], set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle through step '{name}'")
+            visiting.add(name)
+            for dep in sorted(self.deps[name]):
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name)
+        return order
+
+    def select(self, targets: list[str] | None) -> list[str]:
+        """Targets (default: every non-manual step) plus their non-manual ancestors, in build order."""
+        if targets:
+            unknown = [t for t in targets if t not in self.steps]
+            if unknown:
+                raise KeyError(f"Unknown step(s): {', '.join(unknown)}. Steps: {', '.join(self.order)}")
+            wanted, todo = set(), list(targets)
+            while todo:
+                name = todo.pop()
+                if name in wanted:
+                    continue
+                wanted.add(name)
+                todo.extend(d for d in self.deps[name] if not self.steps[d].manual)
+        else:
+            wanted = {name for name, step in self.steps.items() if not step.manual}
+        return [name for name in self.order if name in wanted]
+
+
+# ---------------------------------------------------------------------------
+# Content hashes
+# ---------------------------------------------------------------------------
+
+class State:
+    """Per-step input/output hashes of the last successful run, plus a (mtime, size) -> hash cache."""
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        data = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        self.steps = data.get("steps", {})
+        self.files = data.get("files", {})
+
+    def save(self):
+        with self.lock:
+            data = {"steps": self.steps, "files": self.files}
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+
+    def _hash_file(self, rel: str, full) -> str:
+        stat = full.stat()
+        with self.lock:
+            cached = self.files.get(rel)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(full, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.files[rel] = [stat.st_mtime_ns, stat.st_size, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def hash(self, rel: str) -> str | None:
+        """Content hash of a repo-relative file or directory (None if missing)."""
+        full = REPO_ROOT / rel
+        if full.is_file():
+            return self._hash_file(rel, full)
+        if full.is_dir():
+            digest = hashlib.sha256()
+            for child in sorted(p for p in full.rglob("*") if p.is_file()):
+                child_rel = child.relative_to(REPO_ROOT).as_posix()
+                digest.update(f"{child.relative_to(full).as_posix()}:{self._hash_file(child_rel, child)};".encode())
+            return digest.hexdigest()
+        return None
+
+    def snapshot(self, step: Step) -> dict:
+        return {
+            "inputs": {rel: self.hash(rel) for rel in [step.script, *step.inputs]},
+            "outputs": {rel: self.hash(rel) for rel in step.outputs},
+        }
+
+    def why_stale(self, step: Step, snapshot: dict) -> str | None:
+        """Reason the step needs to run, or None if it is up to date."""
+        last = self.steps.get(step.name)
+        if last is None:
+            return "never built"
+        for rel, digest in snapshot["inputs"].items():
+            if digest != last["inputs"].get(rel):
+                return f"{rel} changed"
+        for rel, digest in snapshot["outputs"].items():
+            if digest is None:
+                return f"{rel} missing"
+            if digest != last["outputs"].get(rel):
+                return f"{rel} modified since last build"
+        return None
+
+    def record(self, step: Step):
+        snapshot = self.snapshot(step)
+        with self.lock:
+            self.steps[step.name] = snapshot
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def run_step(step: Step) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONIOENCODING="utf-8")
+    proc = subprocess.run(step.command(), cwd=REPO_ROOT / step.cwd, env=env,
+                          capture_output=True, text=True, encoding="utf-8", errors="replace")
+    if proc.returncode == 0:
+        for source, target in step.publish.items():
+            shutil.copyfile(REPO_ROOT / source, REPO_ROOT / target)
+    return proc
+
+
+def build(pipeline: Pipeline, targets=None, jobs: int | None = None, force: bool = False, dry_run: bool = False) -> bool:
+    """Bring the selected steps up to date. Returns False if any step failed."""
+    state = State()
+    selected = pipeline.select(targets)
+    forced = set(targets or selected) if force else set()
+    pending, done, blocked = list(selected), set(), set()
+    stale = set()   # dry run: steps that would run; their dependents may see new inputs
+    ok = True
+
+    def check_and_run(name):
+        step = pipeline.steps[name]
+        snapshot = state.snapshot(step)
+        upstream = sorted(pipeline.deps[name] & stale)
+        missing = [rel for rel, digest in snapshot["inputs"].items() if digest is None]
+        if missing and not upstream:
+            return name, "missing", f"missing input(s): {', '.join(missing)}", None
+        reason = "forced" if name in forced else state.why_stale(step, snapshot)
+        if reason is None and upstream:
+            reason = f"after {', '.join(upstream)}"
+        if reason is None:
+            return name, "up to date", None, None
+        if dry_run:
+            return name, "would run", reason, None
+        return name, "ran", reason, run_step(step)
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        running = set()
+        while pending or running:
+            for name in list(pending):
+                deps = pipeline.deps[name] & set(selected)
+                if deps & blocked:
+                    pending.remove(name)
+                    blocked.add(name)
+                    print(f"[skip] {name}: a dependency failed")
+                elif deps <= done:
+                    pending.remove(name)
+                    running.add(pool.submit(check_and_run, name))
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, status, reason, proc = future.result()
+                if status == "missing" or (proc is not None and proc.returncode != 0):
+                    ok = False
+                    blocked.add(name)
+                    print(f"[fail] {name}: {reason if proc is None else f'exit code {proc.returncode}'}")
+                    if proc is not None:
+                        print(proc.stdout + proc.stderr)
+                    continue
+                done.add(name)
+                if status == "ran":
+                    state.record(pipeline.steps[name])
+                    state.save()
+                    print(f"[ran]  {name} ({reason})")
+                elif status == "would run":
+                    stale.add(name)
+                    print(f"[stale] {name} ({reason})")
+                else:
+                    print(f"[ok]   {name}")
+    if not dry_run:
+        state.save()
+    return ok
+
+
+def list_steps(pipeline: Pipeline):
+    state = State()
+    for name in pipeline.order:
+        step = pipeline.steps[name]
+        reason = state.why_stale(step, state.snapshot(step))
+        deps = ", ".join(sorted(pipeline.deps[name])) or "-"
+        manual = " (manual)" if step.manual else ""
+        print(f"{name:22s} {reason or 'up to date':40s} after: {deps}{manual}")
+    state.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild stale results, in dependency order.")
+    parser.add_argument("targets", nargs="*", help="steps to bring up to date (default: all non-manual steps)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="steps to run at once (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="re-run the named steps (default: all) even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only report which steps are stale")
+    parser.add_argument("--list", action="store_true", help="list all steps, their status and dependencies")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(STEPS)
+    if args.list:
+        list_steps(pipeline)
+        return
+    if not build(pipeline, args.targets, jobs=args.jobs, force=args.force, dry_run=args.dry_run):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Hot-path timers and counters for the pipeline scripts.
+
+Off unless the CPE_PROFILE environment variable is set. The stages time themselves
+with spans and count events with counters:
+
+    from cpe_common import profiling
+    with profiling.span("cellpose_eval", image=filename):
+        masks, flows, styles, diams = model.eval(...)
+    profiling.count("api_retries")
+
+When the script exits, a summary table goes to stderr: calls, total, mean, p50, p95
+and max per span, each span's share of the wall time, and the counter totals. A
+Chrome trace is also written to the path in CPE_PROFILE ("1" means
+profile-trace.json in the working directory); open it in chrome://tracing or
+ui.perfetto.dev. Tile threads show up as their own rows. Workers of
+cpe_common/parallel.py write their spans to a part file when they exit, and the
+parent merges those files into its trace.
+
+Spans in the tree:
+    decode, tile, encode, api_call, parse, aggregate   (LLM scripts)
+    cellpose_eval, regionprops, spatial                (cellpose-results)
+    dvice_preprocess, dvice_predict                    (dvice-results)
+    write                                              (CSV / JSON / Parquet / mask output)
+
+When profiling is disabled, span() returns one shared null context and count()
+returns immediately, so the hooks can stay in the hot paths.
+
+Run any entry point profiled, from its own folder. --cprofile or --pyinstrument adds
+a whole-program profile of the parent process on top of the spans:
+
+    cd cellpose-results
+    python ../cpe_common/profiling.py [--trace t.json] [--cprofile out.prof | --pyinstrument out.html] analyze_cpe.py
+
+cProfile and pyinstrument see only the parent process. Use WORKERS = 1 to profile
+Cellpose or DVICE themselves.
+"""
+
+import argparse
+import atexit
+import contextlib
+import glob
+import json
+import multiprocessing as mp
+import os
+import runpy
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+ENV = "CPE_PROFILE"
+DEFAULT_TRACE = "profile-trace.json"
+
+_NULL = contextlib.nullcontext()
+_enabled = False
+_trace_path = None
+_started = 0
+_events = []                    # (name, start_ns, end_ns, thread id, args)
+_counters = defaultdict(int)
+_lock = threading.Lock()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _events.append((self.name, self.start, time.perf_counter_ns(), threading.get_native_id(), self.args))
+
+
+def span(name: str, **args):
+    """Time the with-block as `name`; args (e.g. image=...) are attached to its trace event."""
+    if not _enabled:
+        return _NULL
+    return _Span(name, args)
+
+
+def count(name: str, n: int = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += n
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(trace_path=DEFAULT_TRACE):
+    """Start recording; the trace and summary are written when the process exits."""
+    global _enabled, _trace_path, _started
+    if not _enabled:
+        _started = time.perf_counter_ns()
+        atexit.register(_at_exit)
+    _enabled = True
+    _trace_path = str(trace_path)
+
+
+def trace_events(events=None, pid=None) -> list[dict]:
+    """Events in Chrome trace format ("X" complete events, microseconds)."""
+    pid = os.getpid() if pid is None else pid
+    return [{"name": name, "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+             "pid": pid, "tid": tid, "args": args}
+            for name, start, end, tid, args in (_events if events is None else events)]
+
+
+def summary(events: list[dict], counters: dict, wall_s: float) -> str:
+    """Per-span table over Chrome trace events, followed by the counter totals."""
+    durations = defaultdict(list)
+    for event in events:
+        if event["ph"] == "X":
+            durations[event["name"]].append(event["dur"] / 1000)
+    lines = [f"{'span':<18}{'calls':>8}{'total_s':>10}{'mean_ms':>10}{'p50_ms':>10}{'p95_ms':>10}"
+             f"{'max_ms':>10}{'% wall':>8}"]
+    for name, ms in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        ms = np.asarray(ms)
+        total = ms.sum() / 1000
+        lines.append(f"{name:<18}{len(ms):>8}{total:>10.2f}{ms.mean():>10.1f}{np.percentile(ms, 50):>10.1f}"
+                     f"{np.percentile(ms, 95):>10.1f}{ms.max():>10.1f}{100 * total / wall_s:>8.1f}")
+    lines.append(f"wall time: {wall_s:.2f} s (spans in worker processes and threads overlap it)")
+    for name, value in sorted(counters.items()):
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines)
+
+
+def _collect_parts(events: list[dict], counters: dict):
+    """Merge in the part files the child processes of this process left behind."""
+    for part in glob.glob(f"{glob.escape(_trace_path)}.{os.getpid()}-*.part"):
+        with open(part, encoding="utf-8") as f:
+            data = json.load(f)
+        events.extend(data["traceEvents"])
+        for name, value in data["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+        os.remove(part)
+
+
+def _at_exit():
+    events = trace_events()
+    counters = dict(_counters)
+    _collect_parts(events, counters)
+    parent = mp.parent_process()
+    if parent is not None:
+        with open(f"{_trace_path}.{parent.pid}-{os.getpid()}.part", "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "counters": counters}, f, default=str)
+        return
+
+    pids = sorted({event["pid"] for event in events} | {os.getpid()})
+    names = [{"name": "process_name", "ph": "M", "pid": pid,
+              "args": {"name": "main" if pid == os.getpid() else f"worker {pid}"}} for pid in pids]
+    with open(_trace_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": names + events, "otherData": {"counters": counters}}, f, default=str)
+    wall_s = (time.perf_counter_ns() - _started) / 1e9
+    print(f"\n{summary(events, counters, wall_s)}\nTrace written to {_trace_path}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a pipeline script with its stage timers switched on.")
+    parser.add_argument("--trace", default=DEFAULT_TRACE, help="Chrome trace output (default: %(default)s)")
+    profiler = parser.add_mutually_exclusive_group()
+    profiler.add_argument("--cprofile", metavar="OUT", help="also run under cProfile: stats to OUT, top 30 to stderr")
+    profiler.add_argument("--pyinstrument", metavar="OUT", help="also run under pyinstrument: HTML report to OUT")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    # spawned workers read the variable when they import the module; the scripts import it as
+    # cpe_common.profiling, which (not this __main__ copy) is the instance that records
+    os.environ[ENV] = args.trace
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+    from cpe_common import profiling
+    profiling.enable(args.trace)
+
+    sys.argv = [args.script, *args.args]
+    sys.path.insert(0, str(Path(args.script).resolve().parent))
+
+    def target():
+        runpy.run_path(args.script, run_name="__main__")
+
+    if args.cprofile:
+        import cProfile
+        import pstats
+        prof = cProfile.Profile()
+        try:
+            prof.runcall(target)
+        finally:
+            prof.dump_stats(args.cprofile)
+            pstats.Stats(prof, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+    elif args.pyinstrument:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            sys.exit("pyinstrument is not installed (pip install pyinstrument), or use --cprofile")
+        prof = Profiler()
+        prof.start()
+        try:
+            target()
+        finally:
+            prof.stop()
+            Path(args.pyinstrument).write_text(prof.output_html(), encoding="utf-8")
+    else:
+        target()
+
+
+if __name__ == "__main__":
+    main()
+elif os.environ.get(ENV):
+    enable(DEFAULT_TRACE if os.environ[ENV] == "1" else os.environ[ENV])
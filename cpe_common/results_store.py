@@ -0,0 +1,314 @@
+"""
+Columnar results store.
+
+All detector outputs are collected into four Parquet tables under results-store/,
+keyed on (path, id):
+
+  images         one row per (source, image) for the LLMs and the CRO JSON:
+                 culture_state, cpe_detected, cpe_types, viability, confidence,
+                 tile counts/fractions, cpe_quadrant, full_response_text
+  tiles          one row per (source, image, tile) from the embedded tile_results
+  engine_scores  one row per (engine, image) for AIRVIC, Cellpose and DVICE:
+                 score (CPE probability, null for AIRVIC) and cpe (0/1 decision)
+  ground_truth   CRO annotations per image: CRO_Dy ... CRO_Re and CRO_CPE (any)
+
+Each table records the content hashes of the source JSON/CSV files it was built
+from, and is rebuilt whenever one of them changes, appears or is removed (a newer
+mtime with the same content only refreshes the table's mtime), so scripts can always read through
+read_table(). Reads use
+Parquet column projection and predicate pushdown, e.g.
+
+    read_table("images", columns=["source", "path", "id", "cpe_detected"],
+               filters=[("source", "in", ["ChatGPT", "CRO"])])
+
+Rebuild everything explicitly with:  python -m cpe_common.results_store
+"""
+
+import os
+import json
+import hashlib
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cpe_common import REPO_ROOT
+from cpe_common.manifest import image_key, parse_image_name
+
+STORE_DIR = REPO_ROOT / "results-store"
+
+LLM_RESULT_FILES = {
+    "Claude": "ai-results/cpe_detection_results_claude.json",
+    "ChatGPT": "ai-results/cpe_detection_results_chatgpt.json",
+    "Gemini": "ai-results/cpe_detection_results_gemini.json",
+    "Grok": "ai-results/cpe_detection_results_grok.json",
+    "CRO": "cro-results/cpe_detection_results_cro.json",
+}
+AIRVIC_CSV = "airvic-results/airvic-results.csv"
+CELLPOSE_CSV = "cellpose-results/cellpose-results.csv"
+DVICE_CSV = "dvice-results/dvice-results.csv"
+DVICE_FINAL_CSV = "dvice-results/dvice-final-results.csv"
+CRO_CSV = "cro-results/cro_cpe_detections.csv"
+
+IMAGES_SCHEMA = pa.schema([
+    ("source", pa.string()),
+    ("image", pa.string()),
+    ("path", pa.int32()),
+    ("id", pa.int32()),
+    ("culture_state", pa.string()),
+    ("cpe_detected", pa.bool_()),
+    ("cpe_types", pa.list_(pa.string())),
+    ("viability", pa.float64()),
+    ("confidence", pa.float64()),
+    ("positive_tiles", pa.int32()),
+    ("early_stress_tiles", pa.int32()),
+    ("total_tiles", pa.int32()),
+    ("positive_tile_fraction", pa.float64()),
+    ("early_stress_tile_fraction", pa.float64()),
+    ("cpe_quadrant", pa.int32()),
+    ("full_response_text", pa.string()),
+])
+
+TILES_SCHEMA = pa.schema([
+    ("source", pa.string()),
+    ("image", pa.string()),
+    ("path", pa.int32()),
+    ("id", pa.int32()),
+    ("tile_id", pa.string()),
+    ("row", pa.int32()),
+    ("col", pa.int32()),
+    ("level", pa.int32()),
+    ("area_fraction", pa.float64()),
+    ("tile_state", pa.string()),
+    ("tile_positive", pa.bool_()),
+    ("consensus_strength", pa.float64()),
+    ("model_confidence_mean", pa.float64()),
+    ("viability_mean", pa.float64()),
+    ("cpe_types", pa.list_(pa.string())),
+])
+
+ENGINE_SCORES_SCHEMA = pa.schema([
+    ("engine", pa.string()),
+    ("path", pa.int32()),
+    ("id", pa.int32()),
+    ("score", pa.float64()),
+    ("cpe", pa.int8()),
+])
+
+
+# ---------------------------------------------------------------------------
+# Ingestion
+# ---------------------------------------------------------------------------
+
+def _load_llm_results() -> dict:
+    results = {}
+    for source, rel_path in LLM_RESULT_FILES.items():
+        path = REPO_ROOT / rel_path
+        if not path.exists():
+            print(f"Warning: {rel_path} not found. Skipping.")
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            results[source] = json.load(f)
+    return results
+
+
+def _keyed_results():
+    """(source, image, result, path, id) for every LLM/CRO result whose image name parses; the others are skipped."""
+    for source, data in _load_llm_results().items():
+        for image, result in data.items():
+            if parse_image_name(image) is None:
+                print(f"Warning: could not parse path/id from {image} in {LLM_RESULT_FILES[source]} - skipping")
+                continue
+            yield source, image, result, *image_key(image)
+
+
+def _build_images() -> pa.Table:
+    rows = []
+    for source, image, result, path_num, img_id in _keyed_results():
+        row = {"source": source, "image": image, "path": path_num, "id": img_id}
+        for name in IMAGES_SCHEMA.names[4:]:
+            row[name] = result.get(name)
+        rows.append(row)
+    rows.sort(key=lambda r: (r["source"], r["path"], r["id"]))
+    return pa.Table.from_pylist(rows, schema=IMAGES_SCHEMA)
+
+
+def _build_tiles() -> pa.Table:
+    rows = []
+    for source, image, result, path_num, img_id in _keyed_results():
+        for tile in result.get("tile_results") or []:
+            state = tile.get("tile_state") or ("clear_cpe" if tile.get("tile_positive") else "healthy")
+            rows.append({
+                "source": source,
+                "image": image,
+                "path": path_num,
+                "id": img_id,
+                "tile_id": tile.get("tile_id"),
+                "row": tile.get("row"),
+                "col": tile.get("col"),
+                "level": tile.get("level", 0),
+                "area_fraction": tile.get("area_fraction"),
+                "tile_state": state,
+                "tile_positive": bool(tile.get("tile_positive")),
+                "consensus_strength": tile.get("consensus_strength"),
+                # the older Claude results call it model_confidence
+                "model_confidence_mean": tile.get("model_confidence_mean", tile.get("model_confidence")),
+                "viability_mean": tile.get("viability_mean"),
+                "cpe_types": tile.get("cpe_types"),
+            })
+    rows.sort(key=lambda r: (r["source"], r["path"], r["id"]))
+    return pa.Table.from_pylist(rows, schema=TILES_SCHEMA)
+
+
+def _build_engine_scores() -> pa.Table:
+    frames = []
+
+    airvic = pd.read_csv(REPO_ROOT / AIRVIC_CSV)
+    frames.append(pd.DataFrame({
+        "engine": "AIRVIC", "path": airvic["path"], "id": airvic["id"],
+        "score": float("nan"), "cpe": airvic["Airvic_CPE"],
+    }))
+
+    cellpose = pd.read_csv(REPO_ROOT / CELLPOSE_CSV)
+    frames.append(pd.DataFrame({
+        "engine": "Cellpose", "path": cellpose["path"], "id": cellpose["id"],
+        "score": cellpose["CellPose CPE Probability"], "cpe": cellpose["CPE Detection"],
+    }))
+
+    # model{i}_probs is just [1 - infected, infected], so only the infected probability is kept
+    dvice = pd.read_csv(REPO_ROOT / DVICE_CSV)
+    for i in (1, 2, 3):
+        frames.append(pd.DataFrame({
+            "engine": f"DVICE_model{i}", "path": dvice["path"], "id": dvice["id"],
+            "score": dvice[f"model{i}_infected"], "cpe": dvice[f"model{i}_class"],
+        }))
+
+    dvice_final = pd.read_csv(REPO_ROOT / DVICE_FINAL_CSV)
+    frames.append(pd.DataFrame({
+        "engine": "DVICE", "path": dvice_final["path"], "id": dvice_final["id"],
+        "score": dvice_final["avg_dvice_prob"], "cpe": dvice_final["DVICE_CPE"],
+    }))
+
+    df = pd.concat(frames, ignore_index=True).sort_values(["engine", "path", "id"])
+    return pa.Table.from_pandas(df, schema=ENGINE_SCORES_SCHEMA, preserve_index=False)
+
+
+def _build_ground_truth() -> pa.Table:
+    cro = pd.read_csv(REPO_ROOT / CRO_CSV)
+    cro_columns = [col for col in cro.columns if col.startswith("CRO_")]
+    cro["CRO_CPE"] = (cro[cro_columns] == 1).any(axis=1).astype(int)
+    cro = cro.sort_values(["path", "id"])
+    return pa.Table.from_pandas(cro, preserve_index=False)
+
+
+TABLES = {
+    "images": (_build_images, list(LLM_RESULT_FILES.values())),
+    "tiles": (_build_tiles, list(LLM_RESULT_FILES.values())),
+    "engine_scores": (_build_engine_scores, [AIRVIC_CSV, CELLPOSE_CSV, DVICE_CSV, DVICE_FINAL_CSV]),
+    "ground_truth": (_build_ground_truth, [CRO_CSV]),
+}
+
+
+# ---------------------------------------------------------------------------
+# Store access
+# ---------------------------------------------------------------------------
+
+def table_path(name: str):
+    return STORE_DIR / f"{name}.parquet"
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hashes(name: str) -> dict:
+    """{source: sha256} for the sources of one table that exist."""
+    return {
+        source: file_hash(REPO_ROOT / source)
+        for source in TABLES[name][1] if (REPO_ROOT / source).exists()
+    }
+
+
+def built_from(name: str) -> dict:
+    """Source hashes recorded in a table when it was built."""
+    metadata = pq.read_schema(table_path(name)).metadata or {}
+    return json.loads(metadata.get(b"cpe_sources", b"{}"))
+
+
+def is_stale(name: str) -> bool:
+    path = table_path(name)
+    if not path.exists():
+        return True
+    built = path.stat().st_mtime
+    sources = [REPO_ROOT / source for source in TABLES[name][1]]
+    # a source removed (or added) since the build: its rows must go (or come in)
+    if set(built_from(name)) != {source for source in TABLES[name][1] if (REPO_ROOT / source).exists()}:
+        return True
+    if not any(source.exists() and source.stat().st_mtime > built for source in sources):
+        return False
+    # a source is newer (e.g. after a checkout): only its content decides
+    if built_from(name) != source_hashes(name):
+        return True
+    os.utime(path)
+    return False
+
+
+def build_table(name: str):
+    builder, _ = TABLES[name]
+    STORE_DIR.mkdir(exist_ok=True)
+    table = builder()
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"cpe_sources"] = json.dumps(source_hashes(name), sort_keys=True).encode()
+    table = table.replace_schema_metadata(metadata)
+    # small row groups keep the per-group min/max statistics useful for pushdown;
+    # written aside and renamed so a concurrent reader never sees a partial file
+    tmp = table_path(name).with_suffix(f".{os.getpid()}.tmp")
+    pq.write_table(table, tmp, row_group_size=1024)
+    os.replace(tmp, table_path(name))
+    return table
+
+
+def build_store():
+    for name in TABLES:
+        table = build_table(name)
+        print(f"{name}: {table.num_rows} rows -> {table_path(name)}")
+
+
+def read_arrow(name: str, columns: list[str] | None = None, filters=None) -> pa.Table:
+    """
+    Read one store table, rebuilding it first if any of its sources changed.
+    `columns` projects, `filters` (pyarrow DNF, e.g. [("source", "==", "CRO")]) is pushed down.
+    """
+    if name not in TABLES:
+        raise KeyError(f"Unknown table '{name}'. Tables: {', '.join(TABLES)}")
+    if is_stale(name):
+        build_table(name)
+    return pq.read_table(table_path(name), columns=columns, filters=filters)
+
+
+def read_table(name: str, columns: list[str] | None = None, filters=None) -> pd.DataFrame:
+    return read_arrow(name, columns, filters).to_pandas()
+
+
+def image_results(source: str, columns: list[str] | None = None) -> dict:
+    """
+    {image name: result dict} for one LLM/CRO source, shaped like the original JSON
+    (fields that were absent are left out), for code written against those files.
+    """
+    if columns is not None:
+        columns = ["image", *[c for c in columns if c != "image"]]
+    table = read_arrow("images", columns=columns, filters=[("source", "==", source)])
+    results = {}
+    for record in table.to_pylist():
+        image = record.pop("image")
+        record.pop("source", None)
+        results[image] = {k: v for k, v in record.items() if v is not None}
+    return results
+
+
+if __name__ == "__main__":
+    build_store()
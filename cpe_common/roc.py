@@ -0,0 +1,150 @@
+"""
+Threshold sweeps, ROC curves and operating points for score-based detectors.
+
+Scores are sorted once per engine and every metric comes from cumulative TP/FP
+counts, so the whole curve costs O(n log n) whatever the number of thresholds:
+
+    curve = roc_curve(y_true, scores)       # one row per distinct score (predict CPE if score >= threshold)
+    auc(curve)                              # exact AUC, ties counted as half (= Mann-Whitney U / (P*N))
+    operating_point(curve)                  # row with the largest Youden's J (tpr - fpr)
+    accuracy_at(y_true, scores, grid)       # accuracy (%) at arbitrary thresholds, e.g. 0, 0.05, ... 1
+
+evaluate() does this for any number of engines at once (Cellpose, the DVICE
+models, AIRVIC's 0/1 calls, LLM confidences, ...). Each engine may cover a
+different subset of images: NaN scores are dropped per engine.
+
+Summary for every engine in the results store:  python -m cpe_common.roc
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+CURVE_COLUMNS = ["threshold", "tp", "fp", "tn", "fn", "accuracy", "tpr", "fpr", "precision", "f1", "youden_j"]
+
+
+def _clean(y_true, scores) -> tuple[np.ndarray, np.ndarray]:
+    y = np.asarray(y_true, dtype=float)
+    s = np.asarray(scores, dtype=float)
+    keep = ~(np.isnan(y) | np.isnan(s))
+    return y[keep].astype(bool), s[keep]
+
+
+def roc_curve(y_true, scores) -> pd.DataFrame:
+    """
+    Confusion counts and metrics at every distinct score, highest threshold first.
+    The first row (threshold +inf) predicts nothing positive, the last predicts everything.
+    """
+    y, s = _clean(y_true, scores)
+    order = np.argsort(-s, kind="mergesort")
+    y, s = y[order], s[order]
+
+    # last index of each run of equal scores: all tied images flip together
+    ends = np.flatnonzero(np.r_[s[1:] != s[:-1], True]) if len(s) else np.array([], dtype=int)
+    tp = np.r_[0, np.cumsum(y)[ends]]
+    fp = np.r_[0, np.cumsum(~y)[ends]]
+    positives, negatives = y.sum(), (~y).sum()
+    fn, tn = positives - tp, negatives - fp
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = tp / positives
+        fpr = fp / negatives
+        curve = pd.DataFrame({
+            "threshold": np.r_[np.inf, s[ends]],
+            "tp": tp, "fp": fp, "tn": tn, "fn": fn,
+            "accuracy": (tp + tn) / len(y) * 100,
+            "tpr": tpr,
+            "fpr": fpr,
+            "precision": tp / (tp + fp),
+            "f1": 2 * tp / (2 * tp + fp + fn),
+            "youden_j": tpr - fpr,
+        })
+    return curve
+
+
+def auc(curve: pd.DataFrame) -> float:
+    """Exact area under the ROC curve (trapezoids between distinct thresholds handle ties)."""
+    fpr, tpr = curve["fpr"].to_numpy(), curve["tpr"].to_numpy()
+    if np.isnan(fpr).any() or np.isnan(tpr).any():
+        return float("nan")  # only one class present
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def operating_point(curve: pd.DataFrame) -> pd.Series:
+    """Threshold with the largest Youden's J (ties: the highest threshold)."""
+    return curve.loc[curve["youden_j"].fillna(-np.inf).idxmax()]
+
+
+def accuracy_at(y_true, scores, thresholds) -> np.ndarray:
+    """Accuracy (%) of `score >= t` for each t, via binary search in the sorted class scores."""
+    y, s = _clean(y_true, scores)
+    pos, neg = np.sort(s[y]), np.sort(s[~y])
+    t = np.asarray(thresholds, dtype=float)
+    tp = len(pos) - np.searchsorted(pos, t, side="left")
+    tn = np.searchsorted(neg, t, side="left")
+    return (tp + tn) / len(y) * 100
+
+
+def evaluate(y_true, scores: dict, grid=None) -> tuple[pd.DataFrame, pd.DataFrame | None]:
+    """
+    Score every engine against one ground truth.
+    scores: {engine: scores aligned with y_true (NaN where the engine has no result)}.
+    Returns (summary, sweep): one summary row per engine with its AUC and optimal operating
+    point, and, if a threshold grid is given, the accuracy (%) of each engine at each grid value.
+    """
+    summary, sweep = [], {}
+    for engine, engine_scores in scores.items():
+        curve = roc_curve(y_true, engine_scores)
+        best = operating_point(curve)
+        y, _ = _clean(y_true, engine_scores)
+        summary.append({
+            "engine": engine,
+            "images": len(y),
+            "positives": int(y.sum()),
+            "auc": auc(curve),
+            **{f"best_{name}": best[name] for name in CURVE_COLUMNS if name not in ("tp", "fp", "tn", "fn")},
+        })
+        if grid is not None:
+            sweep[engine] = accuracy_at(y_true, engine_scores, grid)
+    sweep_df = None if grid is None else pd.DataFrame({"threshold": np.asarray(grid), **sweep})
+    return pd.DataFrame(summary), sweep_df
+
+
+def store_scores() -> tuple[pd.Series, dict]:
+    """CRO_CPE and every engine's CPE score from the results store, on the ground-truth images."""
+    from cpe_common import ground_truth
+    from cpe_common.results_store import read_table
+
+    engines = read_table("engine_scores").set_index(["path", "id"])
+    # AIRVIC only gives a 0/1 call, which is used as its score
+    engines["score"] = engines["score"].fillna(engines["cpe"].astype(float))
+    wide = engines.pivot_table(index=["path", "id"], columns="engine", values="score")
+
+    # LLM confidence is in the verdict; turn it into a CPE score
+    images = read_table("images", columns=["source", "path", "id", "cpe_detected", "confidence"],
+                        filters=[("source", "!=", "CRO")])
+    confidence = images["confidence"].astype(float)
+    llm = np.where(images["cpe_detected"].fillna(False).astype(bool), confidence, 1 - confidence)
+    llm[images["cpe_detected"].isna().to_numpy()] = np.nan
+    wide = wide.join(images.assign(score=llm).pivot_table(index=["path", "id"], columns="source", values="score"))
+
+    wide = ground_truth.align(wide)
+    return ground_truth.y_true(), {engine: wide[engine].to_numpy() for engine in wide.columns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AUC and optimal operating point for every engine in the results store.")
+    parser.add_argument("--csv", help="also write the summary to this CSV")
+    args = parser.parse_args()
+
+    y_true, scores = store_scores()
+    summary, _ = evaluate(y_true, scores)
+    print(summary.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    if args.csv:
+        summary.to_csv(args.csv, index=False)
+        print(f"Saved: {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Spatial statistics of segmented cells: is the CPE isolated, clustered or widespread?
+
+All statistics for one image come from one KD-tree over the cell centroids, with
+vectorized queries over all cells:
+
+    nn_mean_px, nn_median_px        nearest-neighbour distance
+    clark_evans                     mean NN distance / its expectation under complete
+                                    spatial randomness (< 1 clustered, > 1 regular)
+    ripley_L_<r>                    Ripley's L(r) - r at r = 25, 50, 100 px (> 0 clustered;
+                                    no edge correction, so compare images of one size)
+    local_density_mean / _max       other cells within LOCAL_RADIUS px of each cell
+    abnormal_fraction               rounded (circularity >= ROUNDED_CIRCULARITY) or elongated
+                                    (eccentricity >= HIGH_ECCENTRICITY) cells
+    abnormal_clusters               groups of >= MIN_CLUSTER abnormal cells chained within
+                                    LINK_DISTANCE px of each other
+    abnormal_clustered_fraction     share of abnormal cells that sit in such a group
+    largest_cluster_cells
+
+    image_metrics(cells, shape)             # dict for one image (cells: cell_features() output)
+    dataset_metrics("cells", shape)         # DataFrame, one row per image of a cell dataset
+
+analyze_cpe.py adds these columns to cpe_metrics.csv, where cellpose_score can use
+them as features. For a cell dataset written earlier:
+python -m cpe_common.spatial cellpose-results/cells --shape 1024 1024 --csv spatial.csv
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+RADII = (25, 50, 100)              # px; a Vero cell is ~30 px across
+LOCAL_RADIUS = 50
+ROUNDED_CIRCULARITY = 0.85
+HIGH_ECCENTRICITY = 0.90
+LINK_DISTANCE = 45                 # ~1.5 cell diameters
+MIN_CLUSTER = 3
+
+COLUMNS = ["nn_mean_px", "nn_median_px", "clark_evans", *[f"ripley_L_{r}" for r in RADII],
+           "local_density_mean", "local_density_max", "abnormal_fraction", "abnormal_clusters",
+           "abnormal_clustered_fraction", "largest_cluster_cells"]
+
+
+def _clusters(points: np.ndarray) -> np.ndarray:
+    """Sizes of the groups of points chained within LINK_DISTANCE."""
+    if len(points) == 0:
+        return np.empty(0, dtype=int)
+    pairs = cKDTree(points).query_pairs(LINK_DISTANCE, output_type="ndarray")
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(points), len(points)))
+    _, component = connected_components(graph, directed=False)
+    return np.bincount(component)
+
+
+def image_metrics(cells, shape) -> dict:
+    """Spatial statistics of one image; cells needs centroid_y/x, circularity and eccentricity."""
+    points = np.column_stack([np.asarray(cells["centroid_y"], dtype=float), np.asarray(cells["centroid_x"], dtype=float)])
+    n = len(points)
+    area = float(shape[0] * shape[1])
+    metrics = dict.fromkeys(COLUMNS, np.nan)
+    metrics.update(abnormal_fraction=0.0, abnormal_clusters=0, abnormal_clustered_fraction=0.0, largest_cluster_cells=0)
+    if n == 0:
+        return metrics
+
+    abnormal = (np.asarray(cells["circularity"]) >= ROUNDED_CIRCULARITY) | (np.asarray(cells["eccentricity"]) >= HIGH_ECCENTRICITY)
+    sizes = _clusters(points[abnormal])
+    clustered = sizes[sizes >= MIN_CLUSTER]
+    metrics.update(
+        abnormal_fraction=float(abnormal.mean()),
+        abnormal_clusters=int(len(clustered)),
+        abnormal_clustered_fraction=float(clustered.sum() / abnormal.sum()) if abnormal.any() else 0.0,
+        largest_cluster_cells=int(sizes.max(initial=0)),
+    )
+    if n < 2:
+        return metrics
+
+    tree = cKDTree(points)
+    nn = tree.query(points, k=2)[0][:, 1]
+    # ordered pairs closer than each radius (count_neighbors includes the n self-pairs)
+    pairs = tree.count_neighbors(tree, np.asarray(RADII, dtype=float)) - n
+    ripley_k = area * pairs / (n * (n - 1))
+    local = tree.query_ball_point(points, LOCAL_RADIUS, return_length=True) - 1
+    metrics.update(
+        nn_mean_px=float(nn.mean()),
+        nn_median_px=float(np.median(nn)),
+        clark_evans=float(nn.mean() / (0.5 / np.sqrt(n / area))),
+        local_density_mean=float(local.mean()),
+        local_density_max=int(local.max()),
+    )
+    for r, k in zip(RADII, ripley_k):
+        metrics[f"ripley_L_{r}"] = float(np.sqrt(k / np.pi) - r)
+    return metrics
+
+
+def dataset_metrics(root, shape) -> pd.DataFrame:
+    """image_metrics for every image of a cell_features dataset, one part file in memory at a time."""
+    from cpe_common.cell_features import parts
+
+    rows = {}
+    for part in parts(root):
+        cells = pq.read_table(part, columns=["image", "centroid_y", "centroid_x", "circularity", "eccentricity"]).to_pandas()
+        for image, group in cells.groupby(cells["image"].astype(str), sort=False):
+            rows[image] = image_metrics(group, shape)
+    return pd.DataFrame.from_dict(rows, orient="index", columns=COLUMNS).rename_axis("image")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spatial statistics for every image of a per-cell feature dataset.")
+    parser.add_argument("root", help="cell dataset directory, e.g. cellpose-results/cells")
+    parser.add_argument("--shape", nargs=2, type=int, required=True, metavar=("HEIGHT", "WIDTH"),
+                        help="image size in pixels")
+    parser.add_argument("--csv", help="write the table to this CSV")
+    args = parser.parse_args()
+
+    table = dataset_metrics(args.root, args.shape)
+    print(table.to_string(float_format=lambda v: f"{v:.3f}"))
+    if args.csv:
+        table.to_csv(args.csv)
+        print(f"Saved: {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
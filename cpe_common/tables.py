@@ -0,0 +1,347 @@
+"""
+Streaming table writer for the comparison tables (CSV, HTML and LaTeX from one layout).
+
+A table is described once as a TableLayout (columns, header groups, cell colors,
+legend) and its rows are streamed to the output file. Each column's cell markup is
+compiled up front; for colored columns the finished cell is cached per value, so
+writing a row is a join and a write, with no per-column passes and no growing
+document string.
+
+    layout = confusion_layout(CONFUSION_GROUPS, COMPARED_CODES)
+    write_csv("compare-results/cpe_confusion_table_short.csv", layout, rows)
+    write_html("compare-results/cpe_confusion_table.html", layout, rows)
+    write_latex("compare-results/cpe_confusion_table.tex", layout, rows, color_names=CONFUSION_LATEX_COLORS)
+
+Rows are any iterable of value sequences in column order (a generator keeps only
+one row in memory).
+"""
+
+import csv
+import html
+from dataclasses import dataclass, field
+from itertools import groupby
+
+THICK_BORDER = "2px solid #333"
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str                       # CSV header
+    label: str | None = None        # HTML/LaTeX header text (default: name)
+    colors: dict | None = None      # value -> "#RRGGBB" cell background
+    show_value: bool = True         # False: the cell is drawn empty and only its color shows
+    narrow: bool = False            # fixed-width data column
+
+    @property
+    def header(self) -> str:
+        return self.name if self.label is None else self.label
+
+
+@dataclass
+class TableLayout:
+    columns: list[Column]
+    groups: list[tuple[str, int]] = field(default_factory=list)  # (header, number of columns), left to right
+    title: str = ""
+    legend: list[tuple[str, str]] = field(default_factory=list)  # (color, description)
+
+    def __post_init__(self):
+        if self.groups and sum(n for _, n in self.groups) != len(self.columns):
+            raise ValueError("Header groups must span all columns exactly")
+
+    def group_edges(self) -> tuple[set, set]:
+        """Indices of the first and last column of each header group."""
+        firsts, lasts, start = set(), set(), 0
+        for _, n in self.groups:
+            firsts.add(start)
+            lasts.add(start + n - 1)
+            start += n
+        return firsts, lasts
+
+
+# ---------------------------------------------------------------------------
+# Confusion tables (per-type outcome codes, see compare_cpe_results.confusion_codes)
+# ---------------------------------------------------------------------------
+
+CONFUSION_COLORS = {
+    1: "#98FB98",   # Pale green for TP / Present
+    0: "#FFFFFF",   # White for TN / Absent
+    -1: "#FFFACD",  # Lemon chiffon for FN
+    -2: "#FFB6C1",  # Light pink for FP
+}
+CONFUSION_LEGEND = [
+    (CONFUSION_COLORS[1], "CRO asserted or AI True Positive"),
+    (CONFUSION_COLORS[0], "AI True Negative"),
+    (CONFUSION_COLORS[-1], "AI False Negative"),
+    (CONFUSION_COLORS[-2], "AI False Positive"),
+]
+CONFUSION_LATEX_COLORS = {
+    CONFUSION_COLORS[1]: "TPgreen",
+    CONFUSION_COLORS[0]: "TNwhite",
+    CONFUSION_COLORS[-1]: "FNyellow",
+    CONFUSION_COLORS[-2]: "FPred",
+}
+
+
+# (CSV prefix, header) of the column groups in cpe_confusion_table_short.csv
+CONFUSION_GROUPS = [("CRO", "CRO"), ("GPT", "ChatGPT"), ("CLD", "Claude"), ("Gem", "Gemini"), ("GRK", "Grok")]
+
+
+def confusion_layout(groups: list[tuple[str, str]], codes) -> TableLayout:
+    """path, id, then one colored cell per (group, CPE code); groups are (CSV prefix, header)."""
+    columns = [Column("path"), Column("id")]
+    for prefix, _ in groups:
+        columns += [Column(f"{prefix}_{code}", code, CONFUSION_COLORS, show_value=False, narrow=True) for code in codes]
+    return TableLayout(
+        columns,
+        groups=[("Image", 2), *[(header, len(codes)) for _, header in groups]],
+        title="CPE Confusion Table",
+        legend=CONFUSION_LEGEND,
+    )
+
+
+# ---------------------------------------------------------------------------
+# CSV
+# ---------------------------------------------------------------------------
+
+def write_csv(path: str, layout: TableLayout, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow([column.name for column in layout.columns])
+        writer.writerows(rows)
+
+
+def read_confusion_csv(path: str):
+    """Stream rows of a confusion CSV written by write_csv: path, id, then integer outcome codes."""
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)  # skip header
+        for row in reader:
+            yield row[:2] + [int(v) if v.lstrip("-").isdigit() else 0 for v in row[2:]]
+
+
+# ---------------------------------------------------------------------------
+# HTML
+# ---------------------------------------------------------------------------
+
+_HTML_HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title}</title>
+    <style>
+        body {{
+            font-family: Arial, sans-serif;
+        }}
+        table {{
+            border-collapse: collapse;
+            border: 2px solid #333;
+            margin: 20px auto;
+            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
+            background-color: #fff;
+        }}
+        th, td {{
+            border: 1px solid #ccc;
+            padding: 4px 6px;
+            text-align: center;
+            font-size: 12px;
+        }}
+        th.data-header, td.data-cell {{
+            width: 15px;
+        }}
+        th {{
+            background-color: #f4f4f4;
+            font-weight: bold;
+            color: #333;
+        }}
+        thead tr:last-child th {{
+            border-bottom: 2px solid #333 !important;
+        }}
+        tr:nth-child(even) {{
+            background-color: #fafafa;
+        }}
+        tr:hover {{
+            background-color: #f0f0f0;
+        }}
+    </style>
+</head>
+<body>
+    <div style="width: fit-content; margin: 20px auto;">
+    <table>
+        <thead>
+"""
+
+_HTML_LEGEND_ROW = """        <tr>
+            <td style="width: 15px; height: 15px; background-color: {color}; border: 1px solid #ccc;"></td>
+            <td style="border: 1px solid #ccc; text-align: left; padding-left: 10px;">{text}</td>
+        </tr>
+"""
+
+
+def _html_edge_styles(layout: TableLayout) -> list[str]:
+    firsts, lasts = layout.group_edges()
+    styles = []
+    for i in range(len(layout.columns)):
+        style = f"border-left: {THICK_BORDER};" if i in firsts else ""
+        if i in lasts:
+            style += f" border-right: {THICK_BORDER};"
+        styles.append(style.strip())
+    return styles
+
+
+def _html_cell(column: Column, edge_style: str):
+    """Compile one column's <td> into a function value -> markup."""
+    cls = ' class="data-cell"' if column.narrow else ""
+    if column.colors:
+        cache = {}
+
+        def render(value):
+            cell = cache.get(value)
+            if cell is None:
+                color = column.colors.get(value)
+                style = " ".join(s for s in (f"background-color: {color};" if color else "", edge_style) if s)
+                text = html.escape(str(value)) if column.show_value else ""
+                cell = cache[value] = f'<td style="{style}"{cls}>{text}</td>'
+            return cell
+        return render
+
+    template = f'<td style="{edge_style}"{cls}>{{}}</td>'
+    return lambda value: template.format(html.escape(str(value)))
+
+
+def write_html(path: str, layout: TableLayout, rows):
+    edge_styles = _html_edge_styles(layout)
+    cells = [_html_cell(column, style) for column, style in zip(layout.columns, edge_styles)]
+    indent = " " * 16
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_HTML_HEAD.format(title=html.escape(layout.title)))
+        if layout.groups:
+            f.write("            <tr>\n")
+            for header, n in layout.groups:
+                f.write(f'{indent}<th colspan="{n}" style="border-left: {THICK_BORDER}; border-right: {THICK_BORDER};">'
+                        f'{html.escape(header)}</th>\n')
+            f.write("            </tr>\n")
+        f.write("            <tr>\n")
+        for column, style in zip(layout.columns, edge_styles):
+            cls = ' class="data-header"' if column.narrow else ""
+            f.write(f'{indent}<th style="{style}"{cls}>{html.escape(column.header)}</th>\n')
+        f.write("            </tr>\n        </thead>\n        <tbody>\n")
+
+        for row in rows:
+            f.write(f"            <tr>{''.join(cell(value) for cell, value in zip(cells, row))}</tr>\n")
+
+        f.write("        </tbody>\n    </table>\n")
+        if layout.legend:
+            f.write('    <table style="border: 2px solid #333; margin-top: 20px; margin-left: 0; border-collapse: collapse;">\n')
+            for color, text in layout.legend:
+                f.write(_HTML_LEGEND_ROW.format(color=color, text=html.escape(text)))
+            f.write("    </table>\n")
+        f.write("    </div>\n</body>\n</html>\n")
+
+
+# ---------------------------------------------------------------------------
+# LaTeX (booktabs + colortbl via xcolor's table option)
+# ---------------------------------------------------------------------------
+
+_LATEX_SPECIAL = {c: "\\" + c for c in "&%$#_{}"}
+_LATEX_SPECIAL.update({"~": r"\textasciitilde{}", "^": r"\textasciicircum{}", "\\": r"\textbackslash{}"})
+_LATEX_ESCAPE = str.maketrans(_LATEX_SPECIAL)
+
+NARROW_SPEC = r">{\centering\arraybackslash}p{0.58cm}"
+
+
+def latex_escape(value) -> str:
+    return str(value).translate(_LATEX_ESCAPE)
+
+
+def _latex_color(color: str, color_names: dict) -> str:
+    if color in color_names:
+        return rf"\cellcolor{{{color_names[color]}}}"
+    return rf"\cellcolor[HTML]{{{color.lstrip('#').upper()}}}"
+
+
+def _latex_cell(column: Column, color_names: dict):
+    if column.colors:
+        cache = {}
+
+        def render(value):
+            cell = cache.get(value)
+            if cell is None:
+                color = column.colors.get(value)
+                prefix = _latex_color(color, color_names) if color else ""
+                cell = cache[value] = prefix + (latex_escape(value) if column.show_value else "")
+            return cell
+        return render
+    return latex_escape
+
+
+def _column_spec(layout: TableLayout) -> str:
+    specs = [NARROW_SPEC if column.narrow else "c" for column in layout.columns]
+    parts = []
+    for spec, run in groupby(specs):
+        n = len(list(run))
+        parts.append(spec * n if spec == "c" or n == 1 else f"*{{{n}}}{{{spec}}}")
+    return " ".join(parts)
+
+
+def write_latex(path: str, layout: TableLayout, rows, caption: str = "", label: str = "",
+                color_names: dict | None = None, merge_first_column: bool = False):
+    """
+    Write a landscape table snippet for the paper. Named colors (color_names: hex -> name)
+    are defined in the snippet; other colors are written inline as \\cellcolor[HTML]{...}.
+    merge_first_column puts runs of equal first-column values in one \\multirow cell
+    (rows must already be sorted on that column; only one run is held in memory).
+    """
+    color_names = color_names or {}
+    cells = [_latex_cell(column, color_names) for column in layout.columns]
+
+    def line(row, start=0):
+        return " & ".join(cell(value) for cell, value in zip(cells[start:], row[start:])) + r" \\" + "\n"
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\\clearpage\n\\begin{landscape}\n\n"
+                "% Required packages (already in your main.tex, but safe to have here)\n"
+                "\\usepackage{pdflscape}\n\\usepackage[table]{xcolor}\n\\usepackage{booktabs}\n"
+                "\\usepackage{multirow}\n\\usepackage{array}\n\n")
+        if color_names:
+            f.write("% Define the exact colors used\n")
+            for color, name in color_names.items():
+                f.write(f"\\definecolor{{{name}}}{{HTML}}{{{color.lstrip('#').upper()}}}\n")
+            f.write("\n")
+
+        f.write("\\begin{table}[p]\n\\centering\n\\small\n\\setlength{\\tabcolsep}{2pt}\n")
+        if caption:
+            f.write(f"\\caption{{{caption}}}\n")
+        if label:
+            f.write(f"\\label{{{label}}}\n")
+        f.write(f"\n\\begin{{tabular}}{{{_column_spec(layout)}}}\n\\toprule\n")
+        if layout.groups:
+            f.write(" & ".join(rf"\multicolumn{{{n}}}{{c}}{{\textbf{{{latex_escape(h)}}}}}" for h, n in layout.groups)
+                    + r" \\" + "\n")
+            rules, start = [], 1
+            for _, n in layout.groups:
+                rules.append(rf"\cmidrule(lr){{{start}-{start + n - 1}}}")
+                start += n
+            f.write("".join(rules) + "\n")
+        f.write(" & ".join(latex_escape(column.header) for column in layout.columns) + r" \\" + "\n\\midrule\n")
+
+        if merge_first_column:
+            for first, run in groupby(rows, key=lambda row: row[0]):
+                run = list(run)
+                for i, row in enumerate(run):
+                    lead = rf"\multirow[t]{{{len(run)}}}{{*}}{{{cells[0](first)}}}" if i == 0 else ""
+                    f.write(lead + " & " + line(row, start=1))
+        else:
+            for row in rows:
+                f.write(line(row))
+
+        f.write("\\bottomrule\n\\end{tabular}\n\\end{table}\n")
+        if layout.legend:
+            f.write("\n% ====================== LEGEND ======================\n"
+                    "\\begin{table}[p]\n\\centering\n\\caption*{Legend}\n"
+                    "\\begin{tabular}{>{\\centering\\arraybackslash}p{18pt} l}\n\\toprule\n")
+            for color, text in layout.legend:
+                f.write(f"{_latex_color(color, color_names)} & {latex_escape(text)} \\\\\n")
+            f.write("\\bottomrule\n\\end{tabular}\n\\end{table}\n")
+        f.write("\n\\end{landscape}\n\\clearpage\n")
@@ -15,16 +15,16 @@ Key decisions based on notebook + paper (PMC11180103 / Nature Communications 202
   Output of model.predict is shape (1, 2) with softmax probabilities: index 0 = uninfected, index 1 = infected (standard convention confirmed via notebook's np.argmax usage and binary task).
 - We extract the "infected" probability (pred[0][1]) for each model as the primary result column.
 - Additional columns for predicted class (0/1) and raw probabilities are included for completeness/auditability (paper emphasizes probability-based infectivity scoring).
-- Filename parsing: e.g., "EXP_path2_passage4_302.png" → path=2, id=302 (using regex for robustness).
+- Filename parsing: e.g., "EXP_path2_passage4_302.png" → path=2, id=302 (the shared pattern in cpe_common/manifest.py).
 - Results saved to dvice-results.csv in the script's root folder.
 - Script is standalone, runs in the root folder containing resources/ and ../converted_pngs/.
 
-Dependencies (must be installed in environment): tensorflow, scikit-image, numpy, pandas, pathlib, re
+Dependencies (must be installed in environment): tensorflow, scikit-image, numpy, pandas, pyarrow
 """
 
 import os
+import sys
 import glob
-import re
 import numpy as np
 import pandas as pd
 import skimage.io
@@ -34,6 +34,22 @@ import skimage.color
 import tensorflow as tf
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common import profiling
+from cpe_common.image_cache import ImageCache
+from cpe_common.manifest import config_hash, hash_files, image_files, parse_image_name, pending, scan
+from cpe_common.parallel import run
+
+# True: only run images that are new or whose content changed (by hash) since dvice-results.csv
+# was written, and keep its other rows; byte-identical images always share one prediction
+INCREMENTAL = False
+# True: read grayscale pixels from the packed image cache (python -m cpe_common.image_cache)
+# where it holds an up-to-date copy, instead of decoding the PNG
+USE_IMAGE_CACHE = True
+# worker processes (each loads its own copy of the three models); images are handed over in
+# shared memory, at most 2 per worker at a time (cpe_common/parallel.py). 1 = run in this process
+WORKERS = 1
+
 
 def prep_for_ml(img, img_size=(224, 224), interpolation='Bi-cubic'):
     """
@@ -70,32 +86,18 @@ def prep_for_ml(img, img_size=(224, 224), interpolation='Bi-cubic'):
     return proc_im
 
 
-def main():
-    # Paths (relative to script root folder)
-    root_dir = Path('.')
-    models_dir = root_dir / 'resources'
-    images_dir = root_dir / '..' / 'converted_pngs'
-
-    # Verify paths
-    if not models_dir.exists():
-        raise FileNotFoundError(f"Models directory not found: {models_dir}")
-    if not images_dir.exists():
-        raise FileNotFoundError(f"Images directory not found: {images_dir}")
-
-    # Load the three DVICE models once (EfficientNet-B3 based binary classifiers)
+def load_models(model_paths):
+    """Load the three DVICE models (EfficientNet-B3 based binary classifiers)."""
     # === MODEL LOADING - Fixed for legacy HDF5 format ===
-    # if you extracted modelX.keras from resources.zip, you need to change the file extension to modelX.h5
-    model_files = ['model1.h5', 'model2.h5', 'model3.h5']
     models = []
-    for mf in model_files:
-        model_path = models_dir / mf
-        full_path = str(model_path.resolve().absolute())
-        
+    for model_path in model_paths:
+        full_path = str(Path(model_path).resolve().absolute())
+
         print(f"Loading model: {full_path}")
-        
-        if not model_path.exists():
+
+        if not Path(model_path).exists():
             raise FileNotFoundError(f"Model file not found: {full_path}")
-        
+
         # Load legacy HDF5 models (this is what your files actually are)
         model = tf.keras.models.load_model(
             full_path,
@@ -103,66 +105,125 @@ def main():
             safe_mode=False
         )
         models.append(model)
-        print(f"✅ Successfully loaded {mf}")
+        print(f"✅ Successfully loaded {Path(model_path).name}")
+    return models
 
-    # Find all 101 PNG images
-    png_files = sorted(list(images_dir.glob('*.png')))
-    print(f"Found {len(png_files)} PNG images to process.")
 
-    results = []
-    for png_path in png_files:
-        filename = png_path.name
-        print(f"Processing: {filename}")
+def predict(models, filename, raw_img):
+    """Infected probability, class and raw probabilities of one 2D grayscale image from every model."""
+    # Preprocess exactly as required by DVICE models
+    with profiling.span("dvice_preprocess", image=filename):
+        preprocessed = prep_for_ml(raw_img)
+    # Add batch dimension: (1, 224, 224, 3) uint8 RGB
+    input_batch = np.expand_dims(preprocessed, axis=0)
 
-        # Parse path and id from filename (e.g. EXP_path2_passage4_302.png)
-        # Regex is robust to slight naming variations in the 101-image dataset
-        path_match = re.search(r'path(\d+)', filename, re.IGNORECASE)
-        path_val = int(path_match.group(1)) if path_match else None
+    # Run predictions with all three models
+    model_results = {}
+    for i, model in enumerate(models, start=1):
+        with profiling.span("dvice_predict", image=filename, model=i):
+            pred = model.predict(input_batch, verbose=0)  # shape (1, 2)
+        pred_probs = pred[0]  # [uninfected_prob, infected_prob]
 
-        id_match = re.search(r'_(\d+)\.png$', filename)
-        id_val = int(id_match.group(1)) if id_match else None
+        # Per paper/notebook: binary classification → infected probability is index 1
+        infected_prob = float(pred_probs[1])
+        predicted_class = int(np.argmax(pred_probs))  # 0=uninfected, 1=infected
 
-        if path_val is None or id_val is None:
-            print(f"  Warning: Could not parse path/id from {filename} - skipping")
-            continue
+        model_results[f'model{i}_infected'] = infected_prob
+        model_results[f'model{i}_class'] = predicted_class
+        model_results[f'model{i}_probs'] = pred_probs.tolist()  # raw for debugging
+    return model_results
 
-        # Load raw image (grayscale PNG expected)
-        raw_img = skimage.io.imread(str(png_path))
-        # Ensure 2D grayscale (in case any PNG is RGB)
-        if len(raw_img.shape) == 3:
-            raw_img = skimage.color.rgb2gray(raw_img)
 
-        # Preprocess exactly as required by DVICE models
-        preprocessed = prep_for_ml(raw_img)
-        # Add batch dimension: (1, 224, 224, 3) uint8 RGB
-        input_batch = np.expand_dims(preprocessed, axis=0)
+def main():
+    # Paths (relative to script root folder)
+    root_dir = Path('.')
+    models_dir = root_dir / 'resources'
+    images_dir = root_dir / '..' / 'converted_pngs'
 
-        # Run predictions with all three models
-        model_results = {}
-        for i, model in enumerate(models, start=1):
-            pred = model.predict(input_batch, verbose=0)  # shape (1, 2)
-            pred_probs = pred[0]  # [uninfected_prob, infected_prob]
+    # Verify paths
+    if not models_dir.exists():
+        raise FileNotFoundError(f"Models directory not found: {models_dir}")
+    if not images_dir.exists():
+        raise FileNotFoundError(f"Images directory not found: {images_dir}")
 
-            # Per paper/notebook: binary classification → infected probability is index 1
-            infected_prob = float(pred_probs[1])
-            predicted_class = int(np.argmax(pred_probs))  # 0=uninfected, 1=infected
+    # if you extracted modelX.keras from resources.zip, you need to change the file extension to modelX.h5
+    model_files = ['model1.h5', 'model2.h5', 'model3.h5']
 
-            model_results[f'model{i}_infected'] = infected_prob
-            model_results[f'model{i}_class'] = predicted_class
-            model_results[f'model{i}_probs'] = pred_probs.tolist()  # raw for debugging
+    # Decide which images need predictions: a row is valid while the image bytes and the
+    # model weights / preprocessing it was computed with are unchanged
+    for mf in model_files:
+        if not (models_dir / mf).exists():
+            raise FileNotFoundError(f"Model file not found: {(models_dir / mf).resolve()}")
+    config = config_hash(hash_files(models_dir / mf for mf in model_files), 'prep_for_ml', (224, 224), 'Bi-cubic')
+    manifest = scan(images_dir)
+    hashes = dict(zip(manifest['image'], manifest['sha256']))
+    csv_path = root_dir / 'dvice-results.csv'
+    previous = pd.read_csv(csv_path) if INCREMENTAL and csv_path.exists() else pd.DataFrame(columns=['image'])
+    if 'image' not in previous:  # written before hashes were recorded: everything is re-run
+        previous = pd.DataFrame(columns=['image'])
+    recorded = {
+        row['image']: (row.get('image_sha256'), row.get('config_hash'))
+        for row in previous.astype(object).where(previous.notna(), None).to_dict('records')
+    }
+    plan = pending(image_files(manifest, ('.png',)), hashes, recorded, config)
+    previous = previous[previous['image'].isin(plan.up_to_date)]
+    if len(previous):
+        print(f"{len(previous)} images unchanged since their predictions were made.")
+
+    # Find all 101 PNG images (those that need predictions)
+    png_files = []
+    for filename in plan.run:
+        # Parse path and id from filename (e.g. EXP_path2_passage4_302.png)
+        if parse_image_name(filename) is None:
+            print(f"  Warning: Could not parse path/id from {filename} - skipping")
+            continue
+        png_files.append(filename)
+    print(f"Found {len(png_files)} PNG images to process.")
+
+    cache = ImageCache() if USE_IMAGE_CACHE else None
+
+    def load(filename):
+        # Load raw image (grayscale PNG expected); a cached copy is the same 2D uint8 pixels
+        with profiling.span("decode", image=filename):
+            raw_img = cache.get(filename, sha256=hashes[filename]) if cache is not None else None
+            if raw_img is None:
+                raw_img = skimage.io.imread(str(images_dir / filename))
+            # Ensure 2D grayscale (in case any PNG is RGB)
+            if len(raw_img.shape) == 3:
+                raw_img = skimage.color.rgb2gray(raw_img)
+            return raw_img
 
+    results = []
+    model_paths = [models_dir / mf for mf in model_files]
+    for filename, model_results in run(png_files, load, predict, init=load_models, init_args=(model_paths,),
+                                       processes=WORKERS):
+        print(f"Processed: {filename}")
+        key = parse_image_name(filename)
         # Store row
         row = {
-            'path': path_val,
-            'id': id_val,
-            **model_results
+            'path': key.path,
+            'id': key.id,
+            **model_results,
+            'image': filename,
+            'image_sha256': hashes[filename],
+            'config_hash': config,
         }
         results.append(row)
 
+    # Byte-identical images share one prediction
+    rows = pd.concat([frame for frame in (previous, pd.DataFrame(results)) if len(frame)], ignore_index=True)
+    copies = []
+    for filename, source in plan.copy.items():
+        key = parse_image_name(filename)
+        if key is not None and source in set(rows['image']):
+            copy = rows[rows['image'] == source].iloc[0].copy()
+            copy['path'], copy['id'], copy['image'] = key.path, key.id, filename
+            copies.append(copy)
+
     # Save to CSV (as specified: path, id, <results columns>)
-    df = pd.DataFrame(results)
-    csv_path = root_dir / 'dvice-results.csv'
-    df.to_csv(csv_path, index=False)
+    df = pd.concat([rows, pd.DataFrame(copies)], ignore_index=True).sort_values(['path', 'id'], ignore_index=True)
+    with profiling.span("write", path=csv_path):
+        df.to_csv(csv_path, index=False)
     print(f"\nProcessing complete! Results saved to: {csv_path}")
     print(f"Columns: {list(df.columns)}")
     print(f"Processed {len(results)} images successfully.")
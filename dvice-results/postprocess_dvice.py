@@ -3,47 +3,34 @@
 postprocess_dvice.py
 
 Combines DVICE model results with CRO ground truth for publication-ready table.
-- Loads CRO annotations from ..\cro-results\cro_cpe_detections.csv
-- Creates CRO_CPE = 1 if ANY CRO_* column is 1
+- Takes CRO_CPE (1 if ANY CRO_* column is 1) from the shared ground truth (cpe_common/ground_truth.py)
 - Keeps ONLY images that exist in the CRO file
 - Adds DVICE probabilities, average, and final binary decision
 """
 
+import sys
 import pandas as pd
 from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from cpe_common import ground_truth
+
 DVICE_CPE_THRESHOLD = 0.5
 
 def main():
     # ====================== PATHS ======================
     dvice_csv = Path('dvice-results.csv')
-    cro_csv = Path('..') / 'cro-results' / 'cro_cpe_detections.csv'
     
     if not dvice_csv.exists():
         raise FileNotFoundError(f"❌ dvice-results.csv not found in current folder")
-    if not cro_csv.exists():
-        raise FileNotFoundError(f"❌ cro_cpe_detections.csv not found at {cro_csv}")
 
     # ====================== LOAD DATA ======================
     print("Loading DVICE results...")
     dvice_df = pd.read_csv(dvice_csv)
     
-    print(f"Loading CRO ground truth from {cro_csv}...")
-    cro_df = pd.read_csv(cro_csv)
-
-    # ====================== CREATE CRO_CPE ======================
-    # Identify all CRO_* columns
-    cro_columns = [col for col in cro_df.columns if col.startswith('CRO_')]
-    print(f"Found CRO columns: {cro_columns}")
-    
-    # CRO_CPE = 1 if ANY CRO annotation is positive
-    cro_df['CRO_CPE'] = (cro_df[cro_columns] == 1).any(axis=1).astype(int)
-
-    # Keep only needed columns from CRO
-    cro_clean = cro_df[['path', 'id', 'CRO_CPE']].copy()
-
     # ====================== MERGE & FILTER ======================
-    # Only keep images that have CRO annotations (inner join)
-    merged = pd.merge(cro_clean, dvice_df, on=['path', 'id'], how='inner')
+    # Only keep images that have CRO annotations (inner join on the shared ground truth)
+    merged = ground_truth.attach(dvice_df)
     print(f"✅ Merged: {len(merged)} images (only those with CRO ground truth)")
 
     # ====================== BUILD FINAL PUBLICATION TABLE ======================